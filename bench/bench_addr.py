@@ -0,0 +1,44 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Micro-benchmark for pyptlib.util.parse_addr_spec.
+
+Compares the resolver-based path (getaddrinfo/getnameinfo) against the
+pure-Python fast path, both with a cold and a warm cache.
+
+Usage: python bench/bench_addr.py
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import pyptlib.util as util
+
+SPECS = ["127.0.0.1:9000", "[::1]:9000", "[2001:db8::1]:443", "192.168.0.1:1"]
+NUMBER = 20000
+
+
+def resolver(spec):
+    return util._resolve_addr(*util._split_addr_spec(spec, None, None))
+
+
+def cold(spec):
+    util._ADDR_CACHE.clear()
+    return util.parse_addr_spec(spec)
+
+
+def main():
+    print("%-20s %12s %12s %12s" % ("spec", "resolver", "fast/cold", "fast/warm"))
+    for spec in SPECS:
+        assert resolver(spec) == cold(spec) == util.parse_addr_spec(spec)
+        times = [min(timeit.repeat(lambda: f(spec), number=NUMBER, repeat=3)) / NUMBER * 1e6
+                 for f in (resolver, cold, util.parse_addr_spec)]
+        print("%-20s %10.2fus %10.2fus %10.2fus" % tuple([spec] + times))
+
+
+if __name__ == '__main__':
+    main()
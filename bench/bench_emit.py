@@ -0,0 +1,74 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark the status-line emitter of TransportPlugin.
+
+Compares the default per-line flush against buffered mode, counting the
+number of write(2) syscalls that reach the underlying file descriptor and
+timing a full VERSION / METHOD / DONE announcement.
+
+Usage: python bench/bench_emit.py [num_transports ...]
+"""
+
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from pyptlib.client import ClientTransportPlugin
+from pyptlib.client_config import ClientConfig
+
+ROUNDS = 200
+
+
+class CountingFileIO(io.FileIO):
+    """Raw file that counts the write syscalls made on it."""
+
+    def __init__(self, *args, **kwargs):
+        io.FileIO.__init__(self, *args, **kwargs)
+        self.writes = 0
+
+    def write(self, b):
+        self.writes += 1
+        return io.FileIO.write(self, b)
+
+
+def open_counting_stdout():
+    raw = CountingFileIO(os.devnull, "w")
+    return raw, io.TextIOWrapper(io.BufferedWriter(raw), line_buffering=False)
+
+
+def announce(num_transports, buffered):
+    raw, stdout = open_counting_stdout()
+    names = ["t%d" % i for i in range(num_transports)]
+    plugin = ClientTransportPlugin(
+        config=ClientConfig("/pt_stat", transports=list(names)),
+        stdout=stdout, buffered=buffered)
+    start = time.perf_counter()
+    plugin.init(names)
+    for i, name in enumerate(plugin.getTransports()):
+        plugin.reportMethodSuccess(name, "socks5", ("127.0.0.1", 10000 + i))
+    plugin.reportMethodsEnd()
+    elapsed = time.perf_counter() - start
+    stdout.close()
+    return raw.writes, elapsed
+
+
+def main(argv):
+    sizes = [int(a) for a in argv] or [1, 10, 50, 200]
+    print("%8s %10s %8s %12s" % ("n", "mode", "writes", "usec/round"))
+    for n in sizes:
+        for buffered in (False, True):
+            best = None
+            for _ in range(ROUNDS):
+                writes, elapsed = announce(n, buffered)
+                best = elapsed if best is None else min(best, elapsed)
+            print("%8d %10s %8d %12.1f" % (
+                n, "buffered" if buffered else "per-line", writes, best * 1e6))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
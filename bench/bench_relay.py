@@ -0,0 +1,80 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Throughput benchmark for pyptlib.util.relay over loopback TCP.
+
+Pushes a fixed amount of data through a relay between two loopback
+connections, with os.splice() where supported and with the recv_into()
+fallback, and prints the throughput and CPU time of each.
+
+Usage: python bench/bench_relay.py [megabytes]
+"""
+
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from pyptlib.util import relay
+
+CHUNK = b"\0" * (1 << 20)
+
+
+def tcp_pair():
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1)
+    client = socket.create_connection(listener.getsockname())
+    server, _ = listener.accept()
+    listener.close()
+    return client, server
+
+
+def source(sock, megabytes):
+    for i in range(megabytes):
+        sock.sendall(CHUNK)
+    sock.shutdown(socket.SHUT_WR)
+
+
+def sink(sock):
+    buf = bytearray(1 << 20)
+    while sock.recv_into(buf):
+        pass
+
+
+def run(megabytes, use_splice):
+    peer_a, a = tcp_pair()
+    b, peer_b = tcp_pair()
+    threads = [threading.Thread(target=source, args=(peer_a, megabytes)),
+               threading.Thread(target=sink, args=(peer_b,))]
+    for t in threads:
+        t.start()
+    start, cpu = time.perf_counter(), time.process_time()
+    n = relay.pump(a, b, use_splice=use_splice)
+    elapsed, cpu = time.perf_counter() - start, time.process_time() - cpu
+    for t in threads:
+        t.join()
+    for sock in (peer_a, a, b, peer_b):
+        sock.close()
+    assert n == megabytes * len(CHUNK)
+    return elapsed, cpu
+
+
+def main():
+    megabytes = int(sys.argv[1]) if len(sys.argv) > 1 else 1024
+    modes = [("copy", False)]
+    if relay.SPLICE_SUPPORTED:
+        modes.insert(0, ("splice", True))
+    print("%-8s %10s %10s %12s" % ("mode", "MB/s", "seconds", "cpu seconds"))
+    for name, use_splice in modes:
+        elapsed, cpu = min(run(megabytes, use_splice) for _ in range(3))
+        print("%-8s %10.0f %10.3f %12.3f" % (name, megabytes / elapsed, elapsed, cpu))
+    print("(cpu seconds are for the whole process, including the source and sink)")
+
+
+if __name__ == '__main__':
+    main()
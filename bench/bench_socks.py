@@ -0,0 +1,70 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Connections-per-second benchmark for pyptlib.socks.
+
+Runs a SocksServer whose handler accepts every request, and opens
+connections to it from concurrent clients, each doing a full SOCKS5
+handshake with transport arguments (or a SOCKS4a one). Prints the number
+of completed handshakes per second.
+
+Usage: python bench/bench_socks.py [connections] [concurrency]
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from pyptlib.socks import SocksServer
+
+ARGS = b"cert=AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA;iat-mode=0"
+SOCKS5 = (b"\x05\x01\x02" + bytes([1, len(ARGS)]) + ARGS + b"\x01\0"
+          + b"\x05\x01\x00\x01\xc0\x00\x02\x01\x01\xbb")
+SOCKS5_REPLY = 2 + 2 + 10
+SOCKS4A = b"\x04\x01\x01\xbb\x00\x00\x00\x01" + ARGS + b"\0bridge.example\0"
+SOCKS4A_REPLY = 8
+
+
+async def handle(request):
+    await request.accept()
+
+
+async def client(addrport, count, request, replyLength):
+    for i in range(count):
+        reader, writer = await asyncio.open_connection(*addrport)
+        writer.write(request)
+        await reader.readexactly(replyLength)
+        writer.close()
+        await writer.wait_closed()
+
+
+async def run(connections, concurrency, request, replyLength):
+    server = SocksServer(handle)
+    addrport = await server.start()
+    start = time.perf_counter()
+    await asyncio.gather(*[client(addrport, connections // concurrency, request, replyLength)
+                           for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    server.close()
+    await server.wait_closed()
+    return (connections // concurrency) * concurrency / elapsed
+
+
+def main():
+    connections = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    print("%-8s %12s" % ("protocol", "conns/s"))
+    for name, request, replyLength in [("socks5", SOCKS5, SOCKS5_REPLY),
+                                       ("socks4a", SOCKS4A, SOCKS4A_REPLY)]:
+        rate = max(asyncio.run(run(connections, concurrency, request, replyLength))
+                   for _ in range(3))
+        print("%-8s %12.0f" % (name, rate))
+    print("(client and server share one event loop and one core)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark plugin bootstrap latency, from process exec to METHODS DONE.
+
+Each run spawns bench/startup_plugin.py through pyptlib.util.subproc.Popen
+with a synthetic TOR_PT_* environment, reads the managed-proxy protocol
+stream from its stdout, and collects the per-step timings that the plugin
+reports on stderr. Results are written as JSON, so that runs against
+different versions can be compared with --compare.
+
+Usage: python bench/bench_startup.py [-n RUNS] [-o results.json]
+                                     [--compare baseline.json]
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import pyptlib
+from pyptlib.util.subproc import Popen
+from subprocess import PIPE
+
+PLUGIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "startup_plugin.py")
+SIZES = [1, 10, 200]
+MODES = ["client", "server"]
+
+
+def make_env(mode, num_transports):
+    names = ["t%d" % i for i in range(num_transports)]
+    env = dict((k, v) for k, v in os.environ.items() if not k.startswith("TOR_PT_"))
+    env["TOR_PT_STATE_LOCATION"] = "/tmp/pyptlib-bench-state"
+    env["TOR_PT_MANAGED_TRANSPORT_VER"] = "1"
+    if mode == "client":
+        env["TOR_PT_CLIENT_TRANSPORTS"] = ",".join(names)
+    else:
+        env["TOR_PT_SERVER_TRANSPORTS"] = ",".join(names)
+        env["TOR_PT_SERVER_BINDADDR"] = ",".join(
+            "%s-127.0.0.1:%d" % (name, 20000 + i) for i, name in enumerate(names))
+        env["TOR_PT_ORPORT"] = "127.0.0.1:9001"
+        env["TOR_PT_EXTENDED_SERVER_PORT"] = ""
+        env["TOR_PT_SERVER_TRANSPORT_OPTIONS"] = ";".join(
+            "%s:key=value%d" % (name, i) for i, name in enumerate(names))
+    return env
+
+
+def run_once(mode, num_transports):
+    done = "%sS DONE" % ("CMETHOD" if mode == "client" else "SMETHOD")
+    env = make_env(mode, num_transports)
+    start = time.perf_counter()
+    proc = Popen([sys.executable, PLUGIN, mode], stdout=PIPE, stderr=PIPE,
+                 env=env, universal_newlines=True)
+    lines = 0
+    while True:
+        line = proc.stdout.readline()
+        if not line:
+            raise RuntimeError("plugin exited before %s" % done)
+        lines += 1
+        if line.startswith(done):
+            break
+    elapsed = time.perf_counter() - start
+    _, err = proc.communicate()
+    steps = json.loads(err.strip().splitlines()[-1])
+    if lines != num_transports + 2:
+        raise RuntimeError("expected %d status lines, got %d" % (num_transports + 2, lines))
+    return elapsed, steps
+
+
+def summarise(samples):
+    return {
+        "median_us": statistics.median(samples) * 1e6,
+        "min_us": min(samples) * 1e6,
+        "max_us": max(samples) * 1e6,
+    }
+
+
+def bench(runs):
+    results = {}
+    for mode in MODES:
+        for n in SIZES:
+            totals = []
+            steps = {}
+            for _ in range(runs):
+                elapsed, run_steps = run_once(mode, n)
+                totals.append(elapsed)
+                for k, v in run_steps.items():
+                    steps.setdefault(k, []).append(sum(v))
+            entry = {"exec_to_done": summarise(totals)}
+            for k, v in steps.items():
+                entry[k] = summarise(v)
+            results["%s/%d" % (mode, n)] = entry
+    return results
+
+
+def compare(results, baseline):
+    print("%-12s %-22s %12s %12s %8s" % ("case", "step", "baseline", "current", "ratio"))
+    for case in sorted(results):
+        for step in sorted(results[case]):
+            if step not in baseline.get(case, {}):
+                continue
+            old = baseline[case][step]["median_us"]
+            new = results[case][step]["median_us"]
+            print("%-12s %-22s %12.1f %12.1f %8.2f" % (
+                case, step, old, new, new / old if old else float("inf")))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-n", "--runs", type=int, default=20)
+    parser.add_argument("-o", "--output", help="write JSON results to this file")
+    parser.add_argument("--compare", help="JSON results of a previous run to compare against")
+    args = parser.parse_args(argv)
+
+    report = {
+        "pyptlib_version": pyptlib.__version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "runs": args.runs,
+        "results": bench(args.runs),
+    }
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(report, fp, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write("\n")
+    if args.compare:
+        with open(args.compare) as fp:
+            compare(report["results"], json.load(fp)["results"])
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,51 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark TOR_PT_SERVER_TRANSPORT_OPTIONS parsing on large option strings.
+
+Parses strings of increasing size, made of many options with long
+base64-like values and some escapes, and prints the time per byte, which
+should stay roughly constant if parsing scales linearly.
+
+Usage: python bench/bench_transport_options.py
+"""
+
+import base64
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from pyptlib.server_config import get_transport_options_impl
+
+SIZES_KB = [1, 4, 16, 64, 256]
+
+
+def make_options(size):
+    options = []
+    total = 0
+    i = 0
+    while total < size:
+        cert = base64.b64encode(os.urandom(70)).decode("ascii")
+        option = "obfs4_%d:cert=%s;obfs4_%d:path=C\\:\\\\state\\;%d" % (i % 8, cert, i % 8, i)
+        options.append(option)
+        total += len(option) + 1
+        i += 1
+    return ";".join(options)
+
+
+def main():
+    print("%8s %8s %12s %10s" % ("size", "options", "usec", "ns/byte"))
+    for kb in SIZES_KB:
+        string = make_options(kb * 1024)
+        number = max(1, 2000 // kb)
+        best = min(timeit.repeat(lambda: get_transport_options_impl(string),
+                                 number=number, repeat=5)) / number
+        print("%7dK %8d %12.1f %10.2f" % (
+            kb, string.count(";") + 1, best * 1e6, best * 1e9 / len(string)))
+
+
+if __name__ == '__main__':
+    main()
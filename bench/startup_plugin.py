@@ -0,0 +1,55 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Minimal managed proxy used by bench_startup.py.
+
+Runs the usual pyptlib bootstrap sequence for the mode given in argv[1]
+("client" or "server"), timing each step, and writes the timings as a JSON
+object on the last line of stderr. The protocol stream goes to stdout as
+usual.
+"""
+
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+
+def timed(timings, key, f, *args):
+    start = time.perf_counter()
+    result = f(*args)
+    timings.setdefault(key, []).append(time.perf_counter() - start)
+    return result
+
+
+def main(mode):
+    timings = {}
+    start = time.perf_counter()
+    if mode == "client":
+        from pyptlib.client import ClientTransportPlugin as Plugin
+        names = os.environ["TOR_PT_CLIENT_TRANSPORTS"].split(",")
+    else:
+        from pyptlib.server import ServerTransportPlugin as Plugin
+        names = os.environ["TOR_PT_SERVER_TRANSPORTS"].split(",")
+    timings["import"] = [time.perf_counter() - start]
+
+    plugin = Plugin()
+    plugin.config = timed(timings, "_loadConfigFromEnv", plugin._loadConfigFromEnv)
+    timed(timings, "_declareSupports", plugin._declareSupports, names)
+    for i, name in enumerate(plugin.getTransports()):
+        if mode == "client":
+            timed(timings, "reportMethodSuccess", plugin.reportMethodSuccess,
+                  name, "socks5", ("127.0.0.1", 10000 + i))
+        else:
+            timed(timings, "reportMethodSuccess", plugin.reportMethodSuccess,
+                  name, plugin.config.serverBindAddr[name], None)
+    timed(timings, "reportMethodsEnd", plugin.reportMethodsEnd)
+
+    sys.stderr.write(json.dumps(timings) + "\n")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1])
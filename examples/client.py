@@ -16,18 +16,13 @@ if __name__ == '__main__':
         print("pyptlib could not bootstrap ('%s')." % str(err))
         sys.exit(1)
 
-    for transport in client.getTransports():
-        # Spawn all the transports in the list, and for each spawned
-        # transport report back the port where it is listening, and
-        # the SOCKS version it supports.
-
-        try:
-            socks_version, bind_addrport = your_function_that_launches_transports(transport)
-        except YourFailException as err:
-            reportFailure(transport, "Failed to launch ('%s')." % str(err))
-            continue
-
-        client.reportMethodSuccess(transport, socks_version, bind_addrport, None, None)
-
-    # After spawning our transports, report that we are done.
-    client.reportMethodsEnd()
+    def launch(transport):
+        # Spawn the transport, and return the SOCKS version it supports
+        # and the port where it is listening. Any exception raised here is
+        # reported to Tor as a CMETHOD-ERROR for this transport.
+        socks_version, bind_addrport = your_function_that_launches_transports(transport)
+        return (socks_version, bind_addrport)
+
+    # Launch all the transports in the list concurrently, report back the
+    # result for each in priority order, and then report that we are done.
+    client.launchTransports(launch, timeout=30)
@@ -16,21 +16,18 @@ if __name__ == '__main__':
         print("pyptlib could not bootstrap ('%s')." % str(err))
         sys.exit(1)
 
-    for transport, transport_bindaddr in list(server.getBindAddresses().items()):
+    def launch(transport, transport_bindaddr):
         # Try to spawn transports and make them listen in the ports
-        # that Tor wants. Report failure or success appropriately.
+        # that Tor wants. Any exception raised here is reported to Tor as
+        # an SMETHOD-ERROR for this transport.
 
         # 'transport' is a string with the name of the transport.
         # 'transport_bindaddr' is the (<ip>,<port>) where that
         # transport should listen for connections.
 
-        try:
-            bind_addrport = your_function_that_launches_transports(transport, transport_bindaddr)
-        except YourFailException as err:
-            reportFailure(transport, "Failed to launch ('%s')." % str(err))
-            continue
+        bind_addrport = your_function_that_launches_transports(transport, transport_bindaddr)
+        return (bind_addrport, None)
 
-        server.reportMethodSuccess(transport, bind_addrport, None)
-
-    # Report back after we finish spawning transports.
-    server.reportMethodsEnd()
+    # Launch all transports concurrently, report back the result for each,
+    # and then report back that we finished spawning transports.
+    server.launchTransports(launch, timeout=30)
@@ -0,0 +1,346 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+asyncio-native variants of the public pyptlib API.
+
+These plugins speak exactly the same managed-proxy protocol as
+:class:`pyptlib.client.ClientTransportPlugin` and
+:class:`pyptlib.server.ServerTransportPlugin`, but write their status
+messages through a non-blocking :class:`asyncio.StreamWriter`, so that a
+slow reader on the other end of stdout never blocks the event loop. All the
+report* methods, and init(), are coroutines that wait until the message has
+been handed off to the OS.
+"""
+
+import asyncio
+import os
+
+from pyptlib.client import ClientTransportPlugin
+from pyptlib.server import ServerTransportPlugin
+
+
+class _StatusPipeProtocol(asyncio.Protocol):
+    """
+    Protocol for the write end of the status pipe, providing flow control
+    and close notification.
+    """
+
+    def __init__(self):
+        self._loop = asyncio.get_running_loop()
+        self._paused = False
+        self._lost = False
+        self._exc = None
+        self._drainWaiters = []
+        self._closed = self._loop.create_future()
+
+    def pause_writing(self):
+        self._paused = True
+
+    def resume_writing(self):
+        self._paused = False
+        self._wakeDrainWaiters()
+
+    def connection_lost(self, exc):
+        self._lost = True
+        self._exc = exc
+        self._wakeDrainWaiters()
+        if not self._closed.done():
+            self._closed.set_result(None)
+
+    def _wakeDrainWaiters(self):
+        waiters, self._drainWaiters = self._drainWaiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def drain(self):
+        """
+        Wait until the transport's write buffer is below its high-water mark.
+
+        :raises: :class:`ConnectionResetError` if the pipe was closed.
+        """
+        if self._paused and not self._lost:
+            waiter = self._loop.create_future()
+            self._drainWaiters.append(waiter)
+            await waiter
+        if self._lost:
+            raise self._exc or ConnectionResetError("Status pipe closed")
+
+    async def waitClosed(self):
+        await asyncio.shield(self._closed)
+
+
+class _StatusPipeWriter(object):
+    """
+    Writer for the status pipe, with the parts of the
+    :class:`asyncio.StreamWriter` interface that the plugins use.
+    """
+
+    def __init__(self, transport, protocol):
+        self.transport = transport
+        self._protocol = protocol
+
+    def write(self, data):
+        self.transport.write(data)
+
+    async def drain(self):
+        await self._protocol.drain()
+
+    def is_closing(self):
+        return self.transport.is_closing()
+
+    def close(self):
+        self.transport.close()
+
+    async def wait_closed(self):
+        await self._protocol.waitClosed()
+
+
+class AsyncTransportPluginMixin(object):
+    """
+    Mixin that turns a TransportPlugin into an asyncio-native one.
+
+    Note: you cannot use this directly; either use
+    AsyncClientTransportPlugin() or AsyncServerTransportPlugin().
+
+    :var asyncio.StreamWriter writer: Writer to send status messages to. If
+            not given, one with the same interface is created by
+            :func:`open` on a duplicate of the file descriptor of stdout.
+            Note that this puts the underlying open file into non-blocking
+            mode, which is shared with stdout.
+    """
+
+    def __init__(self, *args, writer=None, **kwargs):
+        super(AsyncTransportPluginMixin, self).__init__(*args, **kwargs)
+        self.writer = writer
+        self._loop = None # loop that the writer belongs to, set by open()
+
+    async def open(self):
+        """
+        Create the non-blocking writer for status messages, if necessary.
+
+        This is called automatically by :func:`init`.
+
+        :raises: :class:`ValueError` if stdout is not a pipe, socket or
+                character device.
+        """
+        loop = asyncio.get_running_loop()
+        self._loop = loop
+        if self.writer is not None:
+            return
+        self.stdout.flush()
+        pipe = os.fdopen(os.dup(self.stdout.fileno()), 'wb', 0)
+        try:
+            transport, protocol = await loop.connect_write_pipe(
+                _StatusPipeProtocol, pipe)
+        except:
+            pipe.close()
+            raise
+        self.writer = _StatusPipeWriter(transport, protocol)
+
+    async def close(self):
+        """
+        Flush any pending messages and close the writer.
+        """
+        if self.writer is None:
+            return
+        self.flush()
+        await self.drain()
+        self.writer.close()
+        await self.writer.wait_closed()
+        self.writer = None
+
+    async def drain(self):
+        """
+        Wait until all messages written so far have been handed to the OS.
+
+        In buffered mode, this does not write out queued messages; use
+        :func:`flush` for that.
+        """
+        await self.writer.drain()
+
+    async def init(self, supported_transports):
+        """
+        Initialise this transport plugin; see
+        :func:`pyptlib.core.TransportPlugin.init`.
+        """
+        await self.open()
+        try:
+            super(AsyncTransportPluginMixin, self).init(supported_transports)
+        finally:
+            await self.drain()
+
+    async def reportMethodError(self, name, message):
+        """
+        See :func:`pyptlib.core.TransportPlugin.reportMethodError`.
+        """
+        super(AsyncTransportPluginMixin, self).reportMethodError(name, message)
+        await self.drain()
+
+    async def reportMethodsEnd(self):
+        """
+        See :func:`pyptlib.core.TransportPlugin.reportMethodsEnd`.
+        """
+        super(AsyncTransportPluginMixin, self).reportMethodsEnd()
+        await self.drain()
+
+    async def reportLog(self, message, severity='notice'):
+        """
+        See :func:`pyptlib.core.TransportPlugin.reportLog`.
+        """
+        super(AsyncTransportPluginMixin, self).reportLog(message, severity)
+        await self.drain()
+
+    async def launchTransports(self, launchers, timeout=None):
+        """
+        Launch all served transports concurrently on the event loop, and
+        report the results; see
+        :func:`pyptlib.core.TransportPlugin.launchTransports`.
+
+        Here, the launchers are coroutine functions. Launches that do not
+        finish within `timeout` seconds are cancelled.
+        """
+        async def launch(args):
+            return await self._getLauncher(launchers, args[0])(*args)
+
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        tasks = [(args, asyncio.ensure_future(launch(args)))
+                 for args in self._getLaunchArgs()]
+        launched = []
+        try:
+            for args, task in tasks:
+                name = args[0]
+                remaining = None
+                if timeout is not None:
+                    remaining = max(start + timeout - loop.time(), 0)
+                try:
+                    result = await asyncio.wait_for(task, remaining)
+                except asyncio.TimeoutError:
+                    await self.reportMethodError(name, "launch timed out after %ss" % timeout)
+                except Exception as e:
+                    await self.reportMethodError(name, "launch failed (%s)" % e)
+                else:
+                    await self.reportMethodSuccess(name, *result)
+                    launched.append(name)
+        finally:
+            for _, task in tasks:
+                task.cancel()
+        await self.reportMethodsEnd()
+        return launched
+
+    def _log(self, message, severity='notice'):
+        # the writer may only be used from its loop, not e.g. from the
+        # thread that signals are dispatched in
+        loop = self._loop
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if loop is None or loop is running:
+            super(AsyncTransportPluginMixin, self)._log(message, severity)
+        else:
+            loop.call_soon_threadsafe(
+                super(AsyncTransportPluginMixin, self)._log, message, severity)
+
+    def _write(self, data):
+        if self.writer is None:
+            raise RuntimeError("status writer not open; call init() or open() first")
+        self.writer.write(data.encode('utf-8'))
+
+
+class AsyncClientTransportPlugin(AsyncTransportPluginMixin, ClientTransportPlugin):
+    """
+    Runtime process for an asyncio client TransportPlugin.
+
+    :var pyptlib.proxy.ProxyConnector proxyConnector: Connector for outgoing
+            connections, through the proxy if one was specified; set by
+            :func:`init`.
+    """
+    proxyConnector = None
+
+    async def init(self, supported_transports, probeProxy=True, probeTarget=None):
+        """
+        Initialise this transport plugin; see
+        :func:`pyptlib.core.TransportPlugin.init`.
+
+        If a proxy was specified, it is then checked with :func:`probeProxy`,
+        and the result reported to Tor.
+
+        http and socks4a proxies can only be checked by connecting to a
+        `probeTarget` through them; without one, they are not probed (see
+        :func:`pyptlib.proxy.ProxyConnector.needsProbeTarget`), and the
+        application must report on them itself, with
+        :func:`reportProxySuccess` or :func:`reportProxyError`, before its
+        first :func:`reportMethodSuccess`.
+
+        :param bool probeProxy: If False, the proxy is not probed, and the
+                application must report on it itself.
+        :param tuple probeTarget: (host,port) to connect to through the
+                proxy when probing it.
+        """
+        await AsyncTransportPluginMixin.init(self, supported_transports)
+        from pyptlib.proxy import ProxyConnector
+        self.proxyConnector = ProxyConnector.fromConfig(self.config)
+        if (probeProxy and self.config.getProxy()
+                and (probeTarget is not None or not self.proxyConnector.needsProbeTarget())):
+            await self.probeProxy(probeTarget)
+
+    async def probeProxy(self, target=None):
+        """
+        Check that the proxy can be used, and report the result with
+        :func:`reportProxySuccess` or :func:`reportProxyError`.
+
+        :param tuple target: (host,port) to connect to through the proxy; see
+                :func:`pyptlib.proxy.ProxyConnector.probe`.
+
+        :returns: bool -- Whether the proxy can be used.
+        :raises: :class:`ValueError` if the proxy needs a `target` to be
+                checked, and none was given. Nothing is reported then.
+        """
+        from pyptlib.proxy import ProxyConnectError
+        try:
+            await self.proxyConnector.probe(target)
+        except (ProxyConnectError, OSError) as e:
+            await self.reportProxyError(str(e))
+            return False
+        except asyncio.TimeoutError:
+            await self.reportProxyError("timed out")
+            return False
+        await self.reportProxySuccess()
+        return True
+
+    async def reportMethodSuccess(self, name, protocol, addrport, args=None, optArgs=None):
+        """
+        See :func:`pyptlib.client.ClientTransportPlugin.reportMethodSuccess`.
+        """
+        ClientTransportPlugin.reportMethodSuccess(self, name, protocol, addrport, args, optArgs)
+        await self.drain()
+
+    async def reportProxySuccess(self):
+        """
+        See :func:`pyptlib.client.ClientTransportPlugin.reportProxySuccess`.
+        """
+        ClientTransportPlugin.reportProxySuccess(self)
+        await self.drain()
+
+    async def reportProxyError(self, msg=None):
+        """
+        See :func:`pyptlib.client.ClientTransportPlugin.reportProxyError`.
+        """
+        ClientTransportPlugin.reportProxyError(self, msg)
+        await self.drain()
+
+
+class AsyncServerTransportPlugin(AsyncTransportPluginMixin, ServerTransportPlugin):
+    """
+    Runtime process for an asyncio server TransportPlugin.
+    """
+
+    async def reportMethodSuccess(self, name, addrport, options):
+        """
+        See :func:`pyptlib.server.ServerTransportPlugin.reportMethodSuccess`.
+        """
+        ServerTransportPlugin.reportMethodSuccess(self, name, addrport, options)
+        await self.drain()
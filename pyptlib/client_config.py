@@ -6,8 +6,6 @@ Low-level parts of pyptlib that are only useful to clients.
 """
 
 from pyptlib.config import Config, ProxyError, get_env
-from pyptlib import util
-from urllib.parse import urlsplit
 
 SUPPORTED_PROXY_SCHEMES = ['http', 'socks4a', 'socks5']
 
@@ -17,6 +15,7 @@ class ClientConfig(Config):
 
     :var urlparse.SplitResult proxy: The proxy that should be used for outgoing connections.  None if no proxy is required.
     """
+    __slots__ = ('proxy',)
 
     @classmethod
     def fromEnv(cls):
@@ -46,7 +45,20 @@ class ClientConfig(Config):
                  transports=None,
                  proxy=None):
         Config.__init__(self, stateLocation, managedTransportVer, transports)
-        self.proxy = proxy
+        self._set(proxy = proxy)
+
+    def _toSnapshot(self):
+        fields = Config._toSnapshot(self)
+        if self.proxy is not None:
+            fields['proxy'] = self.proxy.geturl()
+        return fields
+
+    @classmethod
+    def _fromSnapshot(cls, fields):
+        if fields.get('proxy') is not None:
+            from urllib.parse import urlsplit
+            fields = dict(fields, proxy=urlsplit(fields['proxy'], allow_fragments=False))
+        return super(ClientConfig, cls)._fromSnapshot(fields)
 
     def getProxy(self):
         """
@@ -65,6 +77,10 @@ class ClientConfig(Config):
         return self.proxy
 
 def parseProxyURI(uri_str):
+    # imported here, since most plugins are never given a proxy
+    from urllib.parse import urlsplit
+    from pyptlib import util
+
     try:
         uri = urlsplit(uri_str, allow_fragments=False)
     except Exception as e:
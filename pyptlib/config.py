@@ -19,27 +19,197 @@ def env_has_k(k, v):
     if v is None: raise ValueError('Missing environment variable %s' % k)
     return v
 
+class FrozenDict(object):
+    """
+    An immutable, hashable and picklable read-only dict.
+
+    Supports the read-only part of the dict interface.
+    """
+    __slots__ = ('_d',)
+
+    def __init__(self, *args, **kwargs):
+        object.__setattr__(self, '_d', dict(*args, **kwargs))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("FrozenDict is immutable")
+
+    def __getitem__(self, key):
+        return self._d[key]
+
+    def __contains__(self, key):
+        return key in self._d
+
+    def __iter__(self):
+        return iter(self._d)
+
+    def __len__(self):
+        return len(self._d)
+
+    def get(self, key, default=None):
+        return self._d.get(key, default)
+
+    def keys(self):
+        return self._d.keys()
+
+    def values(self):
+        return self._d.values()
+
+    def items(self):
+        return self._d.items()
+
+    def __eq__(self, other):
+        if isinstance(other, FrozenDict):
+            return self._d == other._d
+        if isinstance(other, dict):
+            return self._d == other
+        return NotImplemented
+
+    def __ne__(self, other):
+        eq = self.__eq__(other)
+        return eq if eq is NotImplemented else not eq
+
+    def __hash__(self):
+        return hash(frozenset(self._d.items()))
+
+    def __repr__(self):
+        return 'FrozenDict(%r)' % (self._d,)
+
+    def __reduce__(self):
+        return (FrozenDict, (self._d,))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+def _restore_config(cls, values):
+    """Unpickle a :class:`Config`; see :func:`Config.__reduce__`."""
+    obj = cls.__new__(cls)
+    for name, value in zip(cls._fields(), values):
+        object.__setattr__(obj, name, value)
+    return obj
+
 class Config(object):
     """
     pyptlib's configuration.
 
+    Configs are immutable, hashable, and cheap to copy and pickle, so they can
+    be shared freely between threads and worker processes, and used as keys.
+
     :var string stateLocation: Location where application should store state.
-    :var list managedTransportVer: List of managed-proxy protocol versions that Tor supports.
-    :var list transports: Strings of pluggable transport names that Tor wants us to handle.
+    :var tuple managedTransportVer: Managed-proxy protocol versions that Tor supports.
+    :var tuple transports: Strings of pluggable transport names that Tor wants us to handle.
     :var bool allTransportsEnabled: True if Tor wants us to spawn all the transports.
     """
+    __slots__ = ('stateLocation', 'managedTransportVer', 'transports', 'allTransportsEnabled')
 
     def __init__(self, stateLocation,
                  managedTransportVer=None,
                  transports=None):
-        self.stateLocation = stateLocation
-        self.managedTransportVer = managedTransportVer or SUPPORTED_TRANSPORT_VERSIONS
-        transports = transports or []
-        self.allTransportsEnabled = False
-        if '*' in transports:
-            self.allTransportsEnabled = True
-            transports.remove('*')
-        self.transports = transports
+        transports = tuple(transports or ())
+        allTransportsEnabled = '*' in transports
+        if allTransportsEnabled:
+            transports = tuple(t for t in transports if t != '*')
+        self._set(
+            stateLocation = stateLocation,
+            managedTransportVer = tuple(managedTransportVer or SUPPORTED_TRANSPORT_VERSIONS),
+            transports = transports,
+            allTransportsEnabled = allTransportsEnabled)
+
+    def _set(self, **fields):
+        """Set fields during construction, bypassing immutability."""
+        for name, value in fields.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("%s is immutable" % self.__class__.__name__)
+
+    def __delattr__(self, name):
+        raise AttributeError("%s is immutable" % self.__class__.__name__)
+
+    @classmethod
+    def _fields(cls):
+        """
+        :returns: tuple -- Names of all the fields of this config class.
+        """
+        fields = cls.__dict__.get('_fields_cache')
+        if fields is None:
+            fields = tuple(name for klass in reversed(cls.__mro__)
+                           for name in klass.__dict__.get('__slots__', ()))
+            cls._fields_cache = fields
+        return fields
+
+    def _values(self):
+        return tuple(getattr(self, name) for name in self._fields())
+
+    def asDict(self):
+        """
+        :returns: dict -- A new dict mapping field names to their values.
+        """
+        return dict(zip(self._fields(), self._values()))
+
+    def __eq__(self, other):
+        if type(self) is not type(other):
+            return NotImplemented
+        return self._values() == other._values()
+
+    def __ne__(self, other):
+        eq = self.__eq__(other)
+        return eq if eq is NotImplemented else not eq
+
+    def __hash__(self):
+        return hash((type(self),) + self._values())
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, ', '.join(
+            '%s=%r' % item for item in zip(self._fields(), self._values())))
+
+    def __reduce__(self):
+        return (_restore_config, (self.__class__, self._values()))
+
+    def replace(self, **fields):
+        """
+        Since configs are immutable, make a changed copy instead.
+
+        :param fields: New values of some fields, in the same form as the
+                config stores them (e.g. tuples and FrozenDicts).
+
+        :returns: A new config of the same class, with `fields` replaced.
+        :raises: :class:`ValueError` if a field does not exist.
+        """
+        unknown = set(fields) - set(self._fields())
+        if unknown:
+            raise ValueError("Unknown config fields (%s)" % ", ".join(sorted(unknown)))
+        values = self.asDict()
+        values.update(fields)
+        obj = self.__class__.__new__(self.__class__)
+        obj._set(**values)
+        return obj
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def _toSnapshot(self):
+        """
+        :returns: dict -- The fields of this config, in a form that can be
+            serialised as JSON; see :mod:`pyptlib.config_cache`.
+        """
+        return self.asDict()
+
+    @classmethod
+    def _fromSnapshot(cls, fields):
+        """
+        Rebuild a config from the output of :func:`_toSnapshot`, without
+        validating it again.
+        """
+        fields = dict(fields)
+        if fields.pop('allTransportsEnabled'):
+            fields['transports'] = list(fields['transports']) + ['*']
+        return cls(**fields)
 
     def getStateLocation(self):
         """
@@ -50,7 +220,7 @@ class Config(object):
 
     def getManagedTransportVersions(self):
         """
-        :returns: list -- The managed-proxy protocol versions that Tor supports.
+        :returns: tuple -- The managed-proxy protocol versions that Tor supports.
         """
 
         return self.managedTransportVer
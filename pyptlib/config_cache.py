@@ -0,0 +1,102 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Persistent snapshots of parsed configs, for fast plugin restarts.
+
+A snapshot stores a validated config in the state location, together with
+a hash of all the TOR_PT_* environment variables it was parsed from. When a
+plugin is restarted with an identical environment, the config is loaded
+from the snapshot instead of being parsed and validated again.
+"""
+
+import os
+
+SNAPSHOT_VERSION = 1
+SNAPSHOT_FILENAME = 'pyptlib-config.json'
+
+def env_key(environ=None):
+    """
+    :returns: str -- A hash of all the TOR_PT_* variables in `environ`,
+        which defaults to os.environ.
+    """
+    import hashlib
+
+    environ = os.environ if environ is None else environ
+    h = hashlib.sha256()
+    for k in sorted(k for k in environ if k.startswith('TOR_PT_')):
+        h.update(('%s=%s\0' % (k, environ[k])).encode('utf-8', 'surrogateescape'))
+    return h.hexdigest()
+
+def snapshot_path(environ=None):
+    """
+    :returns: str -- Path of the snapshot file, or None if the environment
+        does not specify a state location.
+    """
+    environ = os.environ if environ is None else environ
+    stateLocation = environ.get('TOR_PT_STATE_LOCATION')
+    if not stateLocation:
+        return None
+    return os.path.join(stateLocation, SNAPSHOT_FILENAME)
+
+def load(configType, environ=None):
+    """
+    Load a config of type `configType` from its snapshot.
+
+    :returns: :class:`pyptlib.config.Config` -- The config, or None if there
+        is no snapshot that is valid for this environment and config type.
+    """
+    import json
+
+    path = snapshot_path(environ)
+    if path is None:
+        return None
+    try:
+        with open(path) as fp:
+            snapshot = json.load(fp)
+        if (snapshot.get('version') != SNAPSHOT_VERSION
+                or snapshot.get('type') != configType.__name__
+                or snapshot.get('key') != env_key(environ)):
+            return None
+        return configType._fromSnapshot(snapshot['config'])
+    except (OSError, ValueError, TypeError, KeyError, AttributeError):
+        return None
+
+def save(config, environ=None):
+    """
+    Atomically write a snapshot of `config` to the state location.
+
+    Failures are ignored, since a snapshot is only an optimisation.
+
+    :returns: bool -- True if the snapshot was written.
+    """
+    import json
+    import tempfile
+
+    path = snapshot_path(environ)
+    if path is None:
+        return False
+    snapshot = {
+        'version': SNAPSHOT_VERSION,
+        'type': config.__class__.__name__,
+        'key': env_key(environ),
+        'config': config._toSnapshot(),
+    }
+    tmp = None
+    try:
+        dirname = os.path.dirname(path)
+        os.makedirs(dirname, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix='.' + SNAPSHOT_FILENAME, dir=dirname)
+        with os.fdopen(fd, 'w') as fp:
+            json.dump(snapshot, fp, default=dict)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp, path)
+        return True
+    except (OSError, TypeError, ValueError):
+        if tmp is not None:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+        return False
@@ -1,7 +1,11 @@
 import sys
+import time
 
+from pyptlib import config_cache
 from pyptlib.config import EnvError, ProxyError, SUPPORTED_TRANSPORT_VERSIONS
 
+LOG_SEVERITIES = ('error', 'warning', 'notice', 'info', 'debug')
+
 
 class TransportPlugin(object):
     """
@@ -15,15 +19,32 @@ class TransportPlugin(object):
     :var str served_version: Version used by the plugin.
     :var list served_transports: List of transports served by the plugin,
             populated by init().
+    :var bool buffered: If True, status messages are collected in memory and
+            written to stdout in a single write by :func:`flush`, which is
+            called automatically by :func:`reportMethodsEnd` and on fatal
+            errors.
+    :var bool configSnapshot: If True, the config read from the environment
+            is cached in the state location, and reused without validating it
+            again if the plugin is restarted with an identical environment.
+            See :mod:`pyptlib.config_cache`.
+    :var bool tune: If True, :func:`init` also raises the open file limit
+            of this process, and servers read socket options from their
+            transport options; what was applied is reported in LOG
+            messages. See :mod:`pyptlib.tuning`.
     """
     configType = None
     methodName = None
 
-    def __init__(self, config=None, stdout=sys.stdout):
+    def __init__(self, config=None, stdout=sys.stdout, buffered=False, configSnapshot=False,
+                 tune=False):
         self.config = config
         self.stdout = stdout
+        self.buffered = buffered
+        self.configSnapshot = configSnapshot
+        self.tune = tune
         self.served_version = None # set by _declareSupports
         self.served_transports = None # set by _declareSupports
+        self._pending = [] # messages not yet written, if buffered
 
     def init(self, supported_transports):
         """
@@ -46,6 +67,26 @@ class TransportPlugin(object):
         if not self.config:
             self.config = self._loadConfigFromEnv()
         self._declareSupports(supported_transports)
+        if self.tune:
+            self._tune()
+
+    def _tune(self):
+        """
+        Run the tuning stage of :func:`init`; see :attr:`tune`.
+        """
+        from pyptlib import tuning
+        try:
+            limits = tuning.raiseFileLimit()
+        except (OSError, ValueError) as e:
+            self._log("Could not raise the open file limit: %s" % e, 'warning')
+            return
+        if limits is None:
+            return
+        old, new = limits
+        if new != old:
+            self._log("Raised the open file limit from %d to %d" % (old, new))
+        else:
+            self._log("Open file limit is %d" % new, 'info')
 
     def _loadConfigFromEnv(self):
         """
@@ -54,14 +95,23 @@ class TransportPlugin(object):
         :raises: :class:`pyptlib.config.EnvError` if environment was incomplete or corrupted.
                 This also causes an ENV-ERROR line to be output, to inform Tor.
         """
+        if self.configSnapshot:
+            config = config_cache.load(self.configType)
+            if config is not None:
+                return config
         try:
-            return self.configType.fromEnv()
+            config = self.configType.fromEnv()
         except ProxyError as e:
             self.emit('PROXY-ERROR %s' % str(e))
+            self.flush()
             raise EnvError(str(e))
         except EnvError as e:
             self.emit('ENV-ERROR %s' % str(e))
+            self.flush()
             raise e
+        if self.configSnapshot:
+            config_cache.save(config)
+        return config
 
     def _declareSupports(self, transports, versions=None):
         """
@@ -76,6 +126,7 @@ class TransportPlugin(object):
         wanted_versions = [v for v in versions if v in cfg.managedTransportVer]
         if not wanted_versions:
             self.emit('VERSION-ERROR no-version')
+            self.flush()
             raise EnvError("Unsupported managed proxy protocol version (%s)" %
                            cfg.managedTransportVer)
         else:
@@ -99,6 +150,103 @@ class TransportPlugin(object):
             raise ValueError("init not yet called")
         return self.served_transports
 
+    def launchTransports(self, launchers, timeout=None, maxWorkers=None):
+        """
+        Launch all served transports concurrently, and report the results.
+
+        Each launcher is run on a daemon thread. Results are reported in the
+        priority order of :func:`getTransports`, as soon as they are
+        available; a launcher that raises an exception, or that does not
+        finish within `timeout` seconds of being submitted, is reported with
+        :func:`reportMethodError`. Finally, :func:`reportMethodsEnd` is called.
+
+        :param launchers: Either a callable that is called for every transport,
+                or a dict mapping transport names to such callables. The
+                callable is given the name of the transport, plus (for servers)
+                the address where it should bind. It should launch the
+                transport and return a tuple of the remaining arguments to
+                reportMethodSuccess(), e.g. ``(protocol, addrport)`` for
+                clients and ``(addrport, options)`` for servers.
+        :param float timeout: Maximum time in seconds to wait for each launch,
+                or None to wait forever. Timed-out launches are not
+                interrupted, and their results are ignored; as they run on
+                daemon threads, they do not keep the process from exiting.
+        :param int maxWorkers: Maximum number of concurrent launches; defaults
+                to the number of transports.
+
+        :returns: list -- Names of the transports that launched successfully.
+        :raises: :class:`ValueError` if called before :func:`init`.
+        """
+        import threading
+        from concurrent.futures import Future, TimeoutError
+
+        launches = self._getLaunchArgs()
+        jobs = [(args, Future()) for args in launches]
+        pending = list(jobs) # not yet picked up by a thread
+        lock = threading.Lock()
+        def work():
+            while True:
+                with lock:
+                    if not pending:
+                        return
+                    args, future = pending.pop(0)
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    result = self._getLauncher(launchers, args[0])(*args)
+                except BaseException as e:
+                    future.set_exception(e)
+                else:
+                    future.set_result(result)
+        # daemon threads, unlike those of a ThreadPoolExecutor, so that a
+        # launch that never returns does not keep the process from exiting
+        for i in range(min(maxWorkers or len(jobs), len(jobs))):
+            thread = threading.Thread(target=work, name="pyptlib-launch")
+            thread.daemon = True
+            thread.start()
+        try:
+            start = time.monotonic()
+            launched = []
+            for args, future in jobs:
+                name = args[0]
+                remaining = None
+                if timeout is not None:
+                    remaining = max(start + timeout - time.monotonic(), 0)
+                try:
+                    result = future.result(remaining)
+                except TimeoutError:
+                    self.reportMethodError(name, "launch timed out after %ss" % timeout)
+                except Exception as e:
+                    self.reportMethodError(name, "launch failed (%s)" % e)
+                else:
+                    self.reportMethodSuccess(name, *result)
+                    launched.append(name)
+        finally:
+            for _, future in jobs:
+                future.cancel()
+        self.reportMethodsEnd()
+        return launched
+
+    def _getLaunchArgs(self):
+        """
+        :returns: list -- Argument tuples to pass to the launcher for each
+                served transport, in priority order.
+        """
+        return [(name,) for name in self.getTransports()]
+
+    @staticmethod
+    def _getLauncher(launchers, name):
+        """
+        :returns: The callable in `launchers` that launches transport `name`.
+        """
+        if callable(launchers):
+            return launchers
+        launcher = launchers.get(name)
+        if launcher is None:
+            def launcher(*args):
+                raise ValueError("no launcher for %s" % name)
+        return launcher
+
     def reportMethodError(self, name, message):
         """
         Write a message to stdout announcing that we failed to launch a transport.
@@ -115,6 +263,33 @@ class TransportPlugin(object):
         """
 
         self.emit('%sS DONE' % self.methodName)
+        self.flush()
+
+    def reportLog(self, message, severity='notice'):
+        """
+        Write a LOG message to stdout, for Tor to add to its own log.
+
+        The message is written out straight away, even if this plugin is
+        buffered; messages queued by :func:`emit` stay queued.
+
+        :param str message: The message.
+        :param str severity: One of 'error', 'warning', 'notice', 'info' or
+                'debug'.
+
+        :raises: :class:`ValueError` if the severity is not valid.
+        """
+
+        if severity not in LOG_SEVERITIES:
+            raise ValueError("invalid log severity %r" % (severity,))
+        self._write('LOG SEVERITY=%s MESSAGE=%s\n' % (severity, quoteString(message)))
+
+    def _log(self, message, severity='notice'):
+        """
+        Like :func:`reportLog`, but always a plain function, even where
+        reportLog() is a coroutine; for pyptlib's own messages. It may also
+        be called from other threads, e.g. by signal handlers.
+        """
+        TransportPlugin.reportLog(self, message, severity)
 
     def getDebugData(self):
         """
@@ -122,7 +297,7 @@ class TransportPlugin(object):
         The data should only be presented and not processed further.
         """
         d = dict(self.__dict__)
-        d["config"] = dict(self.config.__dict__)
+        d["config"] = self.config.asDict()
         d["__class__"] = self.__class__
         return d
 
@@ -130,9 +305,45 @@ class TransportPlugin(object):
         """
         Announce a message.
 
+        If this plugin is buffered, the message is only queued; it is written
+        out on the next call to :func:`flush`.
+
         :param str msg: A message.
         """
 
-        print(msg, file=self.stdout)
+        if self.buffered:
+            self._pending.append(msg + '\n')
+        else:
+            self._write(msg + '\n')
+
+    def flush(self):
+        """
+        Write out all messages queued by :func:`emit` in a single write.
+
+        This is a no-op if nothing is queued, e.g. if the plugin is not
+        buffered. Applications may call this at any point to announce the
+        messages emitted so far, e.g. before a long-running operation.
+        """
+
+        if self._pending:
+            data = ''.join(self._pending)
+            del self._pending[:]
+            self._write(data)
+
+    def _write(self, data):
+        """
+        Write some already-formatted message data to stdout, and flush it.
+        """
+
+        self.stdout.write(data)
         self.stdout.flush()
 
+
+def quoteString(string):
+    """
+    :returns: str -- `string` as a double-quoted C-style string, with
+            backslash escapes, as used in LOG messages.
+    """
+    escaped = string.replace('\\', '\\\\').replace('"', '\\"')
+    escaped = escaped.replace('\n', '\\n').replace('\r', '\\r').replace('\t', '\\t')
+    return '"%s"' % escaped
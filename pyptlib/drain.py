@@ -0,0 +1,270 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Graceful draining of connections when a transport shuts down.
+
+:func:`pyptlib.util.subproc.auto_killall` terminates all children as soon as
+a shutdown signal arrives, dropping every connection in flight. With a
+:class:`Drain`, shutdown instead goes through a drain phase first: it stops
+accepting on all listeners, lets active connections finish up to a
+deadline while reporting progress to Tor in LOG messages, and only then
+terminates (and if necessary kills) the children with
+:func:`pyptlib.util.subproc.killall`. While draining, supervisors do not
+restart children that exit.
+
+A typical server does::
+
+    drain = Drain(deadline=60)
+    drain.addListener(server)
+
+    async def handle(reader, writer):
+        with drain.track():
+            ... # relay the connection
+
+    subproc.dispatch_signals_in_loop()
+    autoDrain(drain, plugin)
+
+The handlers installed by :func:`autoDrain` wait for connections to finish,
+so signals should be dispatched with
+:func:`pyptlib.util.subproc.dispatch_signals_in_loop` or
+:func:`pyptlib.util.subproc.dispatch_signals_in_thread`; otherwise they
+block the main thread, and any connections relayed by it, for the whole
+deadline.
+
+Transports running in child processes should drain in each child in the
+same way, and the parent should then give :func:`autoDrain` a `wait_s` of
+at least the children's deadline.
+"""
+
+import atexit
+import contextlib
+import inspect
+import threading
+import time
+
+from pyptlib.util import subproc
+
+
+class Drain(object):
+    """
+    Tracks active connections and listeners, for draining them on shutdown.
+
+    Connections may be tracked from any thread, and from asyncio code.
+
+    :var float deadline: Maximum time in seconds to wait for active
+            connections to finish.
+    :var float progressInterval: Time in seconds between progress reports.
+    :var bool draining: Whether the drain has started.
+    :var list listeners: Objects with a close() method, closed to stop
+            accepting new connections when the drain starts.
+    """
+
+    def __init__(self, deadline=30, progressInterval=5, clock=time.monotonic):
+        self.deadline = deadline
+        self.progressInterval = progressInterval
+        self.draining = False
+        self.listeners = []
+        self._clock = clock
+        self._active = 0
+        self._cond = threading.Condition()
+        self._waiters = [] # (loop, future) of waitAsync() calls
+
+    def addListener(self, listener):
+        """
+        Add a listener to close when the drain starts, e.g. a listening
+        socket, an :class:`asyncio.Server` or a
+        :class:`pyptlib.socks.SocksServer`. If the drain already started, the
+        listener is closed straight away.
+        """
+        with self._cond:
+            if not self.draining:
+                self.listeners.append(listener)
+                return
+        _close(listener)
+
+    @contextlib.contextmanager
+    def track(self):
+        """
+        Context manager that counts a connection as active while it runs.
+        """
+        with self._cond:
+            self._active += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active -= 1
+                if self._active == 0:
+                    self._cond.notify_all()
+                    for loop, future in self._waiters:
+                        loop.call_soon_threadsafe(_setDone, future)
+
+    def active(self):
+        """
+        :returns: int -- The number of active connections.
+        """
+        return self._active
+
+    def start(self):
+        """
+        Start draining: close all listeners, and stop supervisors from
+        restarting children.
+
+        :returns: bool -- False if the drain had already started.
+        """
+        with self._cond:
+            if self.draining:
+                return False
+            self.draining = True
+            listeners, self.listeners = self.listeners, []
+        subproc.start_draining()
+        for listener in listeners:
+            _close(listener)
+        return True
+
+    def wait(self, report=None):
+        """
+        Wait until no connections are active, or the deadline expires.
+
+        :param report: Called as ``report(active, remaining)`` every
+                progressInterval seconds while connections are active, with
+                the number of active connections and the seconds left.
+
+        :returns: int -- The number of connections still active.
+        """
+        start = self._clock()
+        end = start + self.deadline
+        nextReport = start + self.progressInterval
+        with self._cond:
+            while self._active:
+                now = self._clock()
+                if now >= end:
+                    break
+                if report is not None and now >= nextReport:
+                    report(self._active, end - now)
+                    nextReport = now + self.progressInterval
+                self._cond.wait(min(end, nextReport) - now)
+            return self._active
+
+    async def waitAsync(self, report=None):
+        """
+        Like :func:`wait`, but waits in the running asyncio event loop. Here,
+        `report` may also be a coroutine function.
+        """
+        import asyncio
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        end = start + self.deadline
+        nextReport = start + self.progressInterval
+        while self._active:
+            now = loop.time()
+            if now >= end:
+                break
+            if report is not None and now >= nextReport:
+                result = report(self._active, end - now)
+                if inspect.isawaitable(result):
+                    await result
+                nextReport = now + self.progressInterval
+            future = loop.create_future()
+            with self._cond:
+                if not self._active:
+                    break
+                self._waiters.append((loop, future))
+            try:
+                await asyncio.wait([future], timeout=min(end, nextReport) - now)
+            finally:
+                with self._cond:
+                    self._waiters.remove((loop, future))
+        return self._active
+
+
+def shutdown(drain, plugin=None, cleanup=lambda: None, wait_s=16):
+    """
+    Drain connections, then terminate all children with
+    :func:`pyptlib.util.subproc.killall`.
+
+    :param Drain drain: The drain to run.
+    :param plugin: A TransportPlugin to report progress to in LOG messages,
+            or None. This may also be an asyncio plugin from
+            :mod:`pyptlib.aio`, whose messages are then written from its
+            event loop.
+    :param cleanup, wait_s: See :func:`pyptlib.util.subproc.killall`.
+    """
+    if not drain.start():
+        return
+    log = _logger(plugin and plugin._log)
+    log(_startMessage(drain))
+    remaining = drain.wait(lambda active, left: log(_progressMessage(active, left)))
+    log(*_endMessage(remaining))
+    subproc.killall(cleanup, wait_s)
+
+async def shutdownAsync(drain, plugin=None, cleanup=lambda: None, wait_s=16):
+    """
+    Like :func:`shutdown`, but waits in the running asyncio event loop, and
+    uses :func:`pyptlib.util.subproc.killall_async`. The plugin may be a
+    :class:`pyptlib.aio.AsyncServerTransportPlugin`.
+    """
+    if not drain.start():
+        return
+    log = _logger(plugin and plugin.reportLog)
+    await _maybeAwait(log(_startMessage(drain)))
+    remaining = await drain.waitAsync(
+        lambda active, left: log(_progressMessage(active, left)))
+    await _maybeAwait(log(*_endMessage(remaining)))
+    await subproc.killall_async(cleanup, wait_s)
+
+def autoDrain(drain, plugin=None, ignoreNumSigInts=0, cleanup=lambda: None, wait_s=16):
+    """
+    Like :func:`pyptlib.util.subproc.auto_killall`, but drain connections
+    with :func:`shutdown` on an INT or TERM signal. Use this instead of
+    auto_killall().
+
+    If signals are dispatched in an asyncio event loop, :func:`shutdownAsync`
+    is used instead. On normal exit, children are terminated without
+    draining.
+
+    :param int ignoreNumSigInts: Number of INT signals to ignore before
+            shutting down.
+    """
+    def handler(signum, sframe):
+        if subproc._dispatch_loop is not None:
+            subproc._dispatch_loop.create_task(
+                shutdownAsync(drain, plugin, cleanup, wait_s))
+        else:
+            shutdown(drain, plugin, cleanup, wait_s)
+    subproc.trap_sigint(handler, ignoreNumSigInts)
+    subproc.trap_sigterm(handler)
+    atexit.register(subproc.killall, cleanup, wait_s)
+
+
+def _close(listener):
+    try:
+        listener.close()
+    except OSError:
+        pass
+
+def _setDone(future):
+    if not future.done():
+        future.set_result(None)
+
+async def _maybeAwait(result):
+    if inspect.isawaitable(result):
+        await result
+
+def _logger(log):
+    if log is None:
+        return lambda message, severity='notice': None
+    return log
+
+def _startMessage(drain):
+    return ("Shutting down: draining %d connections, for up to %ss"
+            % (drain.active(), drain.deadline))
+
+def _progressMessage(active, left):
+    return "Draining: %d connections still active, %.0fs left" % (active, left)
+
+def _endMessage(remaining):
+    if remaining:
+        return ("Drain deadline reached, closing %d connections" % remaining, 'warning')
+    return ("All connections drained",)
@@ -0,0 +1,308 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Client for Tor's Extended ORPort.
+
+A server transport that relays to the Extended ORPort, rather than to the
+plain ORPort, must authenticate with the SafeCookie scheme, and then tell
+Tor the address of the client and the name of the transport. See
+ext-orport-spec.txt in torspec.
+
+:class:`ExtORPortClient` loads and validates the auth cookie once, and
+keeps a small pool of connections that have already been authenticated, so
+that a new client connection only costs the round trip of its commands.
+"""
+
+import collections
+import hashlib
+import hmac
+import os
+import select
+import socket
+import threading
+import time
+
+AUTH_COOKIE_HEADER = b"! Extended ORPort Auth Cookie !\x0a"
+AUTH_COOKIE_LENGTH = 32
+AUTH_NONCE_LENGTH = 32
+
+AUTH_TYPE_SAFE_COOKIE = 0x01
+SERVER_HASH_HEADER = b"ExtORPort authentication server-to-client hash"
+CLIENT_HASH_HEADER = b"ExtORPort authentication client-to-server hash"
+
+CMD_DONE = 0x0000
+CMD_USERADDR = 0x0001
+CMD_TRANSPORT = 0x0002
+REPLY_OKAY = 0x1000
+REPLY_DENY = 0x1001
+
+
+class ExtORPortError(Exception):
+    """
+    Thrown when the Extended ORPort rejects us, or violates the protocol.
+    """
+    pass
+
+
+class ExtORPortClient(object):
+    """
+    Connects to the Extended ORPort on behalf of client connections.
+
+    This is safe to use from several threads.
+
+    :var tuple extendedORPort: (ip,port) of the Extended ORPort.
+    :var bytes cookie: The auth cookie.
+    :var int poolSize: Number of authenticated connections to keep ready.
+    :var float timeout: Timeout in seconds of socket operations while
+            connecting and authenticating.
+    :var float maxIdle: Pooled connections older than this many seconds are
+            discarded instead of used.
+    """
+
+    def __init__(self, extendedORPort, cookie, poolSize=4, timeout=10, maxIdle=60,
+                 clock=time.monotonic):
+        if len(cookie) != AUTH_COOKIE_LENGTH:
+            raise ValueError("Auth cookie must be %d bytes" % AUTH_COOKIE_LENGTH)
+        self.extendedORPort = tuple(extendedORPort)
+        self.cookie = cookie
+        self.poolSize = poolSize
+        self.timeout = timeout
+        self.maxIdle = maxIdle
+        self._clock = clock
+        self._pool = collections.deque() # (time authenticated, socket)
+        self._lock = threading.Lock()
+        self._filling = False
+        self._closed = False
+
+    @classmethod
+    def fromConfig(cls, config, **kwargs):
+        """
+        :param pyptlib.server_config.ServerConfig config: Config from Tor.
+        :param kwargs: Passed to the constructor.
+
+        :returns: :class:`ExtORPortClient` -- A client for the Extended
+                ORPort in `config`.
+        :raises: :class:`ValueError` if `config` has no Extended ORPort, or
+                its auth cookie file is invalid; :class:`OSError` if the auth
+                cookie file could not be read.
+        """
+        if not config.getExtendedORPort() or not config.getAuthCookieFile():
+            raise ValueError("Extended ORPort is not supported by this Tor")
+        return cls(config.getExtendedORPort(),
+                   loadAuthCookie(config.getAuthCookieFile()), **kwargs)
+
+    def connect(self, addrport, transport):
+        """
+        Get a connection to the Extended ORPort, for a client connection.
+
+        :param tuple addrport: (ip,port) of the client, or None if unknown.
+        :param str transport: Name of the transport, or None.
+
+        :returns: socket -- A blocking socket, ready to carry OR traffic.
+        :raises: :class:`ExtORPortError` if Tor denied the connection, or
+                :class:`OSError` if the connection failed.
+        """
+        sock = self._take() or self._open()
+        try:
+            sock.sendall(encodeCommands(addrport, transport))
+            readReply(sock)
+            sock.settimeout(None)
+        except:
+            sock.close()
+            raise
+        finally:
+            self.refill()
+        return sock
+
+    def fill(self):
+        """
+        Open and authenticate connections until the pool is full.
+
+        This blocks; see :func:`refill` to do it in the background.
+        """
+        while not self._closed:
+            with self._lock:
+                if len(self._pool) >= self.poolSize:
+                    return
+            sock = self._open()
+            with self._lock:
+                if self._closed:
+                    sock.close()
+                    return
+                self._pool.append((self._clock(), sock))
+
+    def refill(self):
+        """
+        Fill the pool in a background thread, unless that is already happening.
+        """
+        with self._lock:
+            if self._filling or self._closed or len(self._pool) >= self.poolSize:
+                return
+            self._filling = True
+        t = threading.Thread(target=self._refill, name="pyptlib-extorport")
+        t.daemon = True
+        t.start()
+
+    def close(self):
+        """
+        Close all pooled connections, and stop refilling the pool.
+        """
+        with self._lock:
+            self._closed = True
+            pool = list(self._pool)
+            self._pool.clear()
+        for _, sock in pool:
+            sock.close()
+
+    def _refill(self):
+        try:
+            self.fill()
+        except (OSError, ExtORPortError):
+            pass # connect() will report it, when it tries for itself
+        finally:
+            with self._lock:
+                self._filling = False
+
+    def _take(self):
+        """
+        :returns: socket -- A usable pooled connection, or None.
+        """
+        while True:
+            with self._lock:
+                if not self._pool:
+                    return None
+                since, sock = self._pool.popleft()
+            if self._clock() - since <= self.maxIdle and isIdle(sock):
+                return sock
+            sock.close()
+
+    def _open(self):
+        """
+        :returns: socket -- A new authenticated connection.
+        """
+        sock = socket.create_connection(self.extendedORPort, self.timeout)
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            authenticate(sock, self.cookie)
+        except:
+            sock.close()
+            raise
+        return sock
+
+
+def loadAuthCookie(path):
+    """
+    Load and validate the auth cookie from an auth cookie file.
+
+    :returns: bytes -- The auth cookie.
+    :raises: :class:`ValueError` if the file is not a valid auth cookie
+            file, or :class:`OSError` if it could not be read.
+    """
+    with open(path, 'rb') as f:
+        data = f.read(len(AUTH_COOKIE_HEADER) + AUTH_COOKIE_LENGTH + 1)
+    if (len(data) != len(AUTH_COOKIE_HEADER) + AUTH_COOKIE_LENGTH
+            or not data.startswith(AUTH_COOKIE_HEADER)):
+        raise ValueError("Invalid auth cookie file (%s)" % path)
+    return data[len(AUTH_COOKIE_HEADER):]
+
+def authenticate(sock, cookie, clientNonce=None):
+    """
+    Authenticate to the Extended ORPort with the SafeCookie scheme.
+
+    Our auth type and nonce are sent without waiting for the list of auth
+    types that Tor offers, to save a round trip.
+
+    :raises: :class:`ExtORPortError` if authentication failed.
+    """
+    if clientNonce is None:
+        clientNonce = os.urandom(AUTH_NONCE_LENGTH)
+    sock.sendall(bytes([AUTH_TYPE_SAFE_COOKIE]) + clientNonce)
+
+    authTypes = set()
+    while True:
+        authType = recvExactly(sock, 1)[0]
+        if authType == 0:
+            break
+        authTypes.add(authType)
+    if AUTH_TYPE_SAFE_COOKIE not in authTypes:
+        raise ExtORPortError("SafeCookie authentication not offered")
+
+    reply = recvExactly(sock, 32 + AUTH_NONCE_LENGTH)
+    serverHash, serverNonce = reply[:32], reply[32:]
+    expected = authHash(cookie, SERVER_HASH_HEADER, clientNonce, serverNonce)
+    if not hmac.compare_digest(serverHash, expected):
+        raise ExtORPortError("Server hash does not match auth cookie")
+    sock.sendall(authHash(cookie, CLIENT_HASH_HEADER, clientNonce, serverNonce))
+    if recvExactly(sock, 1) != b"\x01":
+        raise ExtORPortError("Authentication rejected")
+
+def authHash(cookie, header, clientNonce, serverNonce):
+    """
+    :returns: bytes -- HMAC-SHA256 of `header` and the nonces, keyed by `cookie`.
+    """
+    return hmac.new(cookie, header + clientNonce + serverNonce, hashlib.sha256).digest()
+
+def encodeCommand(command, body=b""):
+    """
+    :returns: bytes -- An Extended ORPort command with the given body.
+    """
+    return command.to_bytes(2, 'big') + len(body).to_bytes(2, 'big') + body
+
+def encodeCommands(addrport, transport):
+    """
+    :returns: bytes -- USERADDR and TRANSPORT commands for the given client
+            address and transport (if any), followed by DONE.
+    """
+    data = b""
+    if addrport is not None:
+        addr, port = addrport
+        if ':' in addr:
+            addr = '[%s]' % addr
+        data += encodeCommand(CMD_USERADDR, ('%s:%d' % (addr, port)).encode('ascii'))
+    if transport is not None:
+        data += encodeCommand(CMD_TRANSPORT, transport.encode('ascii'))
+    return data + encodeCommand(CMD_DONE)
+
+def readReply(sock):
+    """
+    Read Tor's reply to our commands.
+
+    :raises: :class:`ExtORPortError` if Tor denied the connection.
+    """
+    header = recvExactly(sock, 4)
+    reply = int.from_bytes(header[:2], 'big')
+    recvExactly(sock, int.from_bytes(header[2:], 'big'))
+    if reply == REPLY_DENY:
+        raise ExtORPortError("Connection denied by Tor")
+    if reply != REPLY_OKAY:
+        raise ExtORPortError("Unexpected reply 0x%04x" % reply)
+
+def recvExactly(sock, n):
+    """
+    :returns: bytes -- Exactly `n` bytes read from `sock`.
+    :raises: :class:`ExtORPortError` if the connection was closed first.
+    """
+    data = b""
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            raise ExtORPortError("Connection closed by Extended ORPort")
+        data += chunk
+    return data
+
+def isIdle(sock):
+    """
+    :returns: bool -- Whether `sock` has nothing to read, i.e. it was neither
+            closed by the peer nor sent anything unexpected.
+    """
+    try:
+        if hasattr(select, 'poll'):
+            # select() is limited to fds below FD_SETSIZE on Unix
+            poller = select.poll()
+            poller.register(sock, select.POLLIN)
+            return not poller.poll(0)
+        readable, _, _ = select.select([sock], [], [], 0)
+    except (OSError, ValueError):
+        return False
+    return not readable
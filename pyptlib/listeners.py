@@ -0,0 +1,181 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Pre-bound listening sockets, handed to child processes.
+
+A :class:`ListenerSet` binds and listens on the bind addresses of all
+server transports up front, so that bind failures are known before
+anything is reported to Tor, and so that child processes don't each have
+to bind their own sockets. Children launched with
+:func:`pyptlib.util.subproc.Popen` inherit the sockets via ``pass_fds``,
+and find them with :func:`adoptListeners`, using the map of transport
+names to fds in the PYPTLIB_LISTEN_FDS environment variable.
+
+A typical server does::
+
+    listeners = ListenerSet()
+    listeners.bind(server.getBindAddresses())
+    for name in listeners.sockets:
+        subproc.Popen(['my-transport', name], **listeners.popenArgs([name]))
+    listeners.report(server)
+"""
+
+import os
+import socket
+
+LISTEN_FDS_ENV = 'PYPTLIB_LISTEN_FDS'
+
+# (level, option, value) set on every listener before binding. On Linux,
+# TCP_NODELAY is inherited by accepted connections.
+DEFAULT_OPTIONS = [
+    (socket.SOL_SOCKET, socket.SO_REUSEADDR, 1),
+    (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),
+]
+
+
+class ListenerSet(object):
+    """
+    Listening sockets for a set of server transports.
+
+    :var int backlog: Backlog of each listener.
+    :var list options: (level, option, value) socket options set on each
+            listener before binding.
+    :var dict sockets: Names of transports mapped to their listening socket.
+    :var dict errors: Names of transports mapped to the reason why they could
+            not be bound.
+    """
+
+    def __init__(self, backlog=socket.SOMAXCONN, options=None):
+        self.backlog = backlog
+        self.options = DEFAULT_OPTIONS if options is None else options
+        self.sockets = {}
+        self.errors = {}
+
+    def bind(self, bindaddrs, tuning=None):
+        """
+        Bind and listen on the address of every transport.
+
+        Failures are recorded in :attr:`errors` rather than raised, so that
+        they can be reported to Tor by :func:`report`.
+
+        :param dict bindaddrs: Names of transports mapped to the (addr,port)
+                where they should listen, e.g. from
+                :func:`pyptlib.server.ServerTransportPlugin.getBindAddresses`.
+        :param dict tuning: Names of transports mapped to a
+                :class:`pyptlib.tuning.SocketTuning` whose listener options
+                to set as well, e.g.
+                :attr:`pyptlib.server.ServerTransportPlugin.socketTuning`.
+
+        :returns: dict -- Names of the transports that were bound, mapped to
+                the (addr,port) where they are listening.
+        """
+        tuning = tuning or {}
+        for name, addrport in bindaddrs.items():
+            options = self.options
+            if name in tuning:
+                options = list(options) + tuning[name].listenerOptions()
+            try:
+                self.sockets[name] = listen(addrport, self.backlog, options)
+            except (OSError, ValueError) as e:
+                self.errors[name] = "could not listen on %s:%s (%s)" % (
+                    addrport[0], addrport[1], e)
+        return self.addresses()
+
+    def addresses(self):
+        """
+        :returns: dict -- Names of the bound transports, mapped to the
+                (addr,port) where they are listening.
+        """
+        return dict((name, sock.getsockname()[:2])
+                    for name, sock in self.sockets.items())
+
+    def popenArgs(self, names=None, env=None):
+        """
+        Keyword arguments for subproc.Popen, that hand listeners to the child.
+
+        :param list names: Names of the transports whose listeners to hand
+                over; defaults to all of them.
+        :param dict env: Environment of the child; defaults to os.environ.
+
+        :returns: dict -- with ``pass_fds`` and ``env`` keys.
+        """
+        if names is None:
+            names = sorted(self.sockets)
+        fds = [(name, self.sockets[name].fileno()) for name in names]
+        env = dict(os.environ if env is None else env)
+        env[LISTEN_FDS_ENV] = ",".join("%s=%d" % (name, fd) for name, fd in fds)
+        return {'pass_fds': tuple(fd for _, fd in fds), 'env': env}
+
+    def report(self, plugin, options=None):
+        """
+        Report every listener to Tor, then report the end of the launch.
+
+        Call this only after the children serving the listeners were
+        started, so that Tor is not told about a transport before it can
+        accept connections.
+
+        :param pyptlib.server.ServerTransportPlugin plugin: Plugin to report to.
+        :param dict options: Names of transports mapped to the options string
+                to pass to reportMethodSuccess().
+        """
+        options = options or {}
+        addresses = self.addresses()
+        for name in plugin.getTransports():
+            if name in addresses:
+                plugin.reportMethodSuccess(name, addresses[name], options.get(name))
+            elif name in self.errors:
+                plugin.reportMethodError(name, self.errors[name])
+        plugin.reportMethodsEnd()
+
+    def close(self):
+        """
+        Close the listeners in this process. Children keep their copies.
+        """
+        for sock in self.sockets.values():
+            sock.close()
+        self.sockets.clear()
+
+
+def listen(addrport, backlog=socket.SOMAXCONN, options=DEFAULT_OPTIONS):
+    """
+    :returns: socket -- A TCP socket listening on `addrport`.
+    :raises: :class:`OSError` if the socket could not be bound.
+    """
+    family = socket.AF_INET6 if ':' in addrport[0] else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    try:
+        for level, option, value in options:
+            sock.setsockopt(level, option, value)
+        sock.bind(tuple(addrport))
+        sock.listen(backlog)
+    except:
+        sock.close()
+        raise
+    return sock
+
+def adoptListeners(environ=None):
+    """
+    Get the listening sockets handed to this process by a :class:`ListenerSet`.
+
+    :param dict environ: Environment to read from; defaults to os.environ.
+
+    :returns: dict -- Names of transports mapped to their listening socket;
+            empty if no listeners were handed to this process.
+    :raises: :class:`ValueError` if the fd map is malformed, or one of its
+            fds is not a socket.
+    """
+    environ = os.environ if environ is None else environ
+    spec = environ.get(LISTEN_FDS_ENV)
+    if not spec:
+        return {}
+    listeners = {}
+    for item in spec.split(","):
+        name, sep, fd = item.partition("=")
+        if not sep or not name or not fd.isdigit():
+            raise ValueError("Invalid %s entry (%s)" % (LISTEN_FDS_ENV, item))
+        try:
+            listeners[name] = socket.socket(fileno=int(fd))
+        except OSError as e:
+            raise ValueError("Invalid listener for %s (%s)" % (name, e))
+    return listeners
@@ -0,0 +1,338 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Asynchronous outbound connections through the proxy from TOR_PT_PROXY.
+
+:class:`ProxyConnector` makes connections to bridges through the http
+(CONNECT), socks4a or socks5 proxy given by
+:func:`pyptlib.client_config.ClientConfig.getProxy`, with authentication if
+the proxy URI has a username or password, or directly if no proxy is set.
+
+Round trips are saved where the protocol allows: the SOCKS5 greeting,
+authentication and request are sent in a single write, and for SOCKS the
+first payload bytes of the connection are sent along with the request. A
+small pool of connections to the proxy, already authenticated for SOCKS5,
+is kept ready for new connections.
+"""
+
+import asyncio
+import base64
+import collections
+import socket
+import time
+
+
+class ProxyConnectError(Exception):
+    """
+    Thrown when the proxy refuses a connection, or violates its protocol.
+    """
+    pass
+
+
+class ProxyConnector(object):
+    """
+    Makes outbound connections, through a proxy if one is configured.
+
+    A ProxyConnector may only be used from one event loop at a time.
+
+    :var urllib.parse.SplitResult proxy: The proxy, or None to connect
+            directly.
+    :var int poolSize: Number of connections to the proxy to keep ready.
+    :var float timeout: Timeout in seconds for connecting to the proxy and
+            completing its handshake.
+    :var float maxIdle: Pooled connections older than this many seconds are
+            discarded instead of used.
+    """
+
+    def __init__(self, proxy=None, poolSize=2, timeout=30, maxIdle=30, clock=time.monotonic):
+        self.proxy = proxy
+        self.poolSize = poolSize if proxy is not None else 0
+        self.timeout = timeout
+        self.maxIdle = maxIdle
+        self._clock = clock
+        self._pool = collections.deque() # (time opened, reader, writer)
+        self._filling = None # task filling the pool
+
+    @classmethod
+    def fromConfig(cls, config, **kwargs):
+        """
+        :param pyptlib.client_config.ClientConfig config: Config from Tor.
+        :param kwargs: Passed to the constructor.
+
+        :returns: :class:`ProxyConnector` -- A connector for the proxy in
+                `config`.
+        """
+        return cls(config.getProxy(), **kwargs)
+
+    async def connect(self, host, port, payload=b""):
+        """
+        Connect to `host`:`port`, through the proxy if there is one.
+
+        :param str host: Address or hostname to connect to. Hostnames are
+                resolved by the proxy.
+        :param int port: Port to connect to.
+        :param bytes payload: First bytes to send on the connection. For
+                SOCKS proxies, these are sent together with the request.
+
+        :returns: tuple -- (reader, writer) asyncio streams of the connection.
+        :raises: :class:`ProxyConnectError` if the proxy refused the
+                connection, :class:`OSError` if the proxy could not be
+                reached, or :class:`asyncio.TimeoutError`.
+        """
+        if self.proxy is None:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(host, port), self.timeout)
+            if payload:
+                writer.write(payload)
+            return reader, writer
+
+        conn = self._take()
+        try:
+            if conn is None:
+                reader, writer = await asyncio.wait_for(self._openProxy(), self.timeout)
+                prepared = False
+            else:
+                reader, writer = conn
+                prepared = True
+            try:
+                await asyncio.wait_for(self._request(
+                    reader, writer, host, port, payload, prepared), self.timeout)
+            except:
+                writer.close()
+                raise
+        finally:
+            self.refill()
+        return reader, writer
+
+    def needsProbeTarget(self):
+        """
+        :returns: bool -- Whether :func:`probe` needs a target to check the
+                proxy. http and socks4a proxies only answer a request for a
+                connection, so connecting to them proves nothing.
+        """
+        return self.proxy is not None and self.proxy.scheme != 'socks5'
+
+    async def probe(self, target=None):
+        """
+        Check that the proxy is reachable, and accepts our credentials.
+
+        With a `target`, a full connection to it is made and closed. Without
+        one, this connects to a SOCKS5 proxy and authenticates; the
+        connection is then kept in the pool.
+
+        :param tuple target: (host,port) to connect to through the proxy.
+                Required if :func:`needsProbeTarget`.
+
+        :raises: :class:`ValueError` if a target is required but missing;
+                otherwise see :func:`connect`.
+        """
+        if target is not None:
+            reader, writer = await self.connect(*target)
+            writer.close()
+            return
+        if self.proxy is None:
+            return
+        if self.needsProbeTarget():
+            raise ValueError("Probing a %s proxy needs a target" % self.proxy.scheme)
+        reader, writer = await asyncio.wait_for(self._prepare(), self.timeout)
+        if len(self._pool) < self.poolSize:
+            self._pool.append((self._clock(), reader, writer))
+        else:
+            writer.close()
+
+    def refill(self):
+        """
+        Fill the pool in a background task, unless that is already happening.
+        """
+        if self._filling is not None or len(self._pool) >= self.poolSize:
+            return
+        self._filling = asyncio.get_running_loop().create_task(self._refill())
+
+    async def close(self):
+        """
+        Close all pooled connections, and stop refilling the pool.
+        """
+        self.poolSize = 0
+        if self._filling is not None:
+            self._filling.cancel()
+            try:
+                await self._filling
+            except asyncio.CancelledError:
+                pass
+        while self._pool:
+            _, reader, writer = self._pool.popleft()
+            writer.close()
+
+    async def _refill(self):
+        try:
+            while len(self._pool) < self.poolSize:
+                reader, writer = await asyncio.wait_for(self._prepare(), self.timeout)
+                self._pool.append((self._clock(), reader, writer))
+        except (ProxyConnectError, OSError, asyncio.TimeoutError):
+            pass # connect() will report it, when it tries for itself
+        finally:
+            self._filling = None
+
+    def _take(self):
+        """
+        :returns: tuple -- (reader, writer) of a usable pooled connection, or None.
+        """
+        while self._pool:
+            since, reader, writer = self._pool.popleft()
+            if (self._clock() - since <= self.maxIdle
+                    and not reader.at_eof() and not writer.is_closing()):
+                return reader, writer
+            writer.close()
+        return None
+
+    async def _openProxy(self):
+        reader, writer = await asyncio.open_connection(self.proxy.hostname, self.proxy.port)
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return reader, writer
+
+    async def _prepare(self):
+        """
+        Open a connection to the proxy, and for SOCKS5 authenticate, ready
+        for a request.
+        """
+        reader, writer = await self._openProxy()
+        try:
+            if self.proxy.scheme == 'socks5':
+                writer.write(socks5Greeting(self.proxy))
+                await readSocks5Greeting(reader, self.proxy)
+        except:
+            writer.close()
+            raise
+        return reader, writer
+
+    async def _request(self, reader, writer, host, port, payload, prepared):
+        scheme = self.proxy.scheme
+        if scheme == 'http':
+            writer.write(httpConnectRequest(self.proxy, host, port))
+            await readHttpConnectReply(reader)
+            if payload:
+                writer.write(payload)
+        elif scheme == 'socks4a':
+            writer.write(socks4aRequest(self.proxy, host, port) + payload)
+            await readSocks4aReply(reader)
+        elif scheme == 'socks5':
+            greeting = b"" if prepared else socks5Greeting(self.proxy)
+            writer.write(greeting + socks5Request(host, port) + payload)
+            if not prepared:
+                await readSocks5Greeting(reader, self.proxy)
+            await readSocks5Reply(reader)
+        else:
+            raise ProxyConnectError("Unsupported proxy scheme (%s)" % scheme)
+
+
+def formatHostPort(host, port):
+    """
+    :returns: str -- `host`:`port`, with IPv6 addresses in brackets.
+    """
+    if ':' in host:
+        host = '[%s]' % host
+    return '%s:%d' % (host, port)
+
+def httpConnectRequest(proxy, host, port):
+    """
+    :returns: bytes -- An HTTP CONNECT request for `host`:`port`.
+    """
+    target = formatHostPort(host, port)
+    lines = ["CONNECT %s HTTP/1.1" % target, "Host: %s" % target]
+    if proxy.username is not None:
+        credentials = "%s:%s" % (proxy.username, proxy.password or "")
+        lines.append("Proxy-Authorization: Basic %s"
+                     % base64.b64encode(credentials.encode('utf-8')).decode('ascii'))
+    return ("\r\n".join(lines) + "\r\n\r\n").encode('utf-8')
+
+async def readHttpConnectReply(reader):
+    try:
+        reply = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.LimitOverrunError:
+        raise ProxyConnectError("HTTP proxy reply too long")
+    except asyncio.IncompleteReadError:
+        raise ProxyConnectError("HTTP proxy closed the connection")
+    status = reply.split(b"\r\n", 1)[0].decode('latin-1')
+    fields = status.split(None, 2)
+    if len(fields) < 2 or not fields[0].startswith("HTTP/") or fields[1] != "200":
+        raise ProxyConnectError("HTTP proxy replied %s" % status)
+
+def socks4aRequest(proxy, host, port):
+    """
+    :returns: bytes -- A SOCKS4a CONNECT request for `host`:`port`.
+    """
+    userid = (proxy.username or "").encode('utf-8') + b"\0"
+    try:
+        ip, hostname = socket.inet_pton(socket.AF_INET, host), b""
+    except OSError:
+        ip, hostname = b"\0\0\0\x01", host.encode('idna') + b"\0"
+    return b"\x04\x01" + port.to_bytes(2, 'big') + ip + userid + hostname
+
+async def readSocks4aReply(reader):
+    reply = await _readExactly(reader, 8)
+    if reply[1] != 0x5a:
+        raise ProxyConnectError("SOCKS4a proxy rejected the request (0x%02x)" % reply[1])
+
+def socks5Greeting(proxy):
+    """
+    :returns: bytes -- A SOCKS5 greeting offering only the auth method we
+            will use, followed by our credentials if any. Since only one
+            method is offered, the credentials can be sent without waiting
+            for the proxy to choose it.
+    """
+    if proxy.username is None:
+        return b"\x05\x01\x00"
+    username = proxy.username.encode('utf-8')
+    password = (proxy.password or "").encode('utf-8')
+    return (b"\x05\x01\x02\x01" + bytes([len(username)]) + username
+            + bytes([len(password)]) + password)
+
+async def readSocks5Greeting(reader, proxy):
+    method = 0 if proxy.username is None else 2
+    reply = await _readExactly(reader, 2)
+    if reply[0] != 5 or reply[1] != method:
+        raise ProxyConnectError("SOCKS5 proxy does not accept our authentication method")
+    if method == 2:
+        status = await _readExactly(reader, 2)
+        if status[1] != 0:
+            raise ProxyConnectError("SOCKS5 proxy rejected our credentials")
+
+def socks5Request(host, port):
+    """
+    :returns: bytes -- A SOCKS5 CONNECT request for `host`:`port`.
+    """
+    for family, atyp in ((socket.AF_INET, 1), (socket.AF_INET6, 4)):
+        try:
+            addr = bytes([atyp]) + socket.inet_pton(family, host)
+            break
+        except OSError:
+            pass
+    else:
+        hostname = host.encode('idna')
+        addr = b"\x03" + bytes([len(hostname)]) + hostname
+    return b"\x05\x01\x00" + addr + port.to_bytes(2, 'big')
+
+async def readSocks5Reply(reader):
+    version, reply, _, atyp = await _readExactly(reader, 4)
+    if version != 5:
+        raise ProxyConnectError("SOCKS5 proxy sent an invalid reply")
+    if reply != 0:
+        raise ProxyConnectError("SOCKS5 proxy rejected the request (0x%02x)" % reply)
+    if atyp == 1:
+        length = 4
+    elif atyp == 4:
+        length = 16
+    elif atyp == 3:
+        length = (await _readExactly(reader, 1))[0]
+    else:
+        raise ProxyConnectError("SOCKS5 proxy sent an invalid address type")
+    await _readExactly(reader, length + 2)
+
+async def _readExactly(reader, n):
+    try:
+        return await reader.readexactly(n)
+    except asyncio.IncompleteReadError:
+        raise ProxyConnectError("Proxy closed the connection")
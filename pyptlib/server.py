@@ -5,17 +5,34 @@
 Public server-side pyptlib API.
 """
 
+import os
+
+from pyptlib.config import FrozenDict
 from pyptlib.core import TransportPlugin
-from pyptlib.server_config import ServerConfig
+from pyptlib.server_config import ServerConfig, freezeTransportOptions, get_transport_options_impl
+
+# File in the state location that reloadOptions() reads the server transport
+# options from, in the format of TOR_PT_SERVER_TRANSPORT_OPTIONS.
+TRANSPORT_OPTIONS_FILENAME = 'server_transport_options'
 
 
 class ServerTransportPlugin(TransportPlugin):
     """
     Runtime process for a server TransportPlugin.
+
+    :var dict socketTuning: Names of transports mapped to the
+            :class:`pyptlib.tuning.SocketTuning` read from their options by
+            :func:`init`, if this plugin was created with ``tune=True``;
+            e.g. to pass to :func:`pyptlib.listeners.ListenerSet.bind`.
     """
     configType = ServerConfig
     methodName = 'SMETHOD'
 
+    def __init__(self, *args, **kwargs):
+        super(ServerTransportPlugin, self).__init__(*args, **kwargs)
+        self._reloadCallbacks = {} # transport name -> [callback]
+        self.socketTuning = {} # transport name -> SocketTuning, set if tuned
+
     def reportMethodSuccess(self, name, addrport, options):
         """
         Write a message to stdout announcing that a server transport was
@@ -32,6 +49,7 @@ class ServerTransportPlugin(TransportPlugin):
         if options:
             extra = " ARGS:%s" % options
         elif self.config.serverTransportOptions:
+            from pyptlib.tuning import isTuningKey
             optlist = []
 
             # self.config.serverTransportOptions looks like this:
@@ -41,7 +59,8 @@ class ServerTransportPlugin(TransportPlugin):
                     continue
 
                 for k, v in list(options_dict.items()):
-                    optlist.append("%s=%s" % (k,v))
+                    if not isTuningKey(k):
+                        optlist.append("%s=%s" % (escapeArg(k), escapeArg(v)))
             extra = " ARGS:%s" % (",".join(optlist))
 
         self.emit('SMETHOD %s %s:%s%s' % (name, addrport[0], addrport[1], extra))
@@ -56,6 +75,108 @@ class ServerTransportPlugin(TransportPlugin):
                     for k, v in self.config.serverBindAddr.items()
                     if k in self.getTransports())
 
+    def _tune(self):
+        super(ServerTransportPlugin, self)._tune()
+        from pyptlib.tuning import SocketTuning
+        options = self.config.serverTransportOptions or {}
+        for name in self.getTransports():
+            try:
+                tuning = SocketTuning.fromOptions(options.get(name))
+            except ValueError as e:
+                self._log("Ignoring socket options of %s: %s" % (name, e), 'warning')
+                continue
+            self.socketTuning[name] = tuning
+            if tuning:
+                self._log("Socket options configured for %s: %s" % (name, tuning.describe()))
+            if tuning.unsupported:
+                self._log("Socket options for %s not supported here: %s"
+                          % (name, ", ".join(tuning.unsupported)), 'warning')
+
+    def addReloadCallback(self, name, callback):
+        """
+        Register a callback for changes to the options of a live transport,
+        made by :func:`reloadOptions`.
+
+        :param str name: Name of the transport.
+        :param callback: Called as ``callback(name, options, oldOptions)``,
+                with the new and old options of the transport, as (possibly
+                empty) FrozenDicts.
+        """
+        self._reloadCallbacks.setdefault(name, []).append(callback)
+
+    def getTransportOptionsPath(self):
+        """
+        :returns: str -- Path of the file that :func:`reloadOptions` reads.
+        """
+        return os.path.join(self.config.getStateLocation(), TRANSPORT_OPTIONS_FILENAME)
+
+    def reloadOptions(self, optionsString=None):
+        """
+        Re-read the server transport options, and push the changes to live
+        transports through their reload callbacks. Listeners are not touched,
+        and callbacks are only called for transports whose options changed.
+
+        :param str optionsString: The new options, in the format of
+                TOR_PT_SERVER_TRANSPORT_OPTIONS. By default, they are read
+                from the file at :func:`getTransportOptionsPath`.
+
+        :returns: list -- Names of the transports whose options changed.
+        :raises: :class:`ValueError` if the options are malformed, or
+                :class:`OSError` if the file could not be read. The config
+                is unchanged in that case.
+        """
+        if optionsString is None:
+            with open(self.getTransportOptionsPath()) as f:
+                optionsString = f.read()
+        optionsString = optionsString.strip()
+        options = freezeTransportOptions(
+            get_transport_options_impl(optionsString) if optionsString else {})
+        oldOptions = self.config.serverTransportOptions or FrozenDict()
+        changed = sorted(name for name in set(oldOptions) | set(options)
+                         if oldOptions.get(name, FrozenDict()) != options.get(name, FrozenDict()))
+        self.config = self.config.replace(serverTransportOptions=options)
+        for name in changed:
+            for callback in self._reloadCallbacks.get(name, []):
+                try:
+                    callback(name, options.get(name, FrozenDict()),
+                             oldOptions.get(name, FrozenDict()))
+                except Exception as e:
+                    self._log("Could not apply new options of %s: %s" % (name, e), 'error')
+        return changed
+
+    def autoReload(self):
+        """
+        Call :func:`reloadOptions` on every HUP signal (Unix only), and report
+        the result to Tor in LOG messages.
+
+        The reload runs wherever trapped signals are dispatched; see
+        :func:`pyptlib.util.subproc.dispatch_signals_in_thread` and
+        :func:`pyptlib.util.subproc.dispatch_signals_in_loop`.
+        """
+        from pyptlib.util import subproc
+        subproc.trap_sighup(lambda signum, sframe: self._reloadOnSignal())
+
+    def _reloadOnSignal(self):
+        try:
+            changed = self.reloadOptions()
+        except (OSError, ValueError) as e:
+            self._log("Could not reload server transport options: %s" % e, 'warning')
+            return
+        self._log("Reloaded server transport options; changed: %s"
+                  % (", ".join(changed) or "none"))
+
+    def _getLaunchArgs(self):
+        bindaddrs = self.config.serverBindAddr
+        return [(name, bindaddrs[name]) for name in self.getTransports()
+                if name in bindaddrs]
+
+
+def escapeArg(string):
+    """
+    :returns: str -- `string` with backslash, ',' and '=' backslash-escaped,
+            as required for keys and values in the ARGS of SMETHOD lines.
+    """
+    return string.replace('\\', '\\\\').replace(',', '\\,').replace('=', '\\=')
 
 def init(supported_transports):
     """DEPRECATED. Use ServerTransportPlugin().init() instead."""
@@ -13,29 +13,81 @@ from pyptlib.config import env_has_k, get_env, SUPPORTED_TRANSPORT_VERSIONS
 def get_transport_options_impl(string):
     """
     Parse transport options.
+
+    The string is parsed in a single pass. As in the PT spec, any character
+    may be escaped with a backslash, e.g. '\\;', '\\:', '\\=' or '\\\\'. The first
+    unescaped ':' of an option ends the transport name, and the first
+    unescaped '=' after that ends the key; any later ':' or '=' is part of
+    the value, so that e.g. base64 padding needs no escaping.
+
     :param str optstring: Example input: 'scramblesuit:k=v;scramblesuit:k2=v2;obs3fs:k=v'
     :returns: {'obfs3': {'k':'v'}, 'scramblesuit': {'k2' : 'v2', 'k' : 'v'} }
+    :raises: :class:`ValueError` if the string is malformed.
     """
-    transport_args = {}
+    import re
 
-    params = string.split(';')
-    for param in params:
-        try:
-            (name, kv_string) = param.split(':')
-        except ValueError:
-            raise ValueError("Invalid options string (%s)" % param)
+    special = re.compile(r'[\\:;=]')
+    transport_args = {}
 
-        if name not in transport_args:
-            transport_args[name] = {}
+    end = len(string)
+    name = key = None
+    param_start = kv_start = start = pos = 0
+    chunks = [] # unescaped pieces of the current token, if it has escapes
+    while True:
+        m = special.search(string, pos)
+        if m is None:
+            i, c = end, ';'
+        else:
+            i = m.start()
+            c = string[i]
+
+        if c == '\\':
+            if i + 1 == end:
+                raise ValueError("Trailing backslash (%s)" % string[param_start:])
+            chunks.append(string[start:i])
+            chunks.append(string[i + 1])
+            start = pos = i + 2
+        elif c == ':' and name is None:
+            chunks.append(string[start:i])
+            name = ''.join(chunks)
+            chunks = []
+            kv_start = start = pos = i + 1
+        elif c == '=' and name is not None and key is None:
+            chunks.append(string[start:i])
+            key = ''.join(chunks)
+            chunks = []
+            start = pos = i + 1
+        elif c == ';':
+            if name is None:
+                raise ValueError("Invalid options string (%s)" % string[param_start:i])
+            if key is None:
+                raise ValueError("Not a k=v value (%s)" % string[kv_start:i])
+            chunks.append(string[start:i])
+            options = transport_args.get(name)
+            if options is None:
+                options = transport_args[name] = {}
+            options[key] = ''.join(chunks)
+            if m is None:
+                break
+            name = key = None
+            chunks = []
+            param_start = start = pos = i + 1
+        else:
+            # a literal ':' or '=' that is part of the current token
+            pos = i + 1
 
-        try:
-            (key, value) = kv_string.split('=')
-        except ValueError:
-            raise ValueError("Not a k=v value (%s)" % kv_string)
+    return transport_args
 
-        transport_args[name][key] = value
+def freezeTransportOptions(options):
+    """
+    :param dict options: Options of each transport, as returned by
+            :func:`get_transport_options_impl`, or None.
 
-    return transport_args
+    :returns: FrozenDict -- The same options, as nested FrozenDicts.
+    """
+    if options is None:
+        return None
+    return config.FrozenDict((k, config.FrozenDict(v)) for k, v in options.items())
 
 class ServerConfig(config.Config):
     """
@@ -43,11 +95,13 @@ class ServerConfig(config.Config):
 
     :var tuple ORPort: (ip,port) pointing to Tor's ORPort.
     :var tuple extendedORPort: (ip,port) pointing to Tor's Extended ORPort. None if Extended ORPort is not supported.
-    :var dict serverBindAddr: A dictionary {<transport> : [<addr>, <port>]}, where <transport> is the name of the transport that must be spawned, and [<addr>, <port>] is a list containing the location where that transport should bind. The dictionary can be empty.
+    :var FrozenDict serverBindAddr: A read-only dictionary {<transport> : (<addr>, <port>)}, where <transport> is the name of the transport that must be spawned, and (<addr>, <port>) is a tuple containing the location where that transport should bind. The dictionary can be empty.
     :var string authCookieFile: String representing the filesystem path where the Extended ORPort Authentication cookie is stored. None if Extended ORPort authentication is not supported.
-    :var dict serverTransportOptions: Dictionary containing user-provided parameters that must be passed to the pluggable transports.
+    :var FrozenDict serverTransportOptions: Read-only dictionary containing user-provided parameters that must be passed to the pluggable transports.
         Example: {'obfs3': {'k':'v'}, 'scramblesuit': {'k2' : 'v2', 'k' : 'v'} }
     """
+    __slots__ = ('serverBindAddr', 'ORPort', 'extendedORPort', 'authCookieFile',
+                 'serverTransportOptions')
 
     @classmethod
     def fromEnv(cls):
@@ -131,11 +185,23 @@ class ServerConfig(config.Config):
         config.Config.__init__(self, stateLocation,
             managedTransportVer or SUPPORTED_TRANSPORT_VERSIONS,
             transports or [])
-        self.serverBindAddr = serverBindAddr or {}
-        self.ORPort = ORPort
-        self.extendedORPort = extendedORPort
-        self.authCookieFile = authCookieFile
-        self.serverTransportOptions = serverTransportOptions
+        self._set(
+            serverBindAddr = config.FrozenDict(
+                (k, tuple(v)) for k, v in (serverBindAddr or {}).items()),
+            ORPort = tuple(ORPort) if ORPort is not None else None,
+            extendedORPort = tuple(extendedORPort) if extendedORPort is not None else None,
+            authCookieFile = authCookieFile,
+            serverTransportOptions = freezeTransportOptions(serverTransportOptions))
+
+    def replace(self, **fields):
+        """
+        See :func:`pyptlib.config.Config.replace`. serverTransportOptions may
+        also be given as nested plain dicts.
+        """
+        if 'serverTransportOptions' in fields:
+            fields['serverTransportOptions'] = freezeTransportOptions(
+                fields['serverTransportOptions'])
+        return config.Config.replace(self, **fields)
 
     def getExtendedORPort(self):
         """
@@ -0,0 +1,345 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Asynchronous SOCKS4a/SOCKS5 server, for client transports.
+
+Tor connects to a client transport through SOCKS, and passes the
+per-bridge arguments of the transport in the SOCKS authentication fields:
+the user ID for SOCKS4, and the concatenated username and password for
+SOCKS5, as ``k=v;k=v`` with backslash escapes.
+
+:class:`SocksServer` does the SOCKS handshake, including parsing those
+arguments, and passes each request to a transport callback as a
+:class:`SocksRequest`. The callback connects to the bridge, and then
+accepts or rejects the request::
+
+    async def handle(request):
+        bridge = await connectToBridge(request.host, request.port, request.args)
+        reader, writer = await request.accept()
+        await relay(reader, writer, bridge)
+
+    server = SocksServer(handle)
+    await server.launch(client, 'rot13')
+"""
+
+import asyncio
+import inspect
+import socket
+
+SOCKS4_VERSION = 4
+SOCKS5_VERSION = 5
+CMD_CONNECT = 1
+
+SOCKS5_AUTH_NONE = 0
+SOCKS5_AUTH_USERPASS = 2
+SOCKS5_AUTH_NO_ACCEPTABLE = 0xff
+SOCKS5_ATYP_IPV4 = 1
+SOCKS5_ATYP_DOMAIN = 3
+SOCKS5_ATYP_IPV6 = 4
+
+# SOCKS5 reply codes; SOCKS4 only distinguishes success from failure.
+SUCCEEDED = 0
+GENERAL_FAILURE = 1
+NOT_ALLOWED = 2
+NETWORK_UNREACHABLE = 3
+HOST_UNREACHABLE = 4
+CONNECTION_REFUSED = 5
+TTL_EXPIRED = 6
+COMMAND_NOT_SUPPORTED = 7
+ADDRESS_TYPE_NOT_SUPPORTED = 8
+
+SOCKS4_GRANTED = 0x5a
+SOCKS4_REJECTED = 0x5b
+
+
+class SocksError(Exception):
+    """
+    Thrown when a SOCKS client violates the protocol, or makes a request
+    that we do not support.
+    """
+    pass
+
+
+class SocksRequest(object):
+    """
+    A parsed SOCKS CONNECT request, waiting to be accepted or rejected.
+
+    :var int version: SOCKS version of the request, 4 or 5.
+    :var str host: Address or hostname to connect to.
+    :var int port: Port to connect to.
+    :var dict args: Per-connection transport arguments.
+    :var asyncio.StreamReader reader: Stream from the SOCKS client.
+    :var asyncio.StreamWriter writer: Stream to the SOCKS client.
+    :var bool replied: Whether the request was accepted or rejected.
+    """
+
+    def __init__(self, version, host, port, args, reader, writer):
+        self.version = version
+        self.host = host
+        self.port = port
+        self.args = args
+        self.reader = reader
+        self.writer = writer
+        self.replied = False
+
+    async def accept(self, bindaddr=('0.0.0.0', 0)):
+        """
+        Tell the SOCKS client that the connection succeeded.
+
+        :param tuple bindaddr: (addr,port) to report as our end of the
+                outgoing connection.
+
+        :returns: tuple -- (reader, writer) streams of the SOCKS client, to
+                relay the connection with.
+        """
+        await self._reply(SUCCEEDED, bindaddr)
+        return self.reader, self.writer
+
+    async def reject(self, reply=GENERAL_FAILURE):
+        """
+        Tell the SOCKS client that the connection failed.
+
+        :param int reply: SOCKS5 reply code giving the reason.
+        """
+        await self._reply(reply, ('0.0.0.0', 0))
+
+    async def _reply(self, reply, bindaddr):
+        if self.replied:
+            raise RuntimeError("SOCKS request already replied to")
+        self.replied = True
+        self.writer.write(encodeReply(self.version, reply, bindaddr))
+        await self.writer.drain()
+
+    def __repr__(self):
+        return "<SocksRequest socks%d %s:%d>" % (self.version, self.host, self.port)
+
+
+class SocksServer(object):
+    """
+    SOCKS4a/SOCKS5 server that passes requests to a transport callback.
+
+    :var handler: Coroutine function called as ``handler(request)`` with each
+            :class:`SocksRequest`. It should accept or reject the request; if
+            it returns without doing either, or raises an exception, the
+            request is rejected. The connection is closed once it returns.
+            Exceptions other than connection errors are passed to the event
+            loop's exception handler.
+    :var float handshakeTimeout: Maximum time in seconds for a SOCKS client
+            to complete its request.
+    :var tuple addrport: (addr,port) where the server listens, once started.
+    """
+
+    def __init__(self, handler, handshakeTimeout=30):
+        self.handler = handler
+        self.handshakeTimeout = handshakeTimeout
+        self.addrport = None
+        self._server = None
+
+    async def start(self, addrport=('127.0.0.1', 0), **kwargs):
+        """
+        Start listening for SOCKS clients.
+
+        :param tuple addrport: (addr,port) to listen on.
+        :param kwargs: Passed to asyncio.start_server().
+
+        :returns: tuple -- (addr,port) where the server listens.
+        """
+        self._server = await asyncio.start_server(
+            self._handle, addrport[0], addrport[1], **kwargs)
+        self.addrport = self._server.sockets[0].getsockname()[:2]
+        return self.addrport
+
+    async def launch(self, plugin, name, addrport=('127.0.0.1', 0), **kwargs):
+        """
+        Start listening, and report the CMETHOD line for transport `name`.
+
+        :param plugin: A :class:`pyptlib.client.ClientTransportPlugin`, or a
+                :class:`pyptlib.aio.AsyncClientTransportPlugin`.
+        :param str name: Name of the transport.
+
+        :returns: tuple -- (addr,port) where the server listens.
+        """
+        addrport = await self.start(addrport, **kwargs)
+        result = plugin.reportMethodSuccess(name, 'socks5', addrport)
+        if inspect.isawaitable(result):
+            await result
+        return addrport
+
+    def close(self):
+        """
+        Stop listening. Connections already accepted are not affected.
+        """
+        if self._server is not None:
+            self._server.close()
+
+    async def wait_closed(self):
+        if self._server is not None:
+            await self._server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        try:
+            try:
+                request = await asyncio.wait_for(
+                    readRequest(reader, writer), self.handshakeTimeout)
+            except (SocksError, asyncio.IncompleteReadError, asyncio.TimeoutError, OSError):
+                return
+            try:
+                await self.handler(request)
+            except ConnectionError:
+                pass # the client or the target went away
+            except Exception as e:
+                asyncio.get_running_loop().call_exception_handler({
+                    'message': "SOCKS handler failed for %s:%s" % (request.host, request.port),
+                    'exception': e,
+                })
+            finally:
+                if not request.replied:
+                    await request.reject()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+
+async def readRequest(reader, writer):
+    """
+    Read a SOCKS request, doing any SOCKS5 authentication on the way.
+
+    :returns: :class:`SocksRequest` -- The request.
+    :raises: :class:`SocksError` if the request is invalid or unsupported;
+            the client is told so first, where the protocol allows.
+    """
+    version = (await reader.readexactly(1))[0]
+    if version == SOCKS5_VERSION:
+        return await _readSocks5Request(reader, writer)
+    elif version == SOCKS4_VERSION:
+        return await _readSocks4Request(reader, writer)
+    raise SocksError("Unknown SOCKS version %d" % version)
+
+async def _readSocks4Request(reader, writer):
+    header = await reader.readexactly(7)
+    command, port, ip = header[0], int.from_bytes(header[1:3], 'big'), header[3:]
+    userid = (await reader.readuntil(b'\0'))[:-1]
+    if ip[:3] == b'\0\0\0' and ip[3] != 0:
+        # SOCKS4a: the hostname follows
+        host = (await reader.readuntil(b'\0'))[:-1].decode('ascii', 'replace')
+    else:
+        host = socket.inet_ntop(socket.AF_INET, ip)
+    try:
+        if command != CMD_CONNECT:
+            raise SocksError("Unsupported SOCKS command %d" % command)
+        args = _decodeArgs(userid)
+    except SocksError:
+        writer.write(encodeReply(SOCKS4_VERSION, GENERAL_FAILURE, ('0.0.0.0', 0)))
+        raise
+    return SocksRequest(SOCKS4_VERSION, host, port, args, reader, writer)
+
+async def _readSocks5Request(reader, writer):
+    methods = await reader.readexactly((await reader.readexactly(1))[0])
+    if SOCKS5_AUTH_USERPASS in methods:
+        writer.write(bytes([SOCKS5_VERSION, SOCKS5_AUTH_USERPASS]))
+        # RFC 1929 username/password subnegotiation
+        authVersion, ulen = await reader.readexactly(2)
+        username = await reader.readexactly(ulen)
+        password = await reader.readexactly((await reader.readexactly(1))[0])
+        # a lone NUL password means the arguments fit in the username
+        raw = username if password == b'\0' else username + password
+        try:
+            if authVersion != 1:
+                raise SocksError("Unknown authentication version %d" % authVersion)
+            args = _decodeArgs(raw)
+        except SocksError:
+            writer.write(b'\x01\x01')
+            raise
+        writer.write(b'\x01\x00')
+    elif SOCKS5_AUTH_NONE in methods:
+        writer.write(bytes([SOCKS5_VERSION, SOCKS5_AUTH_NONE]))
+        args = {}
+    else:
+        writer.write(bytes([SOCKS5_VERSION, SOCKS5_AUTH_NO_ACCEPTABLE]))
+        raise SocksError("No acceptable authentication method")
+
+    version, command, _, atyp = await reader.readexactly(4)
+    if atyp == SOCKS5_ATYP_IPV4:
+        host = socket.inet_ntop(socket.AF_INET, await reader.readexactly(4))
+    elif atyp == SOCKS5_ATYP_IPV6:
+        host = socket.inet_ntop(socket.AF_INET6, await reader.readexactly(16))
+    elif atyp == SOCKS5_ATYP_DOMAIN:
+        host = await reader.readexactly((await reader.readexactly(1))[0])
+        host = host.decode('ascii', 'replace')
+    else:
+        writer.write(encodeReply(SOCKS5_VERSION, ADDRESS_TYPE_NOT_SUPPORTED, ('0.0.0.0', 0)))
+        raise SocksError("Unknown address type %d" % atyp)
+    port = int.from_bytes(await reader.readexactly(2), 'big')
+    if version != SOCKS5_VERSION or command != CMD_CONNECT:
+        writer.write(encodeReply(SOCKS5_VERSION, COMMAND_NOT_SUPPORTED, ('0.0.0.0', 0)))
+        raise SocksError("Unsupported SOCKS command %d" % command)
+    return SocksRequest(SOCKS5_VERSION, host, port, args, reader, writer)
+
+def _decodeArgs(raw):
+    try:
+        return parseClientArgs(raw.decode('utf-8'))
+    except (UnicodeDecodeError, ValueError) as e:
+        raise SocksError("Invalid transport arguments (%s)" % e)
+
+def encodeReply(version, reply, bindaddr):
+    """
+    :returns: bytes -- A SOCKS `version` reply with SOCKS5 reply code `reply`.
+    """
+    addr, port = bindaddr
+    if version == SOCKS4_VERSION:
+        code = SOCKS4_GRANTED if reply == SUCCEEDED else SOCKS4_REJECTED
+        if ':' in addr:
+            addr = '0.0.0.0' # SOCKS4 has no IPv6
+        return (bytes([0, code]) + port.to_bytes(2, 'big')
+                + socket.inet_pton(socket.AF_INET, addr))
+    if ':' in addr:
+        atyp, packed = SOCKS5_ATYP_IPV6, socket.inet_pton(socket.AF_INET6, addr)
+    else:
+        atyp, packed = SOCKS5_ATYP_IPV4, socket.inet_pton(socket.AF_INET, addr)
+    return bytes([SOCKS5_VERSION, reply, 0, atyp]) + packed + port.to_bytes(2, 'big')
+
+def parseClientArgs(string):
+    """
+    Parse per-connection transport arguments.
+
+    :param str string: Arguments in ``k=v;k=v`` form, where backslash
+            escapes the next character, e.g. ``cert=a\\;b;iat-mode=0``.
+
+    :returns: dict -- The arguments.
+    :raises: :class:`ValueError` if the string is malformed.
+
+    >>> parseClientArgs("shared-secret=rahasia;secrets-file=/tmp/blob")
+    {'shared-secret': 'rahasia', 'secrets-file': '/tmp/blob'}
+    """
+    args = {}
+    if not string:
+        return args
+    key = None
+    buf = []
+    escaped = False
+    for c in string:
+        if escaped:
+            buf.append(c)
+            escaped = False
+        elif c == '\\':
+            escaped = True
+        elif c == '=' and key is None:
+            key = ''.join(buf)
+            buf = []
+        elif c == ';':
+            if key is None:
+                raise ValueError("Not a k=v value (%s)" % ''.join(buf))
+            args[key] = ''.join(buf)
+            key = None
+            buf = []
+        else:
+            buf.append(c)
+    if escaped:
+        raise ValueError("Trailing backslash (%s)" % string)
+    if key is not None:
+        args[key] = ''.join(buf)
+    elif buf:
+        raise ValueError("Not a k=v value (%s)" % ''.join(buf))
+    return args
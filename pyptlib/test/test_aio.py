@@ -0,0 +1,216 @@
+import asyncio
+import os
+import threading
+import unittest
+
+from pyptlib.aio import AsyncClientTransportPlugin, AsyncServerTransportPlugin
+from pyptlib.config import EnvError
+from pyptlib.test.test_proxy import FakeProxy
+
+class AsyncPluginTestMixin(object):
+    """
+    This class is not a TestCase but is meant to be mixed-into tests
+    for subclasses of AsyncTransportPluginMixin.
+    """
+    pluginType = None
+
+    def setUp(self):
+        r, w = os.pipe()
+        self.reader = os.fdopen(r, 'r')
+        self.stdout = os.fdopen(w, 'w')
+        self.plugin = self.pluginType(stdout=self.stdout)
+
+    def tearDown(self):
+        self.reader.close()
+        self.stdout.close()
+
+    def run_plugin(self, coro):
+        async def run():
+            try:
+                await coro
+            finally:
+                await self.plugin.close()
+        asyncio.run(run())
+        self.stdout.close()
+        return self.reader.readlines()
+
+    def installTestConfig(self, stateLocation="/pt_stat", **kwargs):
+        self.plugin.config = self.pluginType.configType(stateLocation, **kwargs)
+
+    def test_init_version(self):
+        """init writes the VERSION line through the async writer."""
+        self.installTestConfig(transports=["rot13"])
+        self.assertEqual(self.run_plugin(self.plugin.init(["rot13"])), ["VERSION 1\n"])
+        self.assertEqual(self.plugin.getTransports(), ["rot13"])
+
+    def test_init_version_error(self):
+        """init still reports and raises on protocol version mismatch."""
+        self.installTestConfig(managedTransportVer=["666"])
+        async def run():
+            with self.assertRaises(EnvError):
+                await self.plugin.init(["rot13"])
+        self.assertEqual(self.run_plugin(run()), ["VERSION-ERROR no-version\n"])
+
+    def test_method_error_and_end(self):
+        """report coroutines write the same lines as the blocking plugin."""
+        self.installTestConfig(transports=["rot13"])
+        async def run():
+            await self.plugin.init(["rot13"])
+            await self.plugin.reportMethodError("rot13", "broken")
+            await self.plugin.reportMethodsEnd()
+        m = self.plugin.methodName
+        self.assertEqual(self.run_plugin(run()),
+            ["VERSION 1\n", "%s-ERROR rot13 broken\n" % m, "%sS DONE\n" % m])
+
+    def test_write_before_open(self):
+        """Messages cannot be written before the writer is open."""
+        self.installTestConfig()
+        self.assertRaises(RuntimeError, self.plugin.emit, "VERSION 1")
+
+class testAsyncClient(AsyncPluginTestMixin, unittest.TestCase):
+    pluginType = AsyncClientTransportPlugin
+
+    def test_cmethod_line(self):
+        self.installTestConfig(transports=["rot13"])
+        async def run():
+            await self.plugin.init(["rot13"])
+            await self.plugin.reportMethodSuccess("rot13", "socks5", ("127.0.0.1", 1080))
+        self.assertIn("CMETHOD rot13 socks5 127.0.0.1:1080\n", self.run_plugin(run()))
+
+    def test_launchTransports(self):
+        """Async launches are reported in order; slow ones are cancelled."""
+        self.installTestConfig(transports=["slow", "hung", "fast"])
+        cancelled = []
+        async def launch(name):
+            if name == "slow":
+                await asyncio.sleep(0.1)
+            elif name == "hung":
+                try:
+                    await asyncio.sleep(10)
+                except asyncio.CancelledError:
+                    cancelled.append(name)
+                    raise
+            return ("socks5", ("127.0.0.1", 1080))
+        async def run():
+            await self.plugin.init(["slow", "hung", "fast"])
+            self.assertEqual(await self.plugin.launchTransports(launch, timeout=0.3),
+                             ["slow", "fast"])
+        lines = self.run_plugin(run())
+        self.assertEqual(cancelled, ["hung"])
+        self.assertEqual([l.split()[0:2] for l in lines], [
+            ["VERSION", "1"], ["CMETHOD", "slow"], ["CMETHOD-ERROR", "hung"],
+            ["CMETHOD", "fast"], ["CMETHODS", "DONE"]])
+
+    def test_init_probes_proxy(self):
+        """init reports PROXY DONE once a probe connection succeeds."""
+        async def run():
+            proxy = await FakeProxy("socks5", "user", "secret").start()
+            self.installTestConfig(transports=["rot13"], proxy=proxy.uri)
+            await self.plugin.init(["rot13"])
+            await self.plugin.proxyConnector.close()
+            await proxy.close()
+            self.assertEqual(proxy.connections, 1)
+        self.assertEqual(self.run_plugin(run()), ["VERSION 1\n", "PROXY DONE\n"])
+
+    def test_init_probes_proxy_target(self):
+        """An http proxy is probed by connecting to probeTarget through it."""
+        async def run():
+            proxy = await FakeProxy("http").start()
+            self.installTestConfig(transports=["rot13"], proxy=proxy.uri)
+            await self.plugin.init(["rot13"], probeTarget=("example.com", 443))
+            await proxy.close()
+            self.assertEqual(proxy.targets, ["example.com:443"])
+        self.assertEqual(self.run_plugin(run()), ["VERSION 1\n", "PROXY DONE\n"])
+
+    def test_init_probes_proxy_no_target(self):
+        """Without a probeTarget, an http proxy is left to the application."""
+        async def run():
+            proxy = await FakeProxy("http").start()
+            self.installTestConfig(transports=["rot13"], proxy=proxy.uri)
+            await self.plugin.init(["rot13"])
+            self.assertTrue(self.plugin.proxyConnector.needsProbeTarget())
+            await self.plugin.reportProxySuccess()
+            await proxy.close()
+            self.assertEqual(proxy.connections, 0)
+        self.assertEqual(self.run_plugin(run()), ["VERSION 1\n", "PROXY DONE\n"])
+
+    def test_init_probes_proxy_error(self):
+        """init reports PROXY-ERROR if the proxy rejects us."""
+        async def run():
+            proxy = await FakeProxy("socks5", "user", "secret").start()
+            self.installTestConfig(transports=["rot13"],
+                                   proxy=proxy.withCredentials("user", "wrong"))
+            await self.plugin.init(["rot13"])
+            await proxy.close()
+        lines = self.run_plugin(run())
+        self.assertEqual(lines[1], "PROXY-ERROR SOCKS5 proxy rejected our credentials\n")
+
+class testAsyncServer(AsyncPluginTestMixin, unittest.TestCase):
+    pluginType = AsyncServerTransportPlugin
+
+    def test_smethod_line(self):
+        self.installTestConfig(transports=["rot13"])
+        async def run():
+            await self.plugin.init(["rot13"])
+            await self.plugin.reportMethodSuccess("rot13", ("127.0.0.1", 4444), None)
+        self.assertIn("SMETHOD rot13 127.0.0.1:4444\n", self.run_plugin(run()))
+
+    def test_buffered(self):
+        """Buffered async plugins write everything at reportMethodsEnd."""
+        self.plugin.buffered = True
+        self.installTestConfig(transports=["rot13"])
+        async def run():
+            await self.plugin.init(["rot13"])
+            await self.plugin.reportMethodSuccess("rot13", ("127.0.0.1", 4444), None)
+            self.assertEqual(self.plugin._pending[0], "VERSION 1\n")
+            await self.plugin.reportMethodsEnd()
+            self.assertEqual(self.plugin._pending, [])
+        self.assertEqual(self.run_plugin(run()),
+            ["VERSION 1\n", "SMETHOD rot13 127.0.0.1:4444\n", "SMETHODS DONE\n"])
+
+    def test_log_from_thread(self):
+        """Internal LOG messages from other threads are written from the loop."""
+        self.installTestConfig(transports=["rot13"])
+        writers = []
+        write = self.plugin._write
+        def _write(data):
+            writers.append(threading.current_thread())
+            write(data)
+        self.plugin._write = _write
+        async def run():
+            await self.plugin.init(["rot13"])
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self.plugin._log, "from a thread")
+            await asyncio.sleep(0)
+        self.assertEqual(self.run_plugin(run()),
+            ["VERSION 1\n", 'LOG SEVERITY=notice MESSAGE="from a thread"\n'])
+        self.assertEqual(writers, [threading.main_thread()] * 2)
+
+class testStatusPipe(unittest.TestCase):
+
+    def test_drain_waits_for_reader(self):
+        """drain() blocks while the pipe is full, until the reader catches up."""
+        r, w = os.pipe()
+        reader = os.fdopen(r, 'rb')
+        stdout = os.fdopen(w, 'w')
+        plugin = AsyncServerTransportPlugin(stdout=stdout)
+        data = b"x" * (1 << 20)
+        async def run():
+            await plugin.open()
+            plugin.writer.write(data)
+            drain = asyncio.ensure_future(plugin.drain())
+            await asyncio.sleep(0.1)
+            self.assertFalse(drain.done())
+            loop = asyncio.get_running_loop()
+            received = await loop.run_in_executor(None, reader.read, len(data))
+            await drain
+            await plugin.close()
+            return received
+        try:
+            self.assertEqual(asyncio.run(run()), data)
+        finally:
+            reader.close()
+            stdout.close()
+
+if __name__ == '__main__':
+    unittest.main()
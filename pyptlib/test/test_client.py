@@ -1,4 +1,7 @@
 import os
+import subprocess
+import sys
+import time
 import unittest
 
 from pyptlib.client import ClientTransportPlugin
@@ -147,6 +150,67 @@ class testClient(PluginCoreTestMixin, unittest.TestCase):
         self.assertRaises(EnvError, self.plugin._loadConfigFromEnv)
         self.assertOutputLinesStartWith("PROXY-ERROR ")
 
+class testClientLaunch(PluginCoreTestMixin, unittest.TestCase):
+    pluginType = ClientTransportPlugin
+
+    def test_launchTransports_priority_order(self):
+        """Results are reported in priority order, not completion order."""
+        self.installTestConfig(transports=["slow", "fast"])
+        self.plugin.init(["slow", "fast"])
+        def launch(name):
+            if name == "slow":
+                time.sleep(0.2)
+                return ("socks5", ("127.0.0.1", 1111))
+            return ("socks4", ("127.0.0.1", 2222))
+        launched = self.plugin.launchTransports(launch)
+        self.assertEqual(launched, ["slow", "fast"])
+        self.assertEqual(self.getOutputLines(), [
+            "VERSION 1\n",
+            "CMETHOD slow socks5 127.0.0.1:1111\n",
+            "CMETHOD fast socks4 127.0.0.1:2222\n",
+            "CMETHODS DONE\n"])
+
+    def test_launchTransports_concurrent(self):
+        """Launches run concurrently."""
+        names = ["t%d" % i for i in range(5)]
+        self.installTestConfig(transports=list(names))
+        self.plugin.init(names)
+        def launch(name):
+            time.sleep(0.2)
+            return ("socks5", ("127.0.0.1", 1111))
+        start = time.monotonic()
+        self.assertEqual(self.plugin.launchTransports(launch), names)
+        self.assertLess(time.monotonic() - start, 0.6)
+
+    def test_launchTransports_errors(self):
+        """Failed, timed-out and missing launchers become METHOD-ERRORs."""
+        self.installTestConfig(transports=["bad", "hung", "missing", "good"])
+        self.plugin.init(["bad", "hung", "missing", "good"])
+        def bad(name):
+            raise IOError("no")
+        def hung(name):
+            time.sleep(0.5)
+        launchers = {"bad": bad, "hung": hung,
+                     "good": lambda name: ("socks5", ("127.0.0.1", 1111))}
+        launched = self.plugin.launchTransports(launchers, timeout=0.1)
+        self.assertEqual(launched, ["good"])
+        self.assertOutputLinesStartWith("VERSION ",
+            "CMETHOD-ERROR bad ", "CMETHOD-ERROR hung ",
+            "CMETHOD-ERROR missing ", "CMETHOD good ", "CMETHODS DONE")
+
+    def test_launchTransports_timeout_does_not_block_exit(self):
+        """A launch that timed out does not keep the process alive."""
+        code = ("import io, time\n"
+                "from pyptlib.client import ClientTransportPlugin\n"
+                "from pyptlib.client_config import ClientConfig\n"
+                "plugin = ClientTransportPlugin(config=ClientConfig('/pt_stat', transports=['hung']),"
+                " stdout=io.StringIO())\n"
+                "plugin.init(['hung'])\n"
+                "plugin.launchTransports(lambda name: time.sleep(30), timeout=0.2)\n")
+        start = time.monotonic()
+        subprocess.check_call([sys.executable, "-c", code], timeout=20)
+        self.assertLess(time.monotonic() - start, 5)
+
 if __name__ == '__main__':
     unittest.main()
 
@@ -0,0 +1,104 @@
+import copy
+import pickle
+import unittest
+
+from pyptlib.client import ClientTransportPlugin
+from pyptlib.client_config import ClientConfig, parseProxyURI
+from pyptlib.config import Config, FrozenDict
+from pyptlib.server_config import ServerConfig
+
+def make_server_config():
+    return ServerConfig("/pt_stat",
+        transports=["obfs3", "scramblesuit"],
+        serverBindAddr={"obfs3": ["127.0.0.1", 5556], "scramblesuit": ("127.0.0.1", 6666)},
+        ORPort=("127.0.0.1", 9001),
+        serverTransportOptions={"obfs3": {"k": "v"}, "scramblesuit": {"k2": "v2"}})
+
+class ConfigTest(unittest.TestCase):
+
+    def test_transports_not_mutated(self):
+        """Config does not modify the transports it was given."""
+        transports = ["*", "obfs3"]
+        config = Config("/pt_stat", transports=transports)
+        self.assertEqual(transports, ["*", "obfs3"])
+        self.assertEqual(config.transports, ("obfs3",))
+        self.assertTrue(config.getAllTransportsEnabled())
+
+    def test_immutable(self):
+        config = make_server_config()
+        self.assertRaises(AttributeError, setattr, config, "stateLocation", "/elsewhere")
+        self.assertRaises(AttributeError, setattr, config, "whatever", 1)
+        self.assertRaises(AttributeError, delattr, config, "ORPort")
+        def setitem(d, k, v):
+            d[k] = v
+        self.assertRaises(TypeError, setitem, config.serverBindAddr, "x", ("127.0.0.1", 1))
+        self.assertRaises(TypeError, setitem, config.serverTransportOptions["obfs3"], "k", "x")
+        self.assertFalse(hasattr(config, "__dict__"))
+
+    def test_hashable(self):
+        self.assertEqual(make_server_config(), make_server_config())
+        self.assertEqual(hash(make_server_config()), hash(make_server_config()))
+        cache = {make_server_config(): 1}
+        self.assertIn(make_server_config(), cache)
+        self.assertNotEqual(make_server_config(), Config("/pt_stat"))
+        self.assertNotEqual(Config("/pt_stat"), Config("/pt_stat2"))
+
+    def test_pickle_and_copy(self):
+        configs = [make_server_config(), Config("/pt_stat", transports=["*"]),
+                   ClientConfig("/pt_stat", transports=["a"],
+                                proxy=parseProxyURI("socks5://user:pw@192.0.2.1:1080"))]
+        for config in configs:
+            for proto in range(2, pickle.HIGHEST_PROTOCOL + 1):
+                clone = pickle.loads(pickle.dumps(config, proto))
+                self.assertEqual(clone, config)
+                self.assertIs(type(clone), type(config))
+            self.assertIs(copy.copy(config), config)
+            self.assertIs(copy.deepcopy(config), config)
+
+    def test_replace(self):
+        config = make_server_config()
+        changed = config.replace(serverTransportOptions={"obfs3": {"k": "new"}})
+        self.assertEqual(changed.serverTransportOptions, FrozenDict(obfs3=FrozenDict(k="new")))
+        self.assertEqual(changed.ORPort, config.ORPort)
+        self.assertIs(type(changed), ServerConfig)
+        self.assertEqual(config.serverTransportOptions["obfs3"]["k"], "v")
+        hash(changed)
+        self.assertEqual(config.replace(), config)
+        self.assertRaises(ValueError, config.replace, whatever=1)
+
+    def test_getters(self):
+        config = make_server_config()
+        self.assertEqual(config.getStateLocation(), "/pt_stat")
+        self.assertEqual(config.getManagedTransportVersions(), ("1",))
+        self.assertEqual(config.getORPort(), ("127.0.0.1", 9001))
+        self.assertEqual(config.serverBindAddr["obfs3"], ("127.0.0.1", 5556))
+        self.assertEqual(config.getServerTransportOptions(),
+                         {"obfs3": {"k": "v"}, "scramblesuit": {"k2": "v2"}})
+
+    def test_asDict_and_debug_data(self):
+        plugin = ClientTransportPlugin(config=ClientConfig("/pt_stat", transports=["a"]))
+        data = plugin.getDebugData()
+        self.assertEqual(data["config"], {"stateLocation": "/pt_stat",
+            "managedTransportVer": ("1",), "transports": ("a",),
+            "allTransportsEnabled": False, "proxy": None})
+
+class FrozenDictTest(unittest.TestCase):
+
+    def test_mapping(self):
+        d = FrozenDict({"a": 1}, b=2)
+        self.assertEqual(sorted(d.items()), [("a", 1), ("b", 2)])
+        self.assertEqual(d, {"a": 1, "b": 2})
+        self.assertEqual({"a": 1, "b": 2}, d)
+        self.assertEqual(dict(d), {"a": 1, "b": 2})
+        self.assertEqual(d.get("c", 3), 3)
+        self.assertIn("a", d)
+        self.assertEqual(len(d), 2)
+
+    def test_hash_pickle(self):
+        d = FrozenDict(a=FrozenDict(b="c"))
+        self.assertEqual(hash(d), hash(FrozenDict(a=FrozenDict(b="c"))))
+        self.assertEqual(pickle.loads(pickle.dumps(d)), d)
+        self.assertRaises(AttributeError, setattr, d, "_d", {})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from io import StringIO
+
+from pyptlib import config_cache
+from pyptlib.client import ClientTransportPlugin
+from pyptlib.client_config import ClientConfig
+from pyptlib.server import ServerTransportPlugin
+from pyptlib.server_config import ServerConfig
+
+class ConfigCacheTest(unittest.TestCase):
+    origEnv = os.environ
+
+    def setUp(self):
+        self.stateLocation = tempfile.mkdtemp()
+        self.server_env = {
+            "TOR_PT_STATE_LOCATION" : self.stateLocation,
+            "TOR_PT_MANAGED_TRANSPORT_VER" : "1",
+            "TOR_PT_EXTENDED_SERVER_PORT" : "",
+            "TOR_PT_ORPORT" : "127.0.0.1:43210",
+            "TOR_PT_SERVER_BINDADDR" : "dummy-127.0.0.1:5556,boom-127.0.0.1:6666",
+            "TOR_PT_SERVER_TRANSPORTS" : "dummy,boom",
+            "TOR_PT_SERVER_TRANSPORT_OPTIONS" : "boom:cert=abc==",
+        }
+        self.client_env = {
+            "TOR_PT_STATE_LOCATION" : self.stateLocation,
+            "TOR_PT_MANAGED_TRANSPORT_VER" : "1",
+            "TOR_PT_CLIENT_TRANSPORTS" : "*",
+            "TOR_PT_PROXY" : "socks5://user:pw@192.0.2.1:1080",
+        }
+        self.fromEnvCalls = 0
+
+    def tearDown(self):
+        os.environ = self.origEnv
+        shutil.rmtree(self.stateLocation)
+
+    def load(self, pluginType, environ):
+        os.environ = environ
+        plugin = pluginType(stdout=StringIO(), configSnapshot=True)
+        configType = plugin.configType
+        origFromEnv = configType.__dict__["fromEnv"]
+        def fromEnv(cls):
+            self.fromEnvCalls += 1
+            return origFromEnv.__func__(cls)
+        configType.fromEnv = classmethod(fromEnv)
+        try:
+            return plugin._loadConfigFromEnv()
+        finally:
+            configType.fromEnv = origFromEnv
+
+    def test_server_roundtrip(self):
+        """An identical environment loads the snapshot instead of parsing."""
+        config1 = self.load(ServerTransportPlugin, self.server_env)
+        self.assertTrue(os.path.exists(config_cache.snapshot_path(self.server_env)))
+        config2 = config_cache.load(ServerConfig, self.server_env)
+        self.assertEqual(config1.asDict(), config2.asDict())
+        self.assertEqual(config2.getServerTransportOptions()["boom"]["cert"], "abc==")
+
+    def test_client_roundtrip(self):
+        config1 = self.load(ClientTransportPlugin, self.client_env)
+        config2 = config_cache.load(ClientConfig, self.client_env)
+        self.assertEqual(config1, config2)
+        self.assertTrue(config2.getAllTransportsEnabled())
+        self.assertEqual(config2.getProxy().password, "pw")
+
+    def test_skip_validation(self):
+        self.load(ClientTransportPlugin, self.client_env)
+        self.load(ClientTransportPlugin, self.client_env)
+        self.assertEqual(self.fromEnvCalls, 1)
+
+    def test_env_change_invalidates(self):
+        self.load(ClientTransportPlugin, self.client_env)
+        env = dict(self.client_env, TOR_PT_PROXY="socks5://user:pw@192.0.2.1:1081")
+        config = self.load(ClientTransportPlugin, env)
+        self.assertEqual(self.fromEnvCalls, 2)
+        self.assertEqual(config.getProxy().port, 1081)
+
+    def test_version_change_invalidates(self):
+        self.load(ClientTransportPlugin, self.client_env)
+        orig = config_cache.SNAPSHOT_VERSION
+        config_cache.SNAPSHOT_VERSION = orig + 1
+        try:
+            self.assertIsNone(config_cache.load(ClientConfig, self.client_env))
+        finally:
+            config_cache.SNAPSHOT_VERSION = orig
+
+    def test_wrong_type_ignored(self):
+        self.load(ClientTransportPlugin, self.client_env)
+        self.assertIsNone(config_cache.load(ServerConfig, self.client_env))
+
+    def test_corrupt_snapshot_ignored(self):
+        with open(config_cache.snapshot_path(self.client_env), "w") as fp:
+            fp.write("{not json")
+        self.load(ClientTransportPlugin, self.client_env)
+        self.assertEqual(self.fromEnvCalls, 1)
+        self.assertIsNotNone(config_cache.load(ClientConfig, self.client_env))
+
+    def test_atomic_write(self):
+        """Saving leaves no temporary files behind."""
+        self.load(ClientTransportPlugin, self.client_env)
+        self.load(ClientTransportPlugin, dict(self.client_env, TOR_PT_CLIENT_TRANSPORTS="a"))
+        self.assertEqual(os.listdir(self.stateLocation), [config_cache.SNAPSHOT_FILENAME])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -19,6 +19,9 @@ class PluginCoreTestMixin(object):
         self.plugin = self.pluginType(stdout=StringIO())
         os.environ = self.origEnv
 
+    def tearDown(self):
+        os.environ = self.origEnv
+
     def getOutputLines(self):
         fp = self.plugin.stdout
         fp.seek(0)
@@ -85,6 +88,56 @@ class PluginCoreTestMixin(object):
         self.assertEqual(["yeayeayea"], self.plugin.getTransports())
         self.assertOutputLinesStartWith("VERSION ")
 
+    def test_buffered_emit_deferred(self):
+        """Buffered plugins only write at reportMethodsEnd."""
+        self.plugin.buffered = True
+        self.installTestConfig(transports=["yeayeayea"])
+        self.plugin.init(["yeayeayea"])
+        self.plugin.reportMethodError("yeayeayea", "no")
+        self.assertOutputLinesEmpty()
+        self.plugin.reportMethodsEnd()
+        self.assertOutputLinesStartWith("VERSION ", "%s-ERROR " % self.plugin.methodName,
+                                        "%sS DONE" % self.plugin.methodName)
+
+    def test_buffered_emit_single_write(self):
+        """Buffered plugins write all queued messages at once."""
+        writes = []
+        self.plugin.buffered = True
+        self.plugin._write = writes.append
+        self.installTestConfig(transports=["yeayeayea"])
+        self.plugin.init(["yeayeayea"])
+        self.plugin.reportMethodsEnd()
+        self.assertEqual(len(writes), 1)
+        self.assertEqual(len(writes[0].splitlines()), 2)
+
+    def test_buffered_emit_flush_on_error(self):
+        """Buffered plugins flush early on fatal errors."""
+        self.plugin.buffered = True
+        self.installTestConfig(managedTransportVer=["666"])
+        self.assertRaises(EnvError, self.plugin._declareSupports, [])
+        self.assertOutputLinesStartWith("VERSION-ERROR ")
+
+    def test_reportLog(self):
+        """LOG messages are quoted, and written out even when buffered."""
+        self.plugin.buffered = True
+        self.plugin.reportLog('a "quoted"\\path\nnext', 'warning')
+        self.assertEqual(self.getOutputLines(),
+            ['LOG SEVERITY=warning MESSAGE="a \\"quoted\\"\\\\path\\nnext"\n'])
+        self.assertRaises(ValueError, self.plugin.reportLog, "x", "loud")
+
+    def test_reportLog_keeps_batch(self):
+        """LOG messages don't flush the queued messages of buffered plugins."""
+        writes = []
+        self.plugin.buffered = True
+        self.plugin._write = writes.append
+        self.installTestConfig(transports=["yeayeayea"])
+        self.plugin.init(["yeayeayea"])
+        self.plugin.reportLog("starting")
+        self.assertEqual(writes, ['LOG SEVERITY=notice MESSAGE="starting"\n'])
+        self.plugin.reportMethodsEnd()
+        self.assertEqual(len(writes), 2)
+        self.assertEqual(len(writes[1].splitlines()), 2)
+
 class DummyConfig(Config):
 
     @classmethod
@@ -0,0 +1,115 @@
+import asyncio
+import io
+import socket
+import threading
+import time
+import unittest
+from unittest import mock
+
+from pyptlib.aio import AsyncServerTransportPlugin
+from pyptlib.drain import Drain, shutdown, shutdownAsync
+from pyptlib.server import ServerTransportPlugin
+from pyptlib.server_config import ServerConfig
+from pyptlib.util import subproc
+
+class FakeListener(object):
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+def release_later(tracker, delay):
+    def run():
+        time.sleep(delay)
+        tracker.__exit__(None, None, None)
+    t = threading.Thread(target=run)
+    t.start()
+    return t
+
+class DrainTest(unittest.TestCase):
+
+    def tearDown(self):
+        subproc._isDraining = False
+
+    def test_start_closes_listeners(self):
+        drain = Drain()
+        listener, late = FakeListener(), FakeListener()
+        drain.addListener(listener)
+        self.assertTrue(drain.start())
+        self.assertTrue(listener.closed)
+        self.assertTrue(subproc.is_shutting_down())
+        drain.addListener(late)
+        self.assertTrue(late.closed)
+        self.assertFalse(drain.start())
+
+    def test_wait_returns_when_idle(self):
+        drain = Drain(deadline=10)
+        tracker = drain.track()
+        tracker.__enter__()
+        self.assertEqual(drain.active(), 1)
+        t = release_later(tracker, 0.1)
+        start = time.monotonic()
+        self.assertEqual(drain.wait(), 0)
+        self.assertLess(time.monotonic() - start, 2)
+        t.join()
+
+    def test_wait_deadline(self):
+        drain = Drain(deadline=0.3, progressInterval=0.1)
+        reports = []
+        with drain.track():
+            self.assertEqual(drain.wait(lambda active, left: reports.append(active)), 1)
+        self.assertTrue(2 <= len(reports) <= 3, reports)
+        self.assertEqual(set(reports), set([1]))
+
+    def test_wait_async(self):
+        drain = Drain(deadline=10)
+        async def run():
+            async def conn():
+                with drain.track():
+                    await asyncio.sleep(0.1)
+            task = asyncio.ensure_future(conn())
+            await asyncio.sleep(0)
+            self.assertEqual(drain.active(), 1)
+            remaining = await drain.waitAsync()
+            await task
+            return remaining
+        start = time.monotonic()
+        self.assertEqual(asyncio.run(run()), 0)
+        self.assertLess(time.monotonic() - start, 2)
+
+    def test_shutdown_reports(self):
+        plugin = ServerTransportPlugin(config=ServerConfig("/pt_stat"), stdout=io.StringIO())
+        drain = Drain(deadline=0.1, progressInterval=0.05)
+        killed = []
+        with mock.patch.object(subproc, "killall", lambda cleanup, wait_s: killed.append(wait_s)):
+            with drain.track():
+                shutdown(drain, plugin, wait_s=3)
+        self.assertEqual(killed, [3])
+        lines = plugin.stdout.getvalue().splitlines()
+        self.assertEqual(lines[0], 'LOG SEVERITY=notice MESSAGE='
+                         '"Shutting down: draining 1 connections, for up to 0.1s"')
+        self.assertTrue(lines[1].startswith('LOG SEVERITY=notice MESSAGE="Draining: 1 '))
+        self.assertEqual(lines[-1], 'LOG SEVERITY=warning MESSAGE='
+                         '"Drain deadline reached, closing 1 connections"')
+
+    def test_shutdown_async(self):
+        drain = Drain(deadline=10)
+        killed = []
+        async def killall_async(cleanup, wait_s):
+            killed.append(wait_s)
+        ours, theirs = socket.socketpair()
+        async def run():
+            reader, writer = await asyncio.open_connection(sock=ours)
+            plugin = AsyncServerTransportPlugin(config=ServerConfig("/pt_stat"),
+                                                stdout=io.StringIO(), writer=writer)
+            with mock.patch.object(subproc, "killall_async", killall_async):
+                await shutdownAsync(drain, plugin, wait_s=5)
+            writer.close()
+        asyncio.run(run())
+        self.assertEqual(killed, [5])
+        output = theirs.makefile("rb").read().decode("utf-8").splitlines()
+        theirs.close()
+        self.assertEqual(output[-1], 'LOG SEVERITY=notice MESSAGE="All connections drained"')
+
+if __name__ == '__main__':
+    unittest.main()
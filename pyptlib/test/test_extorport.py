@@ -0,0 +1,225 @@
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+from pyptlib import extorport
+from pyptlib.extorport import ExtORPortClient, ExtORPortError, loadAuthCookie
+from pyptlib.server_config import ServerConfig
+
+COOKIE = os.urandom(32)
+
+class FakeExtORPort(object):
+    """
+    An Extended ORPort that implements the server side of SafeCookie
+    authentication, and records the commands of each connection.
+    """
+
+    def __init__(self, cookie=COOKIE, authTypes=b"\x01"):
+        self.cookie = cookie
+        self.authTypes = authTypes
+        self.listener = socket.socket()
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(16)
+        self.addrport = self.listener.getsockname()
+        self.authenticated = 0
+        self.commands = [] # commands of each connection, once DONE
+        self.conns = []
+        self.lock = threading.Lock()
+        t = threading.Thread(target=self.serve)
+        t.daemon = True
+        t.start()
+
+    def serve(self):
+        while True:
+            try:
+                conn, _ = self.listener.accept()
+            except OSError:
+                return
+            self.conns.append(conn)
+            t = threading.Thread(target=self.handle, args=(conn,))
+            t.daemon = True
+            t.start()
+
+    def handle(self, conn):
+        recv = lambda n: extorport.recvExactly(conn, n)
+        try:
+            conn.sendall(self.authTypes + b"\x00")
+            if recv(1) != b"\x01":
+                return
+            clientNonce = recv(32)
+            serverNonce = os.urandom(32)
+            conn.sendall(extorport.authHash(self.cookie, extorport.SERVER_HASH_HEADER,
+                                            clientNonce, serverNonce) + serverNonce)
+            clientHash = extorport.authHash(self.cookie, extorport.CLIENT_HASH_HEADER,
+                                            clientNonce, serverNonce)
+            ok = recv(32) == clientHash
+            if ok:
+                with self.lock:
+                    self.authenticated += 1
+            conn.sendall(b"\x01" if ok else b"\x00")
+            if not ok:
+                return
+            commands = {}
+            while True:
+                header = recv(4)
+                command = int.from_bytes(header[:2], "big")
+                body = recv(int.from_bytes(header[2:], "big"))
+                if command == extorport.CMD_DONE:
+                    break
+                commands[command] = body.decode("ascii")
+            with self.lock:
+                self.commands.append(commands)
+            deny = commands.get(extorport.CMD_TRANSPORT) == "denied"
+            conn.sendall(extorport.encodeCommand(
+                extorport.REPLY_DENY if deny else extorport.REPLY_OKAY))
+            conn.sendall(b"OR traffic")
+        except (OSError, ExtORPortError):
+            pass
+
+    def close(self):
+        self.listener.close()
+        for conn in self.conns:
+            conn.close()
+
+class testExtORPortClient(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeExtORPort()
+        self.client = ExtORPortClient(self.server.addrport, COOKIE, poolSize=2)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.close()
+
+    def test_connect(self):
+        """Client address and transport are sent, and the connection is usable."""
+        sock = self.client.connect(("1.2.3.4", 5678), "obfs4")
+        try:
+            self.assertEqual(extorport.recvExactly(sock, 10), b"OR traffic")
+        finally:
+            sock.close()
+        self.assertEqual(self.server.commands, [{
+            extorport.CMD_USERADDR: "1.2.3.4:5678",
+            extorport.CMD_TRANSPORT: "obfs4"}])
+
+    def test_connect_ipv6(self):
+        self.client.connect(("::1", 80), None).close()
+        self.assertEqual(self.server.commands, [{extorport.CMD_USERADDR: "[::1]:80"}])
+
+    def test_denied(self):
+        self.assertRaises(ExtORPortError, self.client.connect, ("1.2.3.4", 5678), "denied")
+
+    def test_bad_cookie(self):
+        self.client.cookie = os.urandom(32)
+        self.assertRaises(ExtORPortError, self.client.connect, None, "obfs4")
+
+    def test_no_safecookie(self):
+        self.server.authTypes = b"\x02"
+        self.assertRaises(ExtORPortError, self.client.connect, None, "obfs4")
+
+    def test_pool(self):
+        """Connections are authenticated ahead of time, and reused."""
+        self.client.fill()
+        self.assertEqual(self.server.authenticated, 2)
+        self.assertEqual(len(self.client._pool), 2)
+        self.client.refill = lambda: None
+        self.client.connect(None, "obfs4").close()
+        self.assertEqual(self.server.authenticated, 2)
+        self.assertEqual(len(self.client._pool), 1)
+
+    def test_pool_stale(self):
+        """Pooled connections closed by Tor are not used."""
+        self.client.fill()
+        for conn in self.server.conns:
+            conn.shutdown(socket.SHUT_RDWR)
+        self.client.refill = lambda: None
+        self.client.connect(None, "obfs4").close()
+        self.assertEqual(self.server.authenticated, 3)
+        self.assertEqual(len(self.client._pool), 0)
+
+    def test_pool_expired(self):
+        now = [0]
+        self.client._clock = lambda: now[0]
+        self.client.fill()
+        now[0] = 1000
+        self.client.refill = lambda: None
+        self.client.connect(None, "obfs4").close()
+        self.assertEqual(self.server.authenticated, 3)
+
+class testIsIdle(unittest.TestCase):
+
+    def setUp(self):
+        self.a, self.b = socket.socketpair()
+
+    def tearDown(self):
+        self.a.close()
+        self.b.close()
+
+    def test_idle(self):
+        self.assertTrue(extorport.isIdle(self.a))
+        self.b.sendall(b"x")
+        self.assertFalse(extorport.isIdle(self.a))
+
+    def test_closed_by_peer(self):
+        self.b.close()
+        self.assertFalse(extorport.isIdle(self.a))
+
+    def test_high_fd(self):
+        """Sockets with fds above FD_SETSIZE are checked too."""
+        try:
+            import resource
+        except ImportError:
+            self.skipTest("resource limits not supported")
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        fd = 2000
+        if soft != resource.RLIM_INFINITY and soft <= fd:
+            if hard != resource.RLIM_INFINITY and hard <= fd:
+                self.skipTest("open file limit too low")
+            resource.setrlimit(resource.RLIMIT_NOFILE, (fd + 1, hard))
+            self.addCleanup(resource.setrlimit, resource.RLIMIT_NOFILE, (soft, hard))
+        os.dup2(self.a.fileno(), fd)
+        sock = socket.socket(fileno=fd)
+        self.addCleanup(sock.close)
+        self.assertTrue(extorport.isIdle(sock))
+        self.b.sendall(b"x")
+        self.assertFalse(extorport.isIdle(sock))
+
+class testAuthCookie(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "auth_cookie")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def writeCookie(self, data):
+        with open(self.path, "wb") as f:
+            f.write(data)
+
+    def test_valid(self):
+        self.writeCookie(extorport.AUTH_COOKIE_HEADER + COOKIE)
+        self.assertEqual(loadAuthCookie(self.path), COOKIE)
+
+    def test_bad_header(self):
+        self.writeCookie(b"x" * 32 + COOKIE)
+        self.assertRaises(ValueError, loadAuthCookie, self.path)
+
+    def test_bad_length(self):
+        self.writeCookie(extorport.AUTH_COOKIE_HEADER + COOKIE + b"x")
+        self.assertRaises(ValueError, loadAuthCookie, self.path)
+
+    def test_fromConfig(self):
+        self.writeCookie(extorport.AUTH_COOKIE_HEADER + COOKIE)
+        config = ServerConfig("/pt_stat", extendedORPort=("127.0.0.1", 4321),
+                              authCookieFile=self.path)
+        client = ExtORPortClient.fromConfig(config)
+        self.assertEqual(client.extendedORPort, ("127.0.0.1", 4321))
+        self.assertEqual(client.cookie, COOKIE)
+        self.assertRaises(ValueError, ExtORPortClient.fromConfig, ServerConfig("/pt_stat"))
+
+if __name__ == '__main__':
+    unittest.main()
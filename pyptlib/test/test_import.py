@@ -0,0 +1,62 @@
+import os
+import subprocess
+import sys
+import unittest
+
+# Modules that should only be loaded when a function that needs them is
+# first called, rather than when the public API is imported.
+LAZY_MODULES = ["urllib.parse", "socket", "inspect", "concurrent.futures", "asyncio"]
+
+# Budget for the cumulative import time of each public module, in
+# microseconds, as reported by "python -X importtime". Override with the
+# PYPTLIB_IMPORT_BUDGET_US environment variable on slow machines.
+IMPORT_BUDGET_US = int(os.getenv("PYPTLIB_IMPORT_BUDGET_US", 20000))
+
+def import_time_us(module):
+    """
+    Import `module` in a fresh interpreter and return its cumulative import
+    time in microseconds.
+    """
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import %s" % module],
+                          stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    for line in proc.stderr.splitlines():
+        fields = line.split("|")
+        if len(fields) == 3 and fields[2].strip() == module:
+            return int(fields[1])
+    raise ValueError("no import time reported for %s" % module)
+
+def newly_imported(module):
+    """
+    Import `module` in a fresh interpreter and return the modules in
+    LAZY_MODULES that this loaded.
+    """
+    code = ("import sys; before = set(sys.modules); import %s; "
+            "print(' '.join(m for m in %r if m in sys.modules and m not in before))"
+            % (module, LAZY_MODULES))
+    return subprocess.check_output([sys.executable, "-c", code],
+                                   universal_newlines=True).split()
+
+class ImportTimeTest(unittest.TestCase):
+
+    def assertImportBudget(self, module):
+        best = min(import_time_us(module) for _ in range(3))
+        self.assertLessEqual(best, IMPORT_BUDGET_US,
+            "import %s took %dus, budget is %dus" % (module, best, IMPORT_BUDGET_US))
+
+    def test_client_budget(self):
+        self.assertImportBudget("pyptlib.client")
+
+    def test_server_budget(self):
+        self.assertImportBudget("pyptlib.server")
+
+    def test_client_lazy(self):
+        self.assertEqual(newly_imported("pyptlib.client"), [])
+
+    def test_server_lazy(self):
+        self.assertEqual(newly_imported("pyptlib.server"), [])
+
+    def test_subproc_lazy(self):
+        self.assertEqual(newly_imported("pyptlib.util.subproc"), [])
+
+if __name__ == '__main__':
+    unittest.main()
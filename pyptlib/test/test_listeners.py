@@ -0,0 +1,90 @@
+import os
+import socket
+import sys
+import unittest
+
+from pyptlib.listeners import ListenerSet, adoptListeners, listen, LISTEN_FDS_ENV
+from pyptlib.server import ServerTransportPlugin
+from pyptlib.test.test_core import PluginCoreTestMixin
+from pyptlib.test.test_server import BASE_ENVIRON
+from pyptlib.util import subproc
+
+# Accept one connection on each adopted listener, replying with its name.
+ADOPT_AND_REPLY = """
+from pyptlib.listeners import adoptListeners
+for name, sock in sorted(adoptListeners().items()):
+    conn, _ = sock.accept()
+    conn.sendall(name.encode("ascii"))
+    conn.close()
+"""
+
+class testListenerSet(PluginCoreTestMixin, unittest.TestCase):
+    pluginType = ServerTransportPlugin
+
+    def setUp(self):
+        PluginCoreTestMixin.setUp(self)
+        self.listeners = ListenerSet()
+        self.busy = listen(("127.0.0.1", 0))
+
+    def tearDown(self):
+        self.listeners.close()
+        self.busy.close()
+        PluginCoreTestMixin.tearDown(self)
+
+    def initPlugin(self):
+        busyPort = self.busy.getsockname()[1]
+        environ = dict(BASE_ENVIRON)
+        environ["TOR_PT_SERVER_BINDADDR"] = "dummy-127.0.0.1:0,boom-127.0.0.1:%d" % busyPort
+        os.environ = environ
+        self.plugin.init(["dummy", "boom"])
+        return busyPort
+
+    def test_report(self):
+        """Bound listeners and bind failures are both reported."""
+        busyPort = self.initPlugin()
+        addresses = self.listeners.bind(self.plugin.getBindAddresses())
+        self.assertEqual(list(addresses), ["dummy"])
+        self.assertIn("boom", self.listeners.errors)
+        self.listeners.report(self.plugin)
+        lines = self.getOutputLines()
+        self.assertEqual(lines[1], "SMETHOD dummy 127.0.0.1:%d\n" % addresses["dummy"][1])
+        self.assertTrue(lines[2].startswith(
+            "SMETHOD-ERROR boom could not listen on 127.0.0.1:%d" % busyPort))
+        self.assertEqual(lines[3], "SMETHODS DONE\n")
+
+    def test_handoff(self):
+        """Children can accept connections on the listeners they inherit."""
+        addresses = self.listeners.bind({"a": ("127.0.0.1", 0), "b": ("127.0.0.1", 0)})
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(sys.path)
+        child = subproc.Popen([sys.executable, "-c", ADOPT_AND_REPLY],
+                              **self.listeners.popenArgs(env=env))
+        try:
+            for name in ["a", "b"]:
+                conn = socket.create_connection(addresses[name], timeout=5)
+                self.assertEqual(conn.recv(16), name.encode("ascii"))
+                conn.close()
+            self.assertEqual(child.wait(5), 0)
+        finally:
+            if child.poll() is None:
+                child.kill()
+                child.wait()
+            subproc._CHILD_PROCS.remove(child)
+
+    def test_popenArgs(self):
+        self.listeners.bind({"a": ("127.0.0.1", 0), "b": ("127.0.0.1", 0)})
+        args = self.listeners.popenArgs(["b"], env={})
+        fd = self.listeners.sockets["b"].fileno()
+        self.assertEqual(args, {"pass_fds": (fd,), "env": {LISTEN_FDS_ENV: "b=%d" % fd}})
+
+class testAdoptListeners(unittest.TestCase):
+
+    def test_none(self):
+        self.assertEqual(adoptListeners({}), {})
+
+    def test_malformed(self):
+        self.assertRaises(ValueError, adoptListeners, {LISTEN_FDS_ENV: "a"})
+        self.assertRaises(ValueError, adoptListeners, {LISTEN_FDS_ENV: "a=x"})
+
+if __name__ == '__main__':
+    unittest.main()
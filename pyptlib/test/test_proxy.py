@@ -0,0 +1,257 @@
+import asyncio
+import base64
+import socket
+import unittest
+from urllib.parse import urlsplit
+
+from pyptlib.proxy import ProxyConnector, ProxyConnectError
+
+class FakeProxy(object):
+    """
+    A proxy that checks credentials, records the targets it is asked for,
+    and then acts as an echo server instead of connecting to the target.
+
+    If lazy, a SOCKS5 proxy only replies once it has read the whole
+    greeting, authentication and request, so that clients that don't
+    pipeline them hang.
+    """
+
+    def __init__(self, scheme, username=None, password=None, lazy=False):
+        self.scheme = scheme
+        self.username = username
+        self.password = password
+        self.lazy = lazy
+        self.connections = 0
+        self.targets = []
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        port = self.server.sockets[0].getsockname()[1]
+        userinfo = ""
+        if self.username is not None:
+            userinfo = self.username
+            if self.password is not None:
+                userinfo += ":" + self.password
+            userinfo += "@"
+        self.uri = urlsplit("%s://%s127.0.0.1:%d" % (self.scheme, userinfo, port))
+        return self
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    def withCredentials(self, username, password=None):
+        """Return our URI, with different credentials."""
+        userinfo = username + (":" + password if password is not None else "")
+        return urlsplit("%s://%s@%s:%d" % (self.scheme, userinfo,
+                                            self.uri.hostname, self.uri.port))
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        try:
+            ok = await getattr(self, "handle_" + self.scheme)(reader, writer)
+            if ok:
+                writer.write(b"echo " + await reader.readexactly(4))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle_http(self, reader, writer):
+        request = (await reader.readuntil(b"\r\n\r\n")).decode("ascii").split("\r\n")
+        method, target, _ = request[0].split()
+        headers = dict(line.split(": ", 1) for line in request[1:] if line)
+        if self.username is not None:
+            expected = base64.b64encode(("%s:%s" % (self.username, self.password)).encode()).decode()
+            if headers.get("Proxy-Authorization") != "Basic " + expected:
+                writer.write(b"HTTP/1.1 407 Proxy Authentication Required\r\n\r\n")
+                return False
+        self.targets.append(target)
+        writer.write(b"HTTP/1.1 200 Connection established\r\n\r\n")
+        return True
+
+    async def handle_socks4a(self, reader, writer):
+        header = await reader.readexactly(8)
+        userid = (await reader.readuntil(b"\0"))[:-1].decode()
+        port = int.from_bytes(header[2:4], "big")
+        if header[4:7] == b"\0\0\0":
+            host = (await reader.readuntil(b"\0"))[:-1].decode()
+        else:
+            host = socket.inet_ntoa(header[4:])
+        if self.username is not None and userid != self.username:
+            writer.write(b"\x00\x5b" + b"\0" * 6)
+            return False
+        self.targets.append("%s:%d" % (host, port))
+        writer.write(b"\x00\x5a" + b"\0" * 6)
+        return True
+
+    async def handle_socks5(self, reader, writer):
+        replies = []
+        version, nmethods = await reader.readexactly(2)
+        methods = await reader.readexactly(nmethods)
+        method = 0 if self.username is None else 2
+        if method not in methods:
+            writer.write(b"\x05\xff")
+            return False
+        replies.append(bytes([5, method]))
+        if method == 2:
+            if not self.lazy:
+                writer.write(replies.pop())
+            _, ulen = await reader.readexactly(2)
+            username = (await reader.readexactly(ulen)).decode()
+            password = (await reader.readexactly((await reader.readexactly(1))[0])).decode()
+            if (username, password) != (self.username, self.password):
+                writer.write(b"".join(replies) + b"\x01\x01")
+                return False
+            replies.append(b"\x01\x00")
+        if not self.lazy:
+            writer.write(b"".join(replies))
+            replies = []
+        _, command, _, atyp = await reader.readexactly(4)
+        if atyp == 3:
+            host = (await reader.readexactly((await reader.readexactly(1))[0])).decode()
+        elif atyp == 1:
+            host = socket.inet_ntop(socket.AF_INET, await reader.readexactly(4))
+        else:
+            host = "[%s]" % socket.inet_ntop(socket.AF_INET6, await reader.readexactly(16))
+        port = int.from_bytes(await reader.readexactly(2), "big")
+        self.targets.append("%s:%d" % (host, port))
+        writer.write(b"".join(replies) + b"\x05\x00\x00\x03\x04host\x00\x50")
+        return True
+
+def run(coro):
+    return asyncio.run(asyncio.wait_for(coro, 5))
+
+class ProxyConnectorTest(unittest.TestCase):
+
+    def assertConnects(self, proxy, target=("example.com", 443), expected="example.com:443",
+                       **kwargs):
+        """Connect through a FakeProxy, and check that it sees the target."""
+        async def go():
+            await proxy.start()
+            connector = ProxyConnector(proxy.uri, **kwargs)
+            try:
+                reader, writer = await connector.connect(*target, payload=b"ping")
+                self.assertEqual(await reader.readexactly(9), b"echo ping")
+                writer.close()
+            finally:
+                await connector.close()
+                await proxy.close()
+        run(go())
+        self.assertEqual(proxy.targets, [expected])
+
+    def test_http(self):
+        self.assertConnects(FakeProxy("http"))
+
+    def test_http_auth(self):
+        self.assertConnects(FakeProxy("http", "user", "secret"), ("::1", 80), "[::1]:80")
+
+    def test_socks4a(self):
+        self.assertConnects(FakeProxy("socks4a", "user"))
+
+    def test_socks4a_ip(self):
+        self.assertConnects(FakeProxy("socks4a"), ("10.0.0.1", 80), "10.0.0.1:80")
+
+    def test_socks5(self):
+        self.assertConnects(FakeProxy("socks5"), ("10.0.0.1", 80), "10.0.0.1:80")
+
+    def test_socks5_auth(self):
+        self.assertConnects(FakeProxy("socks5", "user", "secret"))
+
+    def test_socks5_pipelined(self):
+        """The SOCKS5 greeting, auth and request are sent without waiting."""
+        self.assertConnects(FakeProxy("socks5", "user", "secret", lazy=True), poolSize=0)
+
+    def test_direct(self):
+        async def go():
+            proxy = await FakeProxy("http").start()
+            connector = ProxyConnector(None)
+            reader, writer = await connector.connect("127.0.0.1", proxy.uri.port,
+                payload=b"CONNECT x:1 HTTP/1.1\r\n\r\n")
+            self.assertTrue((await reader.readline()).startswith(b"HTTP/1.1 200"))
+            writer.close()
+            await proxy.close()
+        run(go())
+
+    def assertRejected(self, proxy, uri):
+        async def go():
+            await proxy.start()
+            connector = ProxyConnector(uri(proxy), poolSize=0)
+            try:
+                with self.assertRaises(ProxyConnectError):
+                    await connector.connect("example.com", 443)
+            finally:
+                await proxy.close()
+        run(go())
+
+    def test_http_bad_auth(self):
+        self.assertRejected(FakeProxy("http", "user", "secret"),
+                            lambda proxy: proxy.withCredentials("user", "wrong"))
+
+    def test_socks4a_bad_user(self):
+        self.assertRejected(FakeProxy("socks4a", "user"),
+                            lambda proxy: proxy.withCredentials("other"))
+
+    def test_socks5_bad_auth(self):
+        self.assertRejected(FakeProxy("socks5", "user", "secret"),
+                            lambda proxy: proxy.withCredentials("user", "wrong"))
+
+    def test_socks5_no_auth(self):
+        self.assertRejected(FakeProxy("socks5", "user", "secret"),
+                            lambda proxy: urlsplit("socks5://127.0.0.1:%d" % proxy.uri.port))
+
+    def test_pool(self):
+        """Probed and refilled connections are reused by connect()."""
+        async def go():
+            proxy = await FakeProxy("socks5", "user", "secret").start()
+            connector = ProxyConnector(proxy.uri, poolSize=2)
+            try:
+                await connector.probe()
+                self.assertEqual(len(connector._pool), 1)
+                connector.refill()
+                await connector._filling
+                self.assertEqual((len(connector._pool), proxy.connections), (2, 2))
+                for i in range(2):
+                    reader, writer = await connector.connect("example.com", 443, b"ping")
+                    self.assertEqual(await reader.readexactly(9), b"echo ping")
+                    writer.close()
+                self.assertEqual(len(proxy.targets), 2)
+            finally:
+                await connector.close()
+                await proxy.close()
+        run(go())
+
+    def test_probe_needs_target(self):
+        """http and socks4a proxies are only probed with a real request."""
+        async def go(scheme):
+            proxy = await FakeProxy(scheme, "user", "secret").start()
+            connector = ProxyConnector(proxy.withCredentials("other", "wrong"))
+            try:
+                self.assertTrue(connector.needsProbeTarget())
+                with self.assertRaises(ValueError):
+                    await connector.probe()
+                with self.assertRaises(ProxyConnectError):
+                    await connector.probe(("example.com", 443))
+            finally:
+                await connector.close()
+                await proxy.close()
+            self.assertEqual(proxy.connections, 1)
+        for scheme in ("http", "socks4a"):
+            run(go(scheme))
+        self.assertFalse(ProxyConnector(urlsplit("socks5://127.0.0.1:1")).needsProbeTarget())
+        self.assertFalse(ProxyConnector(None).needsProbeTarget())
+
+    def test_probe_unreachable(self):
+        async def go():
+            sock = socket.socket()
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+            sock.close()
+            connector = ProxyConnector(urlsplit("socks5://127.0.0.1:%d" % port))
+            with self.assertRaises(OSError):
+                await connector.probe()
+        run(go())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,12 @@
 import os
+import signal
+import tempfile
 import unittest
 
+from io import StringIO
+
 from pyptlib.config import EnvError, Config
-from pyptlib.server_config import get_transport_options_impl
+from pyptlib.server_config import ServerConfig, get_transport_options_impl
 from pyptlib.server import ServerTransportPlugin
 from pyptlib.test.test_core import PluginCoreTestMixin
 from pyptlib.core import SUPPORTED_TRANSPORT_VERSIONS
@@ -173,6 +177,17 @@ class testServerOutput(PluginCoreTestMixin, unittest.TestCase):
 
         self.assertIn("SMETHOD boom 127.0.0.1:6666 ARGS:roots=culture,first=fire\n", self.getOutputLines())
 
+    def test_smethod_line_args_escaped(self):
+        """Parsed options are escaped again in the ARGS of SMETHOD lines."""
+        TEST_ENVIRON = dict(BASE_ENVIRON)
+        TEST_ENVIRON["TOR_PT_SERVER_TRANSPORT_OPTIONS"] = r"boom:cert=AAAA==;boom:x=a\;b,c\\d"
+        os.environ = TEST_ENVIRON
+        self.plugin.init(["dummy", "boom"])
+        self.plugin.reportMethodSuccess("boom", ("127.0.0.1", 6666), None)
+
+        self.assertIn(r"SMETHOD boom 127.0.0.1:6666 ARGS:cert=AAAA\=\=,x=a;b\,c\\d" "\n",
+                      self.getOutputLines())
+
     def test_smethod_line_explicit_args(self):
         """Test an SMETHOD line with extra arguments."""
         os.environ = BASE_ENVIRON
@@ -183,6 +198,78 @@ class testServerOutput(PluginCoreTestMixin, unittest.TestCase):
 
         self.assertIn("SMETHOD boom 127.0.0.1:6666 ARGS:roots=culture,first=fire\n", self.getOutputLines())
 
+    def test_launchTransports(self):
+        """Test that launchers get the bind addresses, in priority order."""
+        os.environ = BASE_ENVIRON
+        self.plugin.init(["boom", "dummy"])
+        seen = []
+        def launch(name, bindaddr):
+            seen.append((name, bindaddr))
+            return (bindaddr, None)
+        self.plugin.launchTransports(launch)
+
+        self.assertEqual(sorted(seen), [("boom", ('127.0.0.1', 6666)), ("dummy", ('127.0.0.1', 5556))])
+        self.assertEqual(self.getOutputLines(), [
+            "VERSION 1\n",
+            "SMETHOD boom 127.0.0.1:6666\n",
+            "SMETHOD dummy 127.0.0.1:5556\n",
+            "SMETHODS DONE\n"])
+
+class testServerReload(unittest.TestCase):
+    """
+    Test reloading the server transport options of live transports.
+    """
+
+    def setUp(self):
+        config = ServerConfig(tempfile.mkdtemp(), transports=["dummy", "boom"],
+            serverBindAddr={"dummy": ("127.0.0.1", 5556), "boom": ("127.0.0.1", 6666)},
+            serverTransportOptions={"boom": {"cert": "old"}, "dummy": {"k": "v"}})
+        self.plugin = ServerTransportPlugin(config=config, stdout=StringIO())
+        self.calls = []
+        for name in ["dummy", "boom", "new"]:
+            self.plugin.addReloadCallback(name, lambda *args: self.calls.append(args))
+
+    def test_reload_changed_only(self):
+        changed = self.plugin.reloadOptions("boom:cert=new;dummy:k=v;new:a=b")
+        self.assertEqual(changed, ["boom", "new"])
+        self.assertEqual(self.calls, [("boom", {"cert": "new"}, {"cert": "old"}),
+                                      ("new", {"a": "b"}, {})])
+        self.assertEqual(self.plugin.config.serverTransportOptions["boom"]["cert"], "new")
+        self.assertEqual(self.plugin.config.serverBindAddr["boom"], ("127.0.0.1", 6666))
+
+    def test_reload_removed(self):
+        self.assertEqual(self.plugin.reloadOptions(""), ["boom", "dummy"])
+        self.assertEqual(self.calls[1], ("dummy", {}, {"k": "v"}))
+
+    def test_reload_bad(self):
+        config = self.plugin.config
+        self.assertRaises(ValueError, self.plugin.reloadOptions, "boom:novalue")
+        self.assertRaises(OSError, self.plugin.reloadOptions)
+        self.assertIs(self.plugin.config, config)
+        self.assertEqual(self.calls, [])
+
+    def test_reload_callback_error(self):
+        def fail(*args):
+            raise ValueError("bad cert")
+        self.plugin.addReloadCallback("boom", fail)
+        self.plugin.reloadOptions("boom:cert=new;dummy:k=v2")
+        self.assertEqual([call[0] for call in self.calls], ["boom", "dummy"])
+        self.assertEqual(self.plugin.stdout.getvalue().splitlines(),
+            ['LOG SEVERITY=error MESSAGE="Could not apply new options of boom: bad cert"'])
+
+    def test_autoReload(self):
+        with open(self.plugin.getTransportOptionsPath(), "w") as f:
+            f.write("boom:cert=new;dummy:k=v\n")
+        old = signal.getsignal(signal.SIGHUP)
+        try:
+            self.plugin.autoReload()
+            os.kill(os.getpid(), signal.SIGHUP)
+        finally:
+            signal.signal(signal.SIGHUP, old)
+        self.assertEqual([call[0] for call in self.calls], ["boom"])
+        self.assertEqual(self.plugin.stdout.getvalue(), 'LOG SEVERITY=notice MESSAGE='
+            '"Reloaded server transport options; changed: boom"\n')
+
 class testUtils(unittest.TestCase):
     def test_get_transport_options_wrong(self):
         """Invalid options string"""
@@ -201,6 +288,33 @@ class testUtils(unittest.TestCase):
         result = get_transport_options_impl(to_parse)
         self.assertEqual(result, expected)
 
+    def test_get_transport_options_escaped(self):
+        """Backslash-escaped separators are part of names, keys and values."""
+        to_parse = r"tre\:buchet:sec\=ret=n\;o\\u;ballista:path=C\:\\x"
+        expected = {"tre:buchet" : {"sec=ret" : "n;o\\u"}, "ballista" : {"path" : "C:\\x"} }
+        self.assertEqual(get_transport_options_impl(to_parse), expected)
+
+    def test_get_transport_options_unescaped_in_value(self):
+        """Unescaped ':' and '=' after the key are part of the value."""
+        to_parse = "obfs4:cert=AAAA+/b==;obfs4:url=http://x:80/?a=b"
+        expected = {"obfs4" : {"cert" : "AAAA+/b==", "url" : "http://x:80/?a=b"} }
+        self.assertEqual(get_transport_options_impl(to_parse), expected)
+
+    def test_get_transport_options_trailing_backslash(self):
+        self.assertRaises(ValueError, get_transport_options_impl, "trebuchet:secret=nou\\")
+
+    def test_get_transport_options_empty_param(self):
+        self.assertRaises(ValueError, get_transport_options_impl, "trebuchet:secret=nou;")
+        self.assertRaises(ValueError, get_transport_options_impl, "")
+
+    def test_get_transport_options_long(self):
+        """Long values and many options."""
+        cert = "A" * 4096 + "=="
+        to_parse = ";".join("t%d:cert=%s;t%d:iat-mode=%d" % (i, cert, i, i % 3) for i in range(50))
+        result = get_transport_options_impl(to_parse)
+        self.assertEqual(len(result), 50)
+        self.assertEqual(result["t49"], {"cert" : cert, "iat-mode" : "1"})
+
 if __name__ == '__main__':
     unittest.main()
 
@@ -0,0 +1,165 @@
+import asyncio
+import io
+import unittest
+
+from pyptlib import socks
+from pyptlib.client import ClientTransportPlugin
+from pyptlib.client_config import ClientConfig
+from pyptlib.socks import SocksServer, parseClientArgs
+
+def socks5_hello(userpass=None):
+    if userpass is None:
+        return b"\x05\x01\x00"
+    username, password = userpass
+    return (b"\x05\x01\x02" + bytes([1, len(username)]) + username
+            + bytes([len(password)]) + password)
+
+SOCKS5_CONNECT_DOMAIN = b"\x05\x01\x00\x03\x0bexample.com\x01\xbb"
+SOCKS5_CONNECT_IPV6 = b"\x05\x01\x00\x04" + b"\x00" * 15 + b"\x01\x00\x50"
+
+class SocksServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.requests = []
+        self.errors = []
+        self.action = "accept"
+
+    async def handle(self, request):
+        self.requests.append(request)
+        if self.action == "accept":
+            reader, writer = await request.accept(("127.0.0.1", 4321))
+            writer.write(b"hello " + await reader.readexactly(4))
+        elif self.action == "reject":
+            await request.reject(socks.CONNECTION_REFUSED)
+        elif self.action == "raise":
+            raise ValueError("boom")
+        elif self.action == "accept-raise":
+            await request.accept(("127.0.0.1", 4321))
+            raise ValueError("boom")
+
+    def converse(self, data, replyLength, then=b""):
+        """
+        Send `data` to a fresh SocksServer, read `replyLength` bytes of reply,
+        then send `then` and return the reply and everything after it.
+        """
+        async def run():
+            asyncio.get_running_loop().set_exception_handler(
+                lambda loop, context: self.errors.append(context))
+            server = SocksServer(self.handle)
+            addrport = await server.start()
+            try:
+                reader, writer = await asyncio.open_connection(*addrport)
+                writer.write(data)
+                reply = await reader.readexactly(replyLength)
+                writer.write(then)
+                rest = await reader.read()
+                writer.close()
+                return reply, rest
+            finally:
+                server.close()
+                await server.wait_closed()
+        return asyncio.run(run())
+
+    def test_socks5_noauth(self):
+        reply, rest = self.converse(socks5_hello() + SOCKS5_CONNECT_DOMAIN, 12, b"ping")
+        self.assertEqual(reply, b"\x05\x00" + b"\x05\x00\x00\x01\x7f\x00\x00\x01\x10\xe1")
+        self.assertEqual(rest, b"hello ping")
+        request, = self.requests
+        self.assertEqual((request.version, request.host, request.port, request.args),
+                         (5, "example.com", 443, {}))
+
+    def test_socks5_args(self):
+        """Arguments are split across the username and password."""
+        hello = socks5_hello((b"shared-secret=rah", b"asia;cert=a\\;b"))
+        reply, rest = self.converse(hello + SOCKS5_CONNECT_IPV6, 14, b"ping")
+        self.assertEqual(reply[:4], b"\x05\x02\x01\x00")
+        request, = self.requests
+        self.assertEqual((request.host, request.port), ("::1", 80))
+        self.assertEqual(request.args, {"shared-secret": "rahasia", "cert": "a;b"})
+
+    def test_socks5_args_nul_password(self):
+        hello = socks5_hello((b"k=v", b"\0"))
+        self.converse(hello + SOCKS5_CONNECT_DOMAIN, 14, b"ping")
+        self.assertEqual(self.requests[0].args, {"k": "v"})
+
+    def test_socks5_bad_args(self):
+        hello = socks5_hello((b"novalue", b"\0"))
+        reply, rest = self.converse(hello + SOCKS5_CONNECT_DOMAIN, 4)
+        self.assertEqual(reply, b"\x05\x02\x01\x01")
+        self.assertEqual(self.requests, [])
+
+    def test_socks5_reject(self):
+        self.action = "reject"
+        reply, rest = self.converse(socks5_hello() + SOCKS5_CONNECT_DOMAIN, 4)
+        self.assertEqual(reply, b"\x05\x00\x05\x05")
+
+    def test_socks5_handler_error(self):
+        """A handler that fails has its request rejected."""
+        self.action = "raise"
+        reply, rest = self.converse(socks5_hello() + SOCKS5_CONNECT_DOMAIN, 4)
+        self.assertEqual(reply, b"\x05\x00\x05\x01")
+        error, = self.errors
+        self.assertEqual(error["message"], "SOCKS handler failed for example.com:443")
+        self.assertIsInstance(error["exception"], ValueError)
+
+    def test_socks5_handler_error_after_reply(self):
+        """A handler that fails after accepting is logged, and disconnected."""
+        self.action = "accept-raise"
+        reply, rest = self.converse(socks5_hello() + SOCKS5_CONNECT_DOMAIN, 12)
+        self.assertEqual(reply[2:4], b"\x05\x00")
+        self.assertEqual(rest, b"")
+        error, = self.errors
+        self.assertEqual(error["message"], "SOCKS handler failed for example.com:443")
+
+    def test_socks5_bind_unsupported(self):
+        reply, rest = self.converse(socks5_hello() + b"\x05\x02" + SOCKS5_CONNECT_DOMAIN[2:], 4)
+        self.assertEqual(reply, b"\x05\x00\x05\x07")
+        self.assertEqual(self.requests, [])
+
+    def test_socks4(self):
+        request = b"\x04\x01\x01\xbb\x0a\x00\x00\x01k=v\0"
+        reply, rest = self.converse(request, 8, b"ping")
+        self.assertEqual(reply, b"\x00\x5a\x10\xe1\x7f\x00\x00\x01")
+        self.assertEqual(rest, b"hello ping")
+        request, = self.requests
+        self.assertEqual((request.version, request.host, request.port, request.args),
+                         (4, "10.0.0.1", 443, {"k": "v"}))
+
+    def test_socks4a(self):
+        request = b"\x04\x01\x01\xbb\x00\x00\x00\x01\0example.com\0"
+        reply, rest = self.converse(request, 8, b"ping")
+        self.assertEqual(reply[:2], b"\x00\x5a")
+        self.assertEqual(self.requests[0].host, "example.com")
+
+    def test_socks4_reject(self):
+        self.action = "reject"
+        reply, rest = self.converse(b"\x04\x01\x01\xbb\x0a\x00\x00\x01\0", 8)
+        self.assertEqual(reply[:2], b"\x00\x5b")
+
+    def test_launch(self):
+        """launch() reports the CMETHOD line for the listening address."""
+        stdout = io.StringIO()
+        plugin = ClientTransportPlugin(config=ClientConfig("/pt_stat"), stdout=stdout)
+        async def run():
+            server = SocksServer(self.handle)
+            addrport = await server.launch(plugin, "rot13")
+            server.close()
+            await server.wait_closed()
+            return addrport
+        addr, port = asyncio.run(run())
+        self.assertEqual(stdout.getvalue(), "CMETHOD rot13 socks5 %s:%d\n" % (addr, port))
+
+class ParseClientArgsTest(unittest.TestCase):
+
+    def test_parse(self):
+        self.assertEqual(parseClientArgs(""), {})
+        self.assertEqual(parseClientArgs("a=1;b=2;"), {"a": "1", "b": "2"})
+        self.assertEqual(parseClientArgs(r"a=x\=y\\;b\;c=="), {"a": "x=y\\", "b;c": "="})
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, parseClientArgs, "a")
+        self.assertRaises(ValueError, parseClientArgs, "a=1;b")
+        self.assertRaises(ValueError, parseClientArgs, "a=1\\")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import socket
+import unittest
+
+from io import StringIO
+
+from pyptlib.listeners import ListenerSet
+from pyptlib.server import ServerTransportPlugin
+from pyptlib.server_config import ServerConfig
+from pyptlib.tuning import SocketTuning, isTuningKey, raiseFileLimit
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+class SocketTuningTest(unittest.TestCase):
+
+    def test_fromOptions(self):
+        tuning = SocketTuning.fromOptions({"pyptlib-nodelay": "1", "pyptlib-sndbuf": "65536",
+                                           "cert": "ignored"})
+        self.assertEqual((tuning.nodelay, tuning.sndbuf, tuning.rcvbuf), (True, 65536, None))
+        self.assertEqual(tuning.describe(), "nodelay=1, sndbuf=65536")
+        self.assertFalse(SocketTuning.fromOptions(None))
+        self.assertEqual(SocketTuning().describe(), "none")
+
+    def test_fromOptions_invalid(self):
+        for options in [{"pyptlib-sndbuf": "big"}, {"pyptlib-rcvbuf": "-1"},
+                        {"pyptlib-nodelay": "2"}, {"pyptlib-whatever": "1"}]:
+            self.assertRaises(ValueError, SocketTuning.fromOptions, options)
+
+    def test_isTuningKey(self):
+        self.assertTrue(isTuningKey("pyptlib-sndbuf"))
+        self.assertFalse(isTuningKey("cert"))
+
+    def test_listener_and_accepted(self):
+        tuning = SocketTuning(nodelay=True, rcvbuf=32768)
+        listeners = ListenerSet()
+        listeners.bind({"rot13": ("127.0.0.1", 0)}, tuning={"rot13": tuning})
+        listener = listeners.sockets["rot13"]
+        try:
+            # Linux doubles the requested buffer size
+            self.assertGreaterEqual(listener.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF), 32768)
+            client = socket.create_connection(listener.getsockname())
+            conn, _ = listener.accept()
+            tuning.applyAccepted(conn)
+            self.assertTrue(conn.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY))
+            conn.close()
+            client.close()
+        finally:
+            listeners.close()
+
+class FileLimitTest(unittest.TestCase):
+
+    def setUp(self):
+        if resource is None:
+            self.skipTest("resource limits not supported")
+        self.orig = resource.getrlimit(resource.RLIMIT_NOFILE)
+
+    def tearDown(self):
+        resource.setrlimit(resource.RLIMIT_NOFILE, self.orig)
+
+    def test_raise(self):
+        soft, hard = self.orig
+        if hard != resource.RLIM_INFINITY and hard < 64:
+            self.skipTest("hard limit too low")
+        resource.setrlimit(resource.RLIMIT_NOFILE, (32, hard))
+        self.assertEqual(raiseFileLimit(64), (32, 64))
+        self.assertEqual(resource.getrlimit(resource.RLIMIT_NOFILE), (64, hard))
+        self.assertEqual(raiseFileLimit(48), (64, 64))
+
+class PluginTuningTest(unittest.TestCase):
+
+    def setUp(self):
+        # tune=True raises the open file limit of the test process
+        if resource is not None:
+            self.orig = resource.getrlimit(resource.RLIMIT_NOFILE)
+
+    def tearDown(self):
+        if resource is not None:
+            resource.setrlimit(resource.RLIMIT_NOFILE, self.orig)
+
+    def test_init_reports(self):
+        config = ServerConfig("/pt_stat", transports=["rot13", "bad"],
+            serverBindAddr={"rot13": ("127.0.0.1", 5556), "bad": ("127.0.0.1", 6666)},
+            serverTransportOptions={"rot13": {"pyptlib-sndbuf": "65536", "key": "k"},
+                                    "bad": {"pyptlib-sndbuf": "lots"}})
+        plugin = ServerTransportPlugin(config=config, stdout=StringIO(), tune=True)
+        plugin.init(["rot13", "bad"])
+        plugin.reportMethodSuccess("rot13", ("127.0.0.1", 5556), None)
+        lines = plugin.stdout.getvalue().splitlines()
+        self.assertEqual(lines[0], "VERSION 1")
+        self.assertTrue(lines[1].startswith("LOG "), lines[1])
+        self.assertIn('LOG SEVERITY=notice MESSAGE="Socket options configured for rot13: sndbuf=65536"', lines)
+        self.assertIn('LOG SEVERITY=warning MESSAGE="Ignoring socket options of bad: '
+                      'Invalid value for pyptlib-sndbuf (lots)"', lines)
+        self.assertEqual(lines[-1], "SMETHOD rot13 127.0.0.1:5556 ARGS:key=k")
+        self.assertEqual(plugin.socketTuning["rot13"].sndbuf, 65536)
+        self.assertNotIn("bad", plugin.socketTuning)
+
+    def test_not_tuned_by_default(self):
+        plugin = ServerTransportPlugin(config=ServerConfig("/pt_stat"), stdout=StringIO())
+        plugin.init([])
+        self.assertEqual(plugin.stdout.getvalue(), "VERSION 1\n")
+        self.assertEqual(plugin.socketTuning, {})
+
+if __name__ == '__main__':
+    unittest.main()
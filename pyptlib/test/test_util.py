@@ -1,3 +1,4 @@
+import random
 import unittest
 
 import pyptlib.util
@@ -30,5 +31,87 @@ class ParseAddrSpecTest(unittest.TestCase):
         """Test that parse_addr_spec does not do DNS resolution by default."""
         self.assertRaises(ValueError, pyptlib.util.parse_addr_spec, "example.com")
 
+def reference_parse_addr_spec(spec, defhost=None, defport=None):
+    """parse_addr_spec without the fast path or cache, i.e. always via libc."""
+    host, port, af = pyptlib.util._split_addr_spec(spec, defhost, defport)
+    return pyptlib.util._resolve_addr(host, port, af)
+
+def outcome(f, *args):
+    try:
+        return f(*args)
+    except ValueError as e:
+        return ("ValueError", str(e))
+
+def addr_spec_corpus(n, seed=1234):
+    """Generate n (spec, defhost, defport) triples, many of them malformed."""
+    rng = random.Random(seed)
+    def octet():
+        if rng.random() < 0.9:
+            return str(rng.randint(0, 255))
+        return rng.choice([str(rng.randint(0, 999)),
+                           "0" + str(rng.randint(0, 99)), "0", "00", "", "x1", "0x7f"])
+    def ipv4():
+        return ".".join(octet() for _ in range(rng.choice([4, 4, 4, 4, 3, 2, 5])))
+    def ipv6():
+        groups = ["%x" % rng.randint(0, 0xffff) for _ in range(8)]
+        i = rng.randint(0, 7)
+        j = rng.randint(i, 8)
+        form = rng.randint(0, 5)
+        if form == 0:
+            return ":".join(groups)
+        if form == 1:
+            return ":".join(groups[:i]) + "::" + ":".join(groups[j:])
+        if form == 2:
+            return ":".join(groups[:6]).upper()
+        if form == 3:
+            return "::ffff:" + ipv4()
+        if form == 4:
+            return "::" + ipv4()
+        return rng.choice(["::", "::1", "fe80::1%lo", "1::2::3", "0:0:0:0:0:0:0:1", ":::"])
+    def port():
+        if rng.random() < 0.7:
+            return str(rng.randint(0, 65535))
+        return rng.choice([str(rng.randint(65536, 99999)),
+                           "0" + str(rng.randint(0, 9999)), "", "http", "-1", "123456", "\u0661"])
+    for _ in range(n):
+        kind = rng.randint(0, 4)
+        defhost = rng.choice([None, None, "192.168.0.1", "1234::1"])
+        defport = rng.choice([None, None, 9999, "8080"])
+        if kind == 0:
+            yield ipv4() + ":" + port(), defhost, defport
+        elif kind == 1:
+            yield "[" + ipv6() + "]:" + port(), defhost, defport
+        elif kind == 2:
+            yield "[" + ipv6() + "]", defhost, defport
+        elif kind == 3:
+            yield rng.choice([ipv4(), ":" + port(), "", ":", ipv4() + ":"]), defhost, defport
+        else:
+            yield "[" + ipv4() + "]:" + port(), defhost, defport
+
+class ParseAddrSpecFastPathTest(unittest.TestCase):
+    def setUp(self):
+        pyptlib.util._ADDR_CACHE.clear()
+
+    def test_differential(self):
+        """The fast path and cache give exactly the same results as libc."""
+        for spec, defhost, defport in addr_spec_corpus(20000):
+            expected = outcome(reference_parse_addr_spec, spec, defhost, defport)
+            for _ in range(2): # miss, then (maybe) hit
+                self.assertEqual(outcome(pyptlib.util.parse_addr_spec, spec, defhost, defport),
+                                 expected, (spec, defhost, defport))
+
+    def test_cache_bounded(self):
+        for i in range(pyptlib.util._ADDR_CACHE_SIZE + 100):
+            pyptlib.util.parse_addr_spec("10.0.%d.%d:80" % (i // 256, i % 256))
+        self.assertEqual(len(pyptlib.util._ADDR_CACHE), pyptlib.util._ADDR_CACHE_SIZE)
+        self.assertNotIn(("10.0.0.0:80", None, None), pyptlib.util._ADDR_CACHE)
+
+    def test_cache_lru(self):
+        pyptlib.util.parse_addr_spec("10.0.0.0:80")
+        for i in range(1, pyptlib.util._ADDR_CACHE_SIZE + 100):
+            pyptlib.util.parse_addr_spec("10.0.0.0:80")
+            pyptlib.util.parse_addr_spec("10.0.%d.%d:80" % (i // 256, i % 256))
+        self.assertIn(("10.0.0.0:80", None, None), pyptlib.util._ADDR_CACHE)
+
 if __name__ == "__main__":
     unittest.main()
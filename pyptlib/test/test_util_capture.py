@@ -0,0 +1,55 @@
+import os
+import tempfile
+import unittest
+
+from pyptlib.util.capture import RingBuffer, RotatingFile, capture_pipe
+
+class RingBufferTest(unittest.TestCase):
+
+    def test_wraparound(self):
+        ring = RingBuffer(8)
+        ring.write(b"abc")
+        self.assertEqual(ring.getvalue(), b"abc")
+        ring.write(b"defgh")
+        self.assertEqual(ring.getvalue(), b"abcdefgh")
+        ring.write(b"ijk")
+        self.assertEqual(ring.getvalue(), b"defghijk")
+        self.assertEqual((len(ring), ring.total), (8, 11))
+
+    def test_overlong_write(self):
+        ring = RingBuffer(4)
+        ring.write(b"ab")
+        ring.write(b"0123456789")
+        self.assertEqual(ring.getvalue(), b"6789")
+        ring.write(b"x")
+        self.assertEqual(ring.getvalue(), b"789x")
+
+class RotatingFileTest(unittest.TestCase):
+
+    def test_rotate(self):
+        path = os.path.join(tempfile.mkdtemp(), "out")
+        spill = RotatingFile(path, max_bytes=4, backups=2)
+        for chunk in [b"aaa", b"bbb", b"ccc", b"ddd"]:
+            spill.write(chunk)
+        spill.close()
+        contents = [open(p, "rb").read() for p in [path, path + ".1", path + ".2"]]
+        self.assertEqual(contents, [b"ddd", b"ccc", b"bbb"])
+        self.assertFalse(os.path.exists(path + ".3"))
+
+class CapturePipeTest(unittest.TestCase):
+
+    def test_many_pipes(self):
+        """One background thread drains every pipe until its end."""
+        captures = []
+        for i in range(5):
+            r, w = os.pipe()
+            captures.append((capture_pipe(r, size=16), w))
+        for i, (capture, w) in enumerate(captures):
+            os.write(w, b"%d" % i * 100)
+            os.close(w)
+        for i, (capture, w) in enumerate(captures):
+            self.assertTrue(capture.wait(5))
+            self.assertEqual(capture.getvalue(), b"%d" % i * 16)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,179 @@
+import asyncio
+import socket
+import time
+import unittest
+
+from pyptlib.util.dialer import Dialer, interleave
+
+V6 = (socket.AF_INET6, ("2001:db8::1", 443, 0, 0))
+V6_2 = (socket.AF_INET6, ("2001:db8::2", 443, 0, 0))
+V4 = (socket.AF_INET, ("192.0.2.1", 443))
+V4_2 = (socket.AF_INET, ("192.0.2.2", 443))
+
+class FakeWriter(object):
+    def __init__(self, addr):
+        self.addr = addr
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+class FakeNetwork(object):
+    """
+    Simulates connection attempts: each address either connects after a
+    delay, is refused after a delay, or is black-holed and never answers.
+    """
+
+    def __init__(self, **behaviour):
+        self.behaviour = behaviour # addr -> ("ok" | "refuse" | "blackhole", delay)
+        self.attempts = []
+        self.cancelled = []
+
+    async def connect(self, family, sockaddr):
+        addr = sockaddr[0]
+        self.attempts.append(addr)
+        kind, delay = self.behaviour[addr]
+        try:
+            if kind == "blackhole":
+                await asyncio.sleep(3600)
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            self.cancelled.append(addr)
+            raise
+        if kind == "refuse":
+            raise ConnectionRefusedError("refused by %s" % addr)
+        return None, FakeWriter(addr)
+
+def run(coro):
+    return asyncio.run(coro)
+
+class DialerTest(unittest.TestCase):
+
+    def timedRace(self, dialer, candidates, key=("bridge", 443)):
+        async def go():
+            start = time.monotonic()
+            reader, writer = await dialer.race(key, candidates)
+            return writer.addr, time.monotonic() - start
+        return run(go())
+
+    def test_blackholed_ipv6(self):
+        """A black-holed IPv6 address only costs the attempt delay."""
+        net = FakeNetwork(**{"2001:db8::1": ("blackhole", 0), "192.0.2.1": ("ok", 0.01)})
+        dialer = Dialer(attemptDelay=0.1, connect=net.connect)
+        addr, elapsed = self.timedRace(dialer, [V4, V6])
+        self.assertEqual(addr, "192.0.2.1")
+        self.assertEqual(net.attempts, ["2001:db8::1", "192.0.2.1"])
+        self.assertEqual(net.cancelled, ["2001:db8::1"])
+        self.assertLess(elapsed, 0.5)
+
+    def test_family_cache(self):
+        """The winning family is tried first next time."""
+        net = FakeNetwork(**{"2001:db8::1": ("blackhole", 0), "192.0.2.1": ("ok", 0.01)})
+        dialer = Dialer(attemptDelay=0.1, connect=net.connect)
+        self.timedRace(dialer, [V6, V4])
+        self.assertEqual(dialer.preferredFamily(("bridge", 443)), socket.AF_INET)
+        del net.attempts[:]
+        addr, elapsed = self.timedRace(dialer, [V6, V4])
+        self.assertEqual(net.attempts, ["192.0.2.1"])
+        self.assertLess(elapsed, 0.09)
+        # other bridges are not affected
+        self.assertEqual(dialer.preferredFamily(("other", 443)), socket.AF_INET6)
+
+    def test_family_cache_expiry(self):
+        now = [0]
+        net = FakeNetwork(**{"2001:db8::1": ("refuse", 0), "192.0.2.1": ("ok", 0)})
+        dialer = Dialer(familyTtl=10, connect=net.connect, clock=lambda: now[0])
+        self.timedRace(dialer, [V6, V4])
+        self.assertEqual(dialer.preferredFamily(("bridge", 443)), socket.AF_INET)
+        now[0] = 11
+        self.assertEqual(dialer.preferredFamily(("bridge", 443)), socket.AF_INET6)
+
+    def test_refused_starts_next(self):
+        """A failed attempt starts the next one without waiting."""
+        net = FakeNetwork(**{"2001:db8::1": ("refuse", 0.01), "192.0.2.1": ("ok", 0.01)})
+        dialer = Dialer(attemptDelay=1, connect=net.connect)
+        addr, elapsed = self.timedRace(dialer, [V6, V4])
+        self.assertEqual(addr, "192.0.2.1")
+        self.assertLess(elapsed, 0.5)
+
+    def test_slow_first_wins(self):
+        """An earlier attempt that completes first still wins; losers are closed."""
+        net = FakeNetwork(**{"2001:db8::1": ("ok", 0.05), "192.0.2.1": ("ok", 0.2)})
+        dialer = Dialer(attemptDelay=0.01, connect=net.connect)
+        addr, elapsed = self.timedRace(dialer, [V6, V4])
+        self.assertEqual(addr, "2001:db8::1")
+        self.assertEqual(net.cancelled, ["192.0.2.1"])
+
+    def test_all_fail(self):
+        net = FakeNetwork(**{"2001:db8::1": ("refuse", 0), "192.0.2.1": ("refuse", 0)})
+        dialer = Dialer(connect=net.connect)
+        with self.assertRaises(OSError) as cm:
+            self.timedRace(dialer, [V6, V4])
+        self.assertIn("refused by 192.0.2.1", str(cm.exception))
+
+    def test_all_blackholed(self):
+        net = FakeNetwork(**{"2001:db8::1": ("blackhole", 0), "192.0.2.1": ("blackhole", 0)})
+        dialer = Dialer(attemptDelay=0.01, timeout=0.1, connect=net.connect)
+        self.assertRaises(asyncio.TimeoutError, self.timedRace, dialer, [V6, V4])
+        self.assertEqual(sorted(net.cancelled), ["192.0.2.1", "2001:db8::1"])
+
+    def test_interleave(self):
+        self.assertEqual(interleave([V4, V4_2, V6, V6_2]), [V6, V4, V6_2, V4_2])
+        self.assertEqual(interleave([V6, V6_2, V4], socket.AF_INET), [V4, V6, V6_2])
+
+    def test_dial_numeric(self):
+        net = FakeNetwork(**{"192.0.2.1": ("ok", 0)})
+        dialer = Dialer(connect=net.connect)
+        reader, writer = run(dialer.dial("192.0.2.1:443"))
+        self.assertEqual(writer.addr, "192.0.2.1")
+
+    def test_dial_bad_spec(self):
+        self.assertRaises(ValueError, run, Dialer().dial("192.0.2.1"))
+
+class LoopbackDialerTest(unittest.TestCase):
+    """
+    Real connections over loopback. An IPv6 listener whose backlog is full
+    silently drops new connection attempts, like a black-holed route.
+    """
+
+    def setUp(self):
+        self.sockets = []
+        try:
+            blackhole = self.listen(socket.AF_INET6, ("::1", 0), 0)
+        except OSError:
+            self.skipTest("IPv6 loopback not available")
+        self.port = blackhole.getsockname()[1]
+        # fill the backlog
+        filler = socket.socket(socket.AF_INET6)
+        filler.connect(("::1", self.port))
+        self.sockets.append(filler)
+        self.listen(socket.AF_INET, ("127.0.0.1", self.port), 16)
+
+    def tearDown(self):
+        for sock in self.sockets:
+            sock.close()
+
+    def listen(self, family, addr, backlog):
+        sock = socket.socket(family)
+        self.sockets.append(sock)
+        sock.bind(addr)
+        sock.listen(backlog)
+        return sock
+
+    def test_blackholed_ipv6(self):
+        dialer = Dialer(attemptDelay=0.1, timeout=5)
+        async def go():
+            start = time.monotonic()
+            reader, writer = await dialer.race(("localhost", self.port), [
+                (socket.AF_INET6, ("::1", self.port, 0, 0)),
+                (socket.AF_INET, ("127.0.0.1", self.port))])
+            elapsed = time.monotonic() - start
+            peer = writer.get_extra_info("peername")
+            writer.close()
+            return peer, elapsed
+        peer, elapsed = run(go())
+        self.assertEqual(peer, ("127.0.0.1", self.port))
+        self.assertLess(elapsed, 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+import asyncio
+import os
+import subprocess
+import sys
+import unittest
+
+from pyptlib.util import subproc
+from pyptlib.util.pipes import LineReader, PipeMultiplexer, iter_lines, iter_lines_async
+
+# Print a line, then wait for stdin to close before printing the last line.
+CHILD_WAITS = ("import sys; print('first ' + sys.argv[1], flush=True); "
+               "sys.stdin.read(); sys.stdout.write('last')")
+
+def spawn(code, *args, **kwargs):
+    return subproc.Popen([sys.executable, "-c", code] + list(args),
+                         stdin=subprocess.PIPE, stdout=subprocess.PIPE, **kwargs)
+
+class LineReaderTest(unittest.TestCase):
+
+    def setUp(self):
+        r, self.w = os.pipe()
+        self.reader = LineReader(r, max_line=8)
+
+    def tearDown(self):
+        self.reader.close()
+        if self.w is not None:
+            os.close(self.w)
+
+    def test_framing(self):
+        """Lines are split correctly across reads."""
+        self.assertEqual(self.reader.read_lines(), [])
+        os.write(self.w, b"one\ntw")
+        self.assertEqual(self.reader.read_lines(), [b"one\n"])
+        os.write(self.w, b"o\nthree\n")
+        self.assertEqual(self.reader.read_lines(), [b"two\n", b"three\n"])
+
+    def test_overlong(self):
+        os.write(self.w, b"0123456789abcdef\nxyz\n")
+        self.assertEqual(self.reader.read_lines(), [b"01234567", b"89abcdef", b"\n", b"xyz\n"])
+
+    def test_eof(self):
+        os.write(self.w, b"one\npartial")
+        os.close(self.w)
+        self.w = None
+        self.assertEqual(self.reader.read_lines(), [b"one\n", b"partial"])
+        self.assertTrue(self.reader.eof)
+
+    def test_encoding(self):
+        self.reader.encoding = "utf-8"
+        os.write(self.w, "café\n".encode("utf-8"))
+        self.assertEqual(self.reader.read_lines(), ["café\n"])
+
+class MultiplexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.procs = []
+
+    def tearDown(self):
+        for proc in self.procs:
+            if proc.poll() is None:
+                proc.kill()
+            proc.wait()
+            proc.stdin.close()
+            proc.stdout.close()
+            subproc._CHILD_PROCS.remove(proc)
+
+    def spawn(self, n):
+        self.procs = [spawn(CHILD_WAITS, str(i)) for i in range(n)]
+        return self.procs
+
+    def test_many_children(self):
+        """One thread follows many children, seeing lines before they exit."""
+        procs = self.spawn(50)
+        lines = dict((proc.pid, []) for proc in procs)
+        ended = []
+        mux = PipeMultiplexer()
+        def handler(proc):
+            def handle(reader, line):
+                if line is None:
+                    ended.append(proc.pid)
+                elif not lines[proc.pid]:
+                    lines[proc.pid].append(line)
+                    # the child is still running, blocked on its stdin
+                    self.assertIsNone(proc.poll())
+                    proc.stdin.close()
+                else:
+                    lines[proc.pid].append(line)
+            return handle
+        for proc in procs:
+            mux.add(proc.stdout, handler(proc), encoding="ascii")
+        while mux:
+            mux.poll(10)
+        mux.close()
+        self.assertEqual(sorted(ended), sorted(lines))
+        for i, proc in enumerate(procs):
+            self.assertEqual(lines[proc.pid], ["first %d\n" % i, "last"])
+
+    def test_iter_lines(self):
+        procs = self.spawn(3)
+        for proc in procs:
+            proc.stdin.close()
+        index = dict((proc.stdout, i) for i, proc in enumerate(procs))
+        seen = sorted((index[pipe], line)
+                      for pipe, line in iter_lines([p.stdout for p in procs], 10))
+        self.assertEqual(seen, [(0, b"first 0\n"), (0, b"last"), (1, b"first 1\n"),
+                                (1, b"last"), (2, b"first 2\n"), (2, b"last")])
+
+    def test_iter_lines_timeout(self):
+        procs = self.spawn(1)
+        lines = list(iter_lines([procs[0].stdout], 0.5))
+        self.assertEqual(lines, [(procs[0].stdout, b"first 0\n")])
+
+    def test_async(self):
+        procs = self.spawn(20)
+        async def follow(proc):
+            lines = []
+            async for line in iter_lines_async(proc.stdout, encoding="ascii"):
+                lines.append(line)
+                proc.stdin.close()
+            return lines
+        async def run():
+            return await asyncio.gather(*[follow(proc) for proc in procs])
+        results = asyncio.run(asyncio.wait_for(run(), 10))
+        self.assertEqual(results, [["first %d\n" % i, "last"] for i in range(20)])
+
+if __name__ == '__main__':
+    unittest.main()
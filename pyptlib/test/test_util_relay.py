@@ -0,0 +1,93 @@
+import errno
+import os
+import socket
+import threading
+import unittest
+
+from pyptlib.util import relay
+
+PAYLOAD = os.urandom(1 << 20)
+
+def tcp_pair():
+    """Return two ends of a loopback TCP connection."""
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1)
+    client = socket.create_connection(listener.getsockname())
+    server, _ = listener.accept()
+    listener.close()
+    return client, server
+
+def send_and_close(sock, data):
+    sock.sendall(data)
+    sock.shutdown(socket.SHUT_WR)
+
+def recv_all(sock):
+    chunks = []
+    while True:
+        chunk = sock.recv(65536)
+        if not chunk:
+            return b"".join(chunks)
+        chunks.append(chunk)
+
+def background(target, *args):
+    t = threading.Thread(target=target, args=args)
+    t.daemon = True
+    t.start()
+    return t
+
+class RelayTest(unittest.TestCase):
+
+    def setUp(self):
+        # peer_a <-> a ==relay== b <-> peer_b
+        self.peer_a, self.a = tcp_pair()
+        self.b, self.peer_b = tcp_pair()
+
+    def tearDown(self):
+        for sock in (self.peer_a, self.a, self.b, self.peer_b):
+            sock.close()
+
+    def assertPumps(self, **kwargs):
+        sender = background(send_and_close, self.peer_a, PAYLOAD)
+        received = []
+        receiver = background(lambda: received.append(recv_all(self.peer_b)))
+        n = relay.pump(self.a, self.b, initial=b"head", **kwargs)
+        sender.join()
+        receiver.join()
+        self.assertEqual(n, len(PAYLOAD) + 4)
+        self.assertEqual(received, [b"head" + PAYLOAD])
+
+    @unittest.skipUnless(relay.SPLICE_SUPPORTED, "splice() not supported")
+    def test_pump_splice(self):
+        self.assertPumps(use_splice=True)
+
+    def test_pump_copy(self):
+        self.assertPumps(use_splice=False, bufsize=4096)
+
+    @unittest.skipUnless(relay.SPLICE_SUPPORTED, "splice() not supported")
+    def test_pump_splice_unsupported(self):
+        """Falls back to copying if splice() does not support the sockets."""
+        def splice(*args, **kwargs):
+            raise OSError(errno.EINVAL, "Invalid argument")
+        orig = os.splice
+        os.splice = splice
+        try:
+            self.assertPumps()
+        finally:
+            os.splice = orig
+
+    def test_relay(self):
+        """Both directions are relayed, and EOF is passed on."""
+        back = PAYLOAD[::-1]
+        senders = [background(send_and_close, self.peer_a, PAYLOAD),
+                   background(send_and_close, self.peer_b, back)]
+        received = {}
+        receivers = [background(lambda: received.__setitem__("b", recv_all(self.peer_b))),
+                     background(lambda: received.__setitem__("a", recv_all(self.peer_a)))]
+        self.assertEqual(relay.relay(self.a, self.b), (len(PAYLOAD), len(back)))
+        for t in senders + receivers:
+            t.join()
+        self.assertEqual(received, {"b": PAYLOAD, "a": back})
+
+if __name__ == '__main__':
+    unittest.main()
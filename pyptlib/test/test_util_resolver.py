@@ -0,0 +1,104 @@
+import asyncio
+import threading
+import time
+import unittest
+
+import pyptlib.util as util
+from pyptlib.util import resolver
+from pyptlib.util.resolver import Resolver, parse_addr_spec_async
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+    def __call__(self):
+        return self.now
+
+class ResolverTest(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.origResolve = util._resolve_addr
+        util._resolve_addr = self.fakeResolve
+        self.clock = FakeClock()
+        self.resolver = Resolver(ttl=60, negativeTtl=5, clock=self.clock)
+
+    def tearDown(self):
+        util._resolve_addr = self.origResolve
+
+    def fakeResolve(self, host, port, af, resolve=False):
+        self.assertTrue(resolve)
+        self.assertIsNot(threading.current_thread(), threading.main_thread())
+        self.calls.append(host)
+        time.sleep(0.05)
+        if host.endswith(".invalid"):
+            raise ValueError("Bad host or port: \"%s\" \"%s\": no" % (host, port))
+        return ("192.0.2.1", int(port))
+
+    def resolve(self, *specs):
+        async def run():
+            return await asyncio.gather(*[self.resolver.parse_addr_spec(s) for s in specs],
+                                        return_exceptions=True)
+        return asyncio.run(run())
+
+    def test_numeric_no_lookup(self):
+        self.assertEqual(self.resolve("127.0.0.1:80", "[::1]:81"),
+                         [("127.0.0.1", 80), ("::1", 81)])
+        self.assertEqual(self.calls, [])
+
+    def test_coalesce_concurrent(self):
+        """Concurrent lookups of one name share a single getaddrinfo."""
+        self.assertEqual(self.resolve(*["example.com:80"] * 10), [("192.0.2.1", 80)] * 10)
+        self.assertEqual(self.calls, ["example.com"])
+
+    def test_positive_ttl(self):
+        self.resolve("example.com:80")
+        self.clock.now = 59
+        self.resolve("example.com:80")
+        self.assertEqual(len(self.calls), 1)
+        self.clock.now = 61
+        self.assertEqual(self.resolve("example.com:80"), [("192.0.2.1", 80)])
+        self.assertEqual(len(self.calls), 2)
+
+    def test_negative_ttl(self):
+        results = self.resolve("nx.invalid:80", "nx.invalid:80")
+        for r in results:
+            self.assertIsInstance(r, ValueError)
+        results = self.resolve("nx.invalid:80")
+        self.assertIsInstance(results[0], ValueError)
+        self.assertEqual(len(self.calls), 1)
+        self.clock.now = 6
+        self.resolve("nx.invalid:80")
+        self.assertEqual(len(self.calls), 2)
+
+    def test_bad_spec(self):
+        self.assertIsInstance(self.resolve("[::1")[0], ValueError)
+
+    def test_bounded(self):
+        self.resolver.maxSize = 3
+        self.resolve(*["host%d.example:80" % i for i in range(5)])
+        self.assertEqual(len(self.resolver._cache), 3)
+
+    def test_invalidate(self):
+        self.resolve("example.com:80")
+        self.resolver.invalidate("example.com:80")
+        self.resolve("example.com:80")
+        self.assertEqual(len(self.calls), 2)
+
+    def test_default_per_loop(self):
+        """A lookup left pending by a closed loop is not shared with a new one."""
+        resolver._DEFAULT_RESOLVERS.clear()
+        async def start():
+            task = asyncio.ensure_future(parse_addr_spec_async("example.com:80"))
+            await asyncio.sleep(0)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(start())
+        finally:
+            loop.close()
+        self.assertEqual(asyncio.run(parse_addr_spec_async("example.com:80")),
+                         ("192.0.2.1", 80))
+
+if __name__ == '__main__':
+    unittest.main()
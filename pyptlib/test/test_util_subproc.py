@@ -1,10 +1,13 @@
 import unittest
 
+import os
 import signal
 import subprocess
+import sys
+import tempfile
 import time
 
-from pyptlib.util.subproc import auto_killall, create_sink, proc_is_alive, Popen, SINK
+from pyptlib.util.subproc import auto_killall, create_sink, proc_is_alive, Popen, CAPTURE, SINK
 from subprocess import PIPE
 
 # We ought to run auto_killall(), instead of manually calling proc.terminate()
@@ -20,11 +23,12 @@ class SubprocTest(unittest.TestCase):
         return self.id().split(".")[-1].replace("test_", "")
 
     def getMainArgs(self):
-        return ["python", "-m" "pyptlib.test.util_subproc_main", self.name()]
+        return [sys.executable, "-m" "pyptlib.test.util_subproc_main", self.name()]
 
-    def spawnMain(self, cmd=None, stdout=PIPE, **kwargs):
+    def spawnMain(self, cmd=None, stdout=PIPE, universal_newlines=True, **kwargs):
         # spawn the main test process and wait a bit for it to initialise
-        proc = Popen(cmd or self.getMainArgs(), stdout = stdout, **kwargs)
+        proc = Popen(cmd or self.getMainArgs(), stdout = stdout,
+                     universal_newlines = universal_newlines, **kwargs)
         time.sleep(0.2)
         return proc
 
@@ -43,6 +47,18 @@ class SubprocTest(unittest.TestCase):
         output = subprocess.check_output(self.getMainArgs())
         self.assertTrue(len(output) == 0)
 
+    def test_Popen_CAPTURE(self):
+        """Test that a child writing more than a pipe holds is not blocked,
+        and that its most recent output is kept."""
+        spill = os.path.join(tempfile.mkdtemp(), "child")
+        code = "import sys; sys.stderr.write('x' * 300000 + 'end')"
+        proc = Popen([sys.executable, "-c", code], stderr=CAPTURE,
+                     capture_size=1000, capture_spill=spill)
+        self.assertEqual(proc.wait(10), 0)
+        self.assertIsNone(proc.stderr)
+        self.assertEqual(proc.captured_output("stderr"), b"x" * 997 + b"end")
+        self.assertEqual(os.path.getsize(spill + ".stderr"), 300003)
+
     def test_trap_sigint_multiple(self):
         """Test that adding multiple SIGINT handlers works as expected."""
         # TODO(infinity0): KNOWN TO FAIL ON WINDOWS
@@ -54,6 +70,17 @@ class SubprocTest(unittest.TestCase):
         self.assertEqual("run h1\n", proc.stdout.readline())
         proc.terminate()
 
+    def test_trap_sigint_thread(self):
+        """Test that handlers can run in a dedicated thread, and still
+        activate after the right number of signals."""
+        proc = self.spawnMain()
+        proc.send_signal(signal.SIGINT)
+        self.assertEqual("run in pyptlib-signals\n", proc.stdout.readline())
+        proc.send_signal(signal.SIGINT)
+        self.assertEqual("run h2\n", proc.stdout.readline())
+        self.assertEqual("run in pyptlib-signals\n", proc.stdout.readline())
+        proc.terminate()
+
     def test_trap_sigint_reset(self):
         """Test that resetting SIGINT handlers works as expected."""
         # TODO(infinity0): KNOWN TO FAIL ON WINDOWS
@@ -75,6 +102,19 @@ class SubprocTest(unittest.TestCase):
         self.assertFalse(proc_is_alive(cid), "child was not killed by parent")
         proc.terminate()
 
+    def assertKillallFast(self):
+        output = subprocess.check_output(self.getMainArgs(), universal_newlines=True)
+        elapsed = float(output)
+        self.assertLess(elapsed, 0.5, "killall took %.3fs" % elapsed)
+
+    def test_killall_fast(self):
+        """Test that killall() returns as soon as its children exit."""
+        self.assertKillallFast()
+
+    def test_killall_async_fast(self):
+        """Test that killall_async() returns as soon as its children exit."""
+        self.assertKillallFast()
+
     def test_auto_killall_2_int(self):
         """Test that auto_killall works for 2-INT signals."""
         # TODO(infinity0): KNOWN TO FAIL ON WINDOWS
@@ -92,6 +132,32 @@ class SubprocTest(unittest.TestCase):
         self.assertFalse(proc_is_alive(pid), "2 INT not handled")
         self.assertFalse(proc_is_alive(cid), "2 INT not handled")
 
+    def test_auto_killall_2_int_loop(self):
+        """Test that auto_killall works for 2-INT signals, when signals are
+        dispatched in an asyncio event loop."""
+        proc = self.spawnMain()
+        pid = proc.pid
+        cid = self.readChildPid(proc)
+        proc.send_signal(signal.SIGINT)
+        proc_wait(proc, 1)
+        self.assertTrue(proc_is_alive(pid), "1 INT not ignored")
+        self.assertTrue(proc_is_alive(cid), "1 INT not ignored")
+        proc.send_signal(signal.SIGINT)
+        proc_wait(proc, 3)
+        self.assertFalse(proc_is_alive(pid), "2 INT not handled")
+        self.assertFalse(proc_is_alive(cid), "2 INT not handled")
+
+    def test_auto_killall_term_thread(self):
+        """Test that auto_killall works for TERM signals, when signals are
+        dispatched in a thread."""
+        proc = self.spawnMain()
+        pid = proc.pid
+        cid = self.readChildPid(proc)
+        proc.send_signal(signal.SIGTERM)
+        proc_wait(proc, 3)
+        self.assertFalse(proc_is_alive(pid), "TERM not handled")
+        self.assertFalse(proc_is_alive(cid), "TERM not handled")
+
     def test_auto_killall_term(self):
         """Test that auto_killall works for TERM signals."""
         # TODO(infinity0): KNOWN TO FAIL ON WINDOWS
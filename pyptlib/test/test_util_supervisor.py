@@ -0,0 +1,120 @@
+import sys
+import time
+import unittest
+
+from pyptlib.util import subproc
+from pyptlib.util.supervisor import Supervisor, RESTART, IGNORE, KILLALL
+
+def child_args(code):
+    return [sys.executable, "-c", code]
+
+EXIT_NOW = child_args("import sys; sys.exit(3)")
+SLEEP = child_args("import time; time.sleep(30)")
+
+def wait_until(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+class SupervisorTestMixin(object):
+    """
+    This class is not a TestCase but is meant to be mixed-into tests
+    for the different ways a Supervisor can watch children.
+    """
+    usePidfd = True
+
+    def setUp(self):
+        self.exits = []
+        # don't let killall() wait on children of other tests
+        self.origChildProcs = subproc._CHILD_PROCS
+        subproc._CHILD_PROCS = []
+        self.origPidfdOpen = subproc.pidfd_open
+        if not self.usePidfd:
+            subproc.pidfd_open = lambda proc: None
+        self.supervisor = Supervisor(backoff_s=0.05, max_backoff_s=0.2,
+            on_exit=lambda child, returncode: self.exits.append((child.name, returncode)))
+        self.supervisor.start()
+
+    def tearDown(self):
+        self.supervisor.stop()
+        for child in self.supervisor.children:
+            if child.proc is not None and child.proc.poll() is None:
+                child.proc.kill()
+                child.proc.wait()
+        subproc.pidfd_open = self.origPidfdOpen
+        subproc._CHILD_PROCS = self.origChildProcs
+        subproc._isTerminating = False
+        subproc._isDraining = False
+
+    def test_restart(self):
+        """A crashing child is restarted, with its restart count exposed."""
+        child = self.supervisor.spawn(EXIT_NOW, RESTART, name="crasher")
+        self.assertTrue(wait_until(lambda: child.restarts >= 3))
+        self.assertEqual(self.supervisor.restart_counts()["crasher"], child.restarts)
+        self.assertEqual(child.returncodes[:3], [3, 3, 3])
+
+    def test_restart_error(self):
+        """Restarts that fail to start the child are retried, with backoff."""
+        child = self.supervisor.spawn(EXIT_NOW, RESTART, name="missing")
+        child.args = ["/nonexistent/pyptlib-test-child"]
+        self.assertTrue(wait_until(lambda: len(child.start_errors) >= 2))
+        self.assertIsInstance(child.start_errors[0], OSError)
+        self.assertEqual(child.restarts, 0)
+        child.args = SLEEP
+        self.assertTrue(wait_until(lambda: child.restarts == 1))
+        self.assertTrue(child.is_alive())
+
+    def test_ignore(self):
+        child = self.supervisor.spawn(EXIT_NOW, IGNORE, name="once")
+        self.assertTrue(wait_until(lambda: self.exits))
+        time.sleep(0.2)
+        self.assertEqual(self.exits, [("once", 3)])
+        self.assertEqual(child.restarts, 0)
+        self.assertIsNone(child.proc)
+
+    def test_exit_event_latency(self):
+        """Exits are noticed promptly, without a polling interval."""
+        child = self.supervisor.spawn(SLEEP, IGNORE, name="sleeper")
+        time.sleep(0.2)
+        start = time.monotonic()
+        child.proc.terminate()
+        self.assertTrue(wait_until(lambda: self.exits))
+        self.assertLess(time.monotonic() - start, 0.5)
+
+    def test_no_restart_while_draining(self):
+        child = self.supervisor.spawn(child_args("import time; time.sleep(0.2)"),
+                                      RESTART, name="drained")
+        subproc.start_draining()
+        self.assertTrue(wait_until(lambda: self.exits))
+        time.sleep(0.2)
+        self.assertEqual(child.restarts, 0)
+        self.assertIsNone(child.proc)
+
+    def test_killall(self):
+        """A KILLALL child takes the other children down with it."""
+        cleaned = []
+        self.supervisor.cleanup = lambda: cleaned.append(True)
+        sleeper = self.supervisor.spawn(SLEEP, RESTART, name="sleeper")
+        proc = sleeper.proc
+        self.supervisor.spawn(child_args("import time; time.sleep(0.2)"), KILLALL, name="critical")
+        self.assertTrue(wait_until(lambda: cleaned))
+        self.assertIsNotNone(proc.poll())
+        time.sleep(0.2)
+        self.assertEqual(sleeper.restarts, 0)
+
+class SupervisorPidfdTest(SupervisorTestMixin, unittest.TestCase):
+    usePidfd = True
+
+    def setUp(self):
+        if not hasattr(subproc.os, "pidfd_open"):
+            self.skipTest("pidfds not supported")
+        SupervisorTestMixin.setUp(self)
+
+class SupervisorSigchldTest(SupervisorTestMixin, unittest.TestCase):
+    usePidfd = False
+
+if __name__ == '__main__':
+    unittest.main()
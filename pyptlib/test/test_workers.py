@@ -0,0 +1,152 @@
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import unittest
+
+from pyptlib.config import EnvError
+from pyptlib.util import subproc
+from pyptlib.util.supervisor import Supervisor
+from pyptlib.workers import WorkerPool, workerListener, formatAddrPort, \
+    WORKER_TRANSPORT_ENV, WORKER_LISTEN_ENV, WORKER_INDEX_ENV, WORKER_READY_ENV
+
+from pyptlib.test.test_util_supervisor import wait_until
+
+WORKER = [sys.executable, "-m", "pyptlib.test.util_workers_child"]
+SLEEP = [sys.executable, "-c", "import time; time.sleep(30)"]
+
+def ask(addrport):
+    """Connect to a worker and return its (name, index, pid)."""
+    conn = socket.create_connection(addrport, timeout=5)
+    try:
+        name, index, pid = conn.makefile().readline().split()
+        return name, int(index), int(pid)
+    finally:
+        conn.close()
+
+def ask_until(addrport, predicate, timeout=5):
+    """Connect to workers until predicate(replies) holds, or give up."""
+    replies = []
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            replies.append(ask(addrport))
+        except (OSError, ValueError):
+            time.sleep(0.02) # no worker has started listening yet
+            continue
+        if predicate(replies):
+            break
+    return replies
+
+@unittest.skipUnless(hasattr(socket, "SO_REUSEPORT"), "SO_REUSEPORT not supported")
+class WorkerPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.origChildProcs = subproc._CHILD_PROCS
+        subproc._CHILD_PROCS = []
+        self.pool = WorkerPool(WORKER, numWorkers=3,
+                               supervisor=Supervisor(backoff_s=0.05))
+
+    def tearDown(self):
+        self.pool.stop()
+        for worker in self.pool.workers:
+            if worker.proc is not None and worker.proc.poll() is None:
+                worker.proc.kill()
+                worker.proc.wait()
+        subproc._CHILD_PROCS = self.origChildProcs
+
+    def test_shared_address(self):
+        """All workers accept connections on the single reported address."""
+        addr, port = self.pool.launch("fish", ("127.0.0.1", 0))[0]
+        self.assertEqual(addr, "127.0.0.1")
+        self.assertNotEqual(port, 0)
+        replies = ask_until((addr, port),
+            lambda replies: len(set(index for _, index, _ in replies)) == 3)
+        self.assertEqual(set(index for _, index, _ in replies), set([0, 1, 2]))
+        self.assertEqual(set(name for name, _, _ in replies), set(["fish"]))
+
+    def test_ready(self):
+        """The address is only returned once a worker is listening."""
+        addrport = self.pool.start("fish", ("127.0.0.1", 0))
+        self.assertEqual(ask(addrport)[0], "fish")
+        for worker in self.pool.workers:
+            self.assertNotIn(WORKER_READY_ENV, worker.kwargs["env"])
+            self.assertNotIn("pass_fds", worker.kwargs)
+
+    def test_not_ready(self):
+        self.pool = WorkerPool(SLEEP, numWorkers=1, readyTimeout=0.2,
+                               supervisor=Supervisor(backoff_s=0.05))
+        self.assertRaises(TimeoutError, self.pool.start, "fish", ("127.0.0.1", 0))
+
+    def test_launch_in_thread_without_pidfd(self):
+        """Without pidfds, the supervisor must be started from the main thread."""
+        origPidfdOpen = subproc.pidfd_open
+        subproc.pidfd_open = lambda proc: None
+        try:
+            results = []
+            def launch():
+                try:
+                    results.append(self.pool.launch("fish", ("127.0.0.1", 0)))
+                except Exception as e:
+                    results.append(e)
+            thread = threading.Thread(target=launch)
+            thread.start()
+            thread.join()
+            self.assertIsInstance(results[0], RuntimeError)
+            self.assertEqual(self.pool.workers, [])
+
+            self.pool.supervisor.start()
+            thread = threading.Thread(target=launch)
+            thread.start()
+            thread.join()
+            self.assertEqual(ask(results[1][0])[0], "fish")
+        finally:
+            self.pool.stop()
+            subproc.pidfd_open = origPidfdOpen
+
+    def test_restart(self):
+        """A dead worker is restarted, on the same address."""
+        addrport = self.pool.start("fish", ("127.0.0.1", 0))
+        worker = self.pool.workers[0]
+        pid = worker.proc.pid
+        os.kill(pid, signal.SIGKILL)
+        self.assertTrue(wait_until(lambda: worker.restarts == 1))
+        replies = ask_until(addrport,
+            lambda replies: any(index == 0 for _, index, _ in replies))
+        self.assertTrue([p for _, index, p in replies if index == 0 and p != pid])
+
+    def test_killall(self):
+        """Workers are terminated by killall()."""
+        self.pool.start("fish", ("127.0.0.1", 0))
+        procs = [worker.proc for worker in self.pool.workers]
+        self.assertEqual(subproc._CHILD_PROCS, procs)
+        try:
+            subproc.killall(wait_s=5)
+        finally:
+            subproc._isTerminating = False
+        self.assertTrue(all(proc.returncode is not None for proc in procs))
+
+class WorkerListenerTest(unittest.TestCase):
+
+    def test_not_worker(self):
+        self.assertRaises(EnvError, workerListener, environ={})
+
+    @unittest.skipUnless(hasattr(socket, "SO_REUSEPORT"), "SO_REUSEPORT not supported")
+    def test_listener(self):
+        environ = {WORKER_TRANSPORT_ENV: "fish", WORKER_LISTEN_ENV: "127.0.0.1:0",
+                   WORKER_INDEX_ENV: "2"}
+        name, index, sock = workerListener(environ=environ)
+        try:
+            self.assertEqual((name, index), ("fish", 2))
+            self.assertEqual(sock.getsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT), 1)
+        finally:
+            sock.close()
+
+    def test_format_addrport(self):
+        self.assertEqual(formatAddrPort(("127.0.0.1", 80)), "127.0.0.1:80")
+        self.assertEqual(formatAddrPort(("::1", 80)), "[::1]:80")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,15 +3,17 @@
 import os
 import signal
 import sys
+import threading
 import time
 
-from pyptlib.util.subproc import auto_killall, killall, trap_sigint, Popen, SINK
+from pyptlib.util.subproc import auto_killall, killall, killall_async, trap_sigint, Popen, SINK
+from pyptlib.util.subproc import dispatch_signals_in_loop, dispatch_signals_in_thread
 from subprocess import PIPE
 
 
 def startChild(subcmd, report=False, stdout=SINK, **kwargs):
     proc = Popen(
-        ["python", "-m", "pyptlib.test.util_subproc_child", subcmd],
+        [sys.executable, "-m", "pyptlib.test.util_subproc_child", subcmd],
         stdout = stdout,
         **kwargs
     )
@@ -45,6 +47,16 @@ def main_trap_sigint_multiple(testname, *argv):
     trap_sigint(handler2, 1)
     sleepIgnoreInts(2)
 
+def handler_thread(signum=0, sframe=None):
+    print("run in %s" % threading.current_thread().name)
+    sys.stdout.flush()
+
+def main_trap_sigint_thread(testname, *argv):
+    dispatch_signals_in_thread()
+    trap_sigint(handler_thread)
+    trap_sigint(handler2, 1)
+    sleepIgnoreInts(1)
+
 def main_trap_sigint_reset(testname, *argv):
     trap_sigint(handler1)
     signal.signal(signal.SIGINT, lambda signum, sframe: None)
@@ -57,11 +69,42 @@ def main_killall_kill(testname, *argv):
     killall(wait_s=4)
     time.sleep(100)
 
+def main_killall_fast(testname, *argv):
+    children = [startChild("default") for i in range(4)]
+    time.sleep(0.5)
+    start = time.monotonic()
+    killall(wait_s=4)
+    print("%f" % (time.monotonic() - start))
+
+def main_killall_async_fast(testname, *argv):
+    import asyncio
+    children = [startChild("default") for i in range(4)]
+    time.sleep(0.5)
+    start = time.monotonic()
+    asyncio.run(killall_async(wait_s=4))
+    print("%f" % (time.monotonic() - start))
+
 def main_auto_killall_2_int(testname, *argv):
     auto_killall(1)
     child = startChild("default", True)
     child.wait()
 
+def main_auto_killall_2_int_loop(testname, *argv):
+    import asyncio
+    async def run():
+        dispatch_signals_in_loop()
+        auto_killall(1)
+        child = startChild("default", True)
+        while child.poll() is None:
+            await asyncio.sleep(0.05)
+    asyncio.run(run())
+
+def main_auto_killall_term_thread(testname, *argv):
+    dispatch_signals_in_thread()
+    auto_killall()
+    child = startChild("default", True)
+    child.wait()
+
 def main_auto_killall_term(testname, *argv):
     auto_killall()
     child = startChild("default", True)
@@ -0,0 +1,13 @@
+#!/usr/bin/python
+
+import os
+
+from pyptlib.workers import workerListener
+
+# Reply to every connection with "<transport> <worker index> <pid>".
+if __name__ == '__main__':
+    name, index, sock = workerListener()
+    while True:
+        conn, _ = sock.accept()
+        conn.sendall(("%s %d %d\n" % (name, index, os.getpid())).encode("ascii"))
+        conn.close()
@@ -0,0 +1,161 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Opt-in tuning of process limits and sockets, for high-traffic bridges.
+
+A plugin created with ``tune=True`` raises its open file limit at init (see
+:func:`raiseFileLimit`), and a server plugin also reads the socket options
+of each transport from its server transport options, using the following
+keys; see :class:`SocketTuning`:
+
+    pyptlib-nodelay: 1 to set TCP_NODELAY, 0 to clear it.
+    pyptlib-sndbuf, pyptlib-rcvbuf: Socket send and receive buffer sizes,
+        in bytes.
+    pyptlib-fastopen: Length of the TCP Fast Open queue of listeners, where
+        the platform supports TCP_FASTOPEN.
+
+For example, in torrc::
+
+    ServerTransportOptions obfs4 pyptlib-sndbuf=262144 pyptlib-fastopen=256
+
+The new file limit, and the socket options read, are reported to Tor in
+LOG messages. The socket options only take effect on the sockets that the
+transport sets them on, e.g. listeners bound with
+:func:`pyptlib.listeners.ListenerSet.bind`, and connections passed to
+:func:`SocketTuning.applyAccepted`. These keys are not passed on in the
+ARGS of SMETHOD lines.
+"""
+
+import socket
+
+OPTION_PREFIX = 'pyptlib-'
+
+# Soft limit to use when the hard limit is unlimited, as on some BSDs.
+MAX_FILE_LIMIT = 1048576
+
+
+def raiseFileLimit(limit=None):
+    """
+    Raise the soft limit on open files (RLIMIT_NOFILE) to the hard limit.
+
+    :param int limit: Raise it no further than this.
+
+    :returns: tuple -- (old, new) soft limit, or None if resource limits are
+            not supported on this platform.
+    :raises: :class:`ValueError` or :class:`OSError` if the limit could not
+            be raised.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    target = MAX_FILE_LIMIT if hard == resource.RLIM_INFINITY else hard
+    if limit is not None:
+        target = min(target, limit)
+    if soft == resource.RLIM_INFINITY or soft >= target:
+        return soft, soft
+    resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+    return soft, target
+
+def isTuningKey(key):
+    """
+    :returns: bool -- Whether `key` is a server transport option read by
+            this module, rather than by the transport.
+    """
+    return key.startswith(OPTION_PREFIX)
+
+
+class SocketTuning(object):
+    """
+    Socket options for the listeners and connections of one transport.
+
+    Each option is None if it is not set.
+
+    :var bool nodelay: Whether to set TCP_NODELAY.
+    :var int sndbuf: SO_SNDBUF, in bytes.
+    :var int rcvbuf: SO_RCVBUF, in bytes.
+    :var int fastopen: TCP_FASTOPEN queue length, for listeners.
+    :var list unsupported: Names of the options that were set, but are not
+            supported on this platform, and so are not applied.
+    """
+    KEYS = ('nodelay', 'sndbuf', 'rcvbuf', 'fastopen')
+
+    def __init__(self, nodelay=None, sndbuf=None, rcvbuf=None, fastopen=None):
+        self.nodelay = nodelay
+        self.sndbuf = sndbuf
+        self.rcvbuf = rcvbuf
+        self.fastopen = fastopen
+        self.unsupported = []
+        if fastopen is not None and not hasattr(socket, 'TCP_FASTOPEN'):
+            self.fastopen = None
+            self.unsupported.append('fastopen')
+
+    @classmethod
+    def fromOptions(cls, options):
+        """
+        :param dict options: Server transport options of one transport, or
+                None. Keys not read by this module are ignored.
+
+        :returns: :class:`SocketTuning` -- The socket options in `options`.
+        :raises: :class:`ValueError` if a key is unknown, or a value invalid.
+        """
+        values = {}
+        for key, value in (options or {}).items():
+            if not isTuningKey(key):
+                continue
+            name = key[len(OPTION_PREFIX):]
+            if name not in cls.KEYS:
+                raise ValueError("Unknown tuning option (%s)" % key)
+            try:
+                number = int(value)
+            except ValueError:
+                number = -1
+            if number < 0 or (name == 'nodelay' and number > 1):
+                raise ValueError("Invalid value for %s (%s)" % (key, value))
+            values[name] = bool(number) if name == 'nodelay' else number
+        return cls(**values)
+
+    def acceptedOptions(self):
+        """
+        :returns: list -- (level, option, value) socket options to set on
+                accepted connections.
+        """
+        options = []
+        if self.nodelay is not None:
+            options.append((socket.IPPROTO_TCP, socket.TCP_NODELAY, int(self.nodelay)))
+        if self.sndbuf is not None:
+            options.append((socket.SOL_SOCKET, socket.SO_SNDBUF, self.sndbuf))
+        if self.rcvbuf is not None:
+            options.append((socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf))
+        return options
+
+    def listenerOptions(self):
+        """
+        :returns: list -- (level, option, value) socket options to set on
+                listeners before binding, e.g. with
+                :class:`pyptlib.listeners.ListenerSet`. Buffer sizes set on
+                a listener are inherited by the connections it accepts.
+        """
+        options = self.acceptedOptions()
+        if self.fastopen is not None:
+            options.append((socket.IPPROTO_TCP, socket.TCP_FASTOPEN, self.fastopen))
+        return options
+
+    def applyAccepted(self, sock):
+        """
+        Set the options on an accepted connection.
+        """
+        for level, option, value in self.acceptedOptions():
+            sock.setsockopt(level, option, value)
+
+    def describe(self):
+        """
+        :returns: str -- The options that are set, e.g. for logging.
+        """
+        return ", ".join("%s=%d" % (name, getattr(self, name)) for name in self.KEYS
+                         if getattr(self, name) is not None) or "none"
+
+    def __bool__(self):
+        return any(getattr(self, name) is not None for name in self.KEYS)
@@ -5,9 +5,6 @@
 Utility functions.
 """
 
-import re
-import socket
-
 # Deprecated; use pyptlib.config.checkClientMode() instead.
 # TODO(infinity0): remove this when all downstream migrates to new API
 from pyptlib.config import checkClientMode
@@ -46,7 +43,45 @@ def parse_addr_spec(spec, defhost = None, defport = None, resolve = False):
     ('192.168.0.1', 9999)
     >>> parse_addr_spec("", defhost="192.168.0.1", defport=9999)
     ('192.168.0.1', 9999)
+
+    Numeric results are computed without calling the system resolver where
+    possible, and are cached.
+    """
+    if resolve:
+        return _resolve_addr(*_split_addr_spec(spec, defhost, defport), resolve=True)
+
+    key = (spec, defhost, defport)
+    addr = _ADDR_CACHE.pop(key, None)
+    if addr is None:
+        host, port, af = _split_addr_spec(spec, defhost, defport)
+        addr = _numeric_addr(host, port, af) or _resolve_addr(host, port, af)
+        if len(_ADDR_CACHE) >= _ADDR_CACHE_SIZE:
+            try:
+                del _ADDR_CACHE[next(iter(_ADDR_CACHE))]
+            except (KeyError, RuntimeError, StopIteration):
+                pass # another thread got there first
+    # (re-)insert as the most recently used entry
+    _ADDR_CACHE[key] = addr
+    return addr
+
+# Least-recently-used cache of numeric parse_addr_spec() results, keyed by
+# (spec, defhost, defport). Dicts keep insertion order, so the first key is
+# always the least recently used one.
+_ADDR_CACHE = {}
+_ADDR_CACHE_SIZE = 1024
+
+def _split_addr_spec(spec, defhost, defport):
+    """
+    Split a host:port specification into its parts.
+
+    :returns: tuple -- (host, port, af) where af is our guess at the address
+        family, or 0 if unknown.
+    :raises: ValueError if spec is not well formed.
     """
+    # imported here, to keep "import pyptlib.client" cheap
+    import re
+    import socket
+
     host = None
     port = None
     af = 0
@@ -76,8 +111,62 @@ def parse_addr_spec(spec, defhost = None, defport = None, resolve = False):
     port = port or defport
     if host is None or port is None:
         raise ValueError("Bad address specification \"%s\"" % spec)
+    return host, port, af
+
+def _numeric_addr(host, port, af):
+    """
+    Normalise a numeric address without going through the system resolver.
+
+    Only handles the canonical forms of IPv4 and IPv6 literals and decimal
+    ports, for which the result is known to be identical to that of
+    :func:`_resolve_addr`.
+
+    :returns: tuple -- (address, port), or None if the caller must fall back
+        to :func:`_resolve_addr`.
+    """
+    if isinstance(port, int) and not isinstance(port, bool):
+        if not 0 <= port <= 65535:
+            return None
+    elif (isinstance(port, str) and 0 < len(port) <= 5
+          and port.isdigit() and port.isascii() and int(port) <= 65535):
+        port = int(port)
+    else:
+        return None
+    if not isinstance(host, str) or not host.isascii():
+        return None
+
+    import socket
+    if '.' in host and ':' not in host:
+        if af not in (0, socket.AF_INET):
+            return None
+        parts = host.split('.')
+        if len(parts) != 4:
+            return None
+        for part in parts:
+            # leading zeros would be parsed as octal by inet_aton
+            if (not part.isdigit() or len(part) > 3
+                    or (len(part) > 1 and part[0] == '0') or int(part) > 255):
+                return None
+        return host, port
+    elif ':' in host and '%' not in host:
+        if af not in (0, socket.AF_INET6):
+            return None
+        try:
+            packed = socket.inet_pton(socket.AF_INET6, host)
+        except (OSError, ValueError):
+            return None
+        return socket.inet_ntop(socket.AF_INET6, packed), port
+    return None
+
+def _resolve_addr(host, port, af, resolve=False):
+    """
+    Normalise an address using the system resolver.
+
+    :returns: tuple -- (address, port)
+    :raises: ValueError if the host or port is invalid or could not be resolved.
+    """
+    import socket
 
-    # Now we have split around the colon and have a guess at the address family.
     # Forward-resolve the name into an addrinfo struct. Real DNS resolution is
     # done only if resolve is true; otherwise the address must be numeric.
     if resolve:
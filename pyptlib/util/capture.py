@@ -0,0 +1,225 @@
+"""Bounded capture of child process output.
+
+Pipes given to capture_pipe() are all drained by one background thread with
+a selector, so children never block on a full pipe. The most recent output
+of each pipe is kept in a fixed-size ring buffer, e.g. for crash reports, and
+can optionally also be spilled to size-limited rotating files.
+
+Normally this is used through subproc.Popen, with stdout or stderr set to
+subproc.CAPTURE.
+"""
+
+import os
+import selectors
+import threading
+
+DEFAULT_CAPTURE_SIZE = 64 * 1024
+DEFAULT_SPILL_SIZE = 1024 * 1024
+DEFAULT_SPILL_BACKUPS = 3
+CHUNK_SIZE = 65536
+
+
+class RingBuffer(object):
+    """Keeps the last size bytes written to it.
+
+    Attributes:
+        size: Capacity in bytes.
+        total: Number of bytes ever written.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.total = 0
+        self._buf = bytearray(size)
+        self._pos = 0 # where the next byte goes
+
+    def write(self, data):
+        n = len(data)
+        self.total += n
+        if n >= self.size:
+            self._buf[:] = data[n - self.size:]
+            self._pos = 0
+            return
+        first = min(n, self.size - self._pos)
+        self._buf[self._pos:self._pos + first] = data[:first]
+        self._buf[:n - first] = data[first:]
+        self._pos = (self._pos + n) % self.size
+
+    def getvalue(self):
+        """Return the bytes kept, oldest first."""
+        if self.total < self.size:
+            return bytes(self._buf[:self._pos])
+        return bytes(self._buf[self._pos:] + self._buf[:self._pos])
+
+    def __len__(self):
+        return min(self.total, self.size)
+
+
+class RotatingFile(object):
+    """Appends to a file, rotating it once it grows past max_bytes.
+
+    Rotation renames path to path.1, path.1 to path.2, and so on, deleting
+    the oldest file beyond backups.
+    """
+
+    def __init__(self, path, max_bytes=DEFAULT_SPILL_SIZE, backups=DEFAULT_SPILL_BACKUPS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._file = open(path, "ab")
+        self._size = self._file.tell()
+
+    def write(self, data):
+        if self._size and self._size + len(data) > self.max_bytes:
+            self._rotate()
+        self._file.write(data)
+        self._file.flush()
+        self._size += len(data)
+
+    def close(self):
+        self._file.close()
+
+    def _rotate(self):
+        self._file.close()
+        for i in range(self.backups - 1, 0, -1):
+            src = "%s.%d" % (self.path, i)
+            if os.path.exists(src):
+                os.replace(src, "%s.%d" % (self.path, i + 1))
+        if self.backups > 0:
+            os.replace(self.path, self.path + ".1")
+        self._file = open(self.path, "wb")
+        self._size = 0
+
+
+class Capture(object):
+    """Output captured from one pipe.
+
+    Attributes:
+        ring: RingBuffer with the most recent output.
+        spill: RotatingFile that all output is also written to, or None.
+    """
+
+    def __init__(self, pipe, size=DEFAULT_CAPTURE_SIZE, spill=None):
+        self.ring = RingBuffer(size)
+        self.spill = spill
+        self._pipe = pipe
+        self._fd = pipe if isinstance(pipe, int) else pipe.fileno()
+        self._lock = threading.Lock()
+        self._eof = threading.Event()
+
+    def fileno(self):
+        return self._fd
+
+    def getvalue(self):
+        """Return the most recent output, up to the ring buffer size."""
+        with self._lock:
+            return self.ring.getvalue()
+
+    def wait(self, timeout=None):
+        """Wait until the end of the pipe has been reached and drained.
+
+        Returns:
+            True, unless the timeout expired first.
+        """
+        return self._eof.wait(timeout)
+
+    def _feed(self, data):
+        with self._lock:
+            self.ring.write(data)
+        if self.spill is not None:
+            try:
+                self.spill.write(data)
+            except OSError:
+                self.spill = None # e.g. disk full; keep the ring buffer going
+
+    def _close(self):
+        if isinstance(self._pipe, int):
+            os.close(self._pipe)
+        else:
+            self._pipe.close()
+        if self.spill is not None:
+            self.spill.close()
+        self._eof.set()
+
+
+class _Drainer(object):
+    """Background thread that drains the pipes of all captures."""
+
+    def __init__(self):
+        self._selector = selectors.DefaultSelector()
+        self._lock = threading.Lock()
+        self._added = []
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_r, False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ)
+        self._thread = threading.Thread(target=self._run, name="pyptlib-capture")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def add(self, capture):
+        with self._lock:
+            self._added.append(capture)
+        os.write(self._wakeup_w, b"\0")
+
+    def _run(self):
+        while True:
+            for key, _ in self._selector.select():
+                if key.fileobj == self._wakeup_r:
+                    self._register_added()
+                else:
+                    self._drain(key.fileobj)
+
+    def _register_added(self):
+        try:
+            while os.read(self._wakeup_r, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        with self._lock:
+            added, self._added = self._added, []
+        for capture in added:
+            self._selector.register(capture, selectors.EVENT_READ)
+
+    def _drain(self, capture):
+        try:
+            data = os.read(capture.fileno(), CHUNK_SIZE)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b""
+        if data:
+            capture._feed(data)
+        else:
+            self._selector.unregister(capture)
+            capture._close()
+
+
+_DRAINER = None
+_DRAINER_LOCK = threading.Lock()
+
+def capture_pipe(pipe, size=DEFAULT_CAPTURE_SIZE, spill_path=None,
+                 spill_bytes=DEFAULT_SPILL_SIZE, spill_backups=DEFAULT_SPILL_BACKUPS):
+    """Drain a pipe in the background, keeping its recent output.
+
+    The pipe is closed once its end is reached.
+
+    Args:
+        pipe: A file object or file descriptor to read from.
+        size: Number of bytes of recent output to keep in memory.
+        spill_path: If set, all output is also appended to this file, which
+            is rotated once it exceeds spill_bytes, keeping spill_backups
+            old files.
+
+    Returns:
+        The Capture for the pipe.
+    """
+    global _DRAINER
+    spill = None
+    if spill_path is not None:
+        spill = RotatingFile(spill_path, spill_bytes, spill_backups)
+    capture = Capture(pipe, size, spill)
+    with _DRAINER_LOCK:
+        if _DRAINER is None:
+            _DRAINER = _Drainer()
+    _DRAINER.add(capture)
+    return capture
@@ -0,0 +1,193 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Happy-eyeballs (RFC 8305) dialing of bridges, for asyncio applications.
+
+A bridge whose name resolves to both IPv6 and IPv4 addresses is dialed by
+racing connection attempts to its addresses, alternating between the
+address families, with each attempt started a short delay after the
+previous one (or immediately once the previous one fails). The first
+connection to succeed wins, and the other attempts are cancelled; so a
+black-holed IPv6 path costs the attempt delay, not a full connect timeout.
+
+The family that won is remembered per bridge for a while, and tried first
+the next time that bridge is dialed.
+"""
+
+import asyncio
+import socket
+import time
+
+import pyptlib.util as util
+
+
+class Dialer(object):
+    """
+    Concurrent dialer with a per-bridge cache of the winning address family.
+
+    A Dialer may only be used from one event loop at a time.
+
+    :var float attemptDelay: Seconds to wait for an attempt before starting
+            the next one.
+    :var float timeout: Maximum seconds for a whole dial, or None.
+    :var float familyTtl: Seconds to remember the winning family of a bridge.
+    :var int maxSize: Maximum number of bridges to remember.
+    """
+
+    def __init__(self, attemptDelay=0.25, timeout=30, familyTtl=600, maxSize=1024,
+                 connect=None, clock=time.monotonic):
+        """
+        :param connect: Coroutine function called as ``connect(family,
+                sockaddr)`` to make one connection attempt, returning a
+                (reader, writer) pair; by default, asyncio.open_connection().
+        """
+        self.attemptDelay = attemptDelay
+        self.timeout = timeout
+        self.familyTtl = familyTtl
+        self.maxSize = maxSize
+        self._connect = connect or _openConnection
+        self._clock = clock
+        self._families = {} # (host, port) -> (expiry, family)
+
+    async def dial(self, spec, defhost=None, defport=None):
+        """
+        Connect to a bridge.
+
+        :param str spec: host:port of the bridge, as accepted by
+                :func:`pyptlib.util.parse_addr_spec`. The host may be a
+                hostname, which is resolved without blocking.
+
+        :returns: tuple -- (reader, writer) asyncio streams of the connection.
+        :raises: :class:`ValueError` if spec is not well formed or could not
+                be resolved, :class:`OSError` if all attempts failed, or
+                :class:`asyncio.TimeoutError`.
+        """
+        host, port, af = util._split_addr_spec(spec, defhost, defport)
+        addr = util._numeric_addr(host, port, af)
+        if addr is not None:
+            family = socket.AF_INET6 if ':' in addr[0] else socket.AF_INET
+            candidates = [(family, addr)]
+        else:
+            loop = asyncio.get_running_loop()
+            try:
+                infos = await loop.getaddrinfo(host, port, family=af,
+                                               type=socket.SOCK_STREAM)
+            except socket.gaierror as e:
+                raise ValueError("Bad host or port: \"%s\" \"%s\": %s" % (host, port, e))
+            candidates = [(family, sockaddr) for family, _, _, _, sockaddr in infos]
+        return await self.race((host, port), candidates)
+
+    async def race(self, key, candidates):
+        """
+        Race connection attempts to `candidates`, in happy-eyeballs order.
+
+        :param key: Key of the bridge in the family cache, e.g. (host, port).
+        :param list candidates: (family, sockaddr) of each address to try,
+                in order of preference within each family.
+
+        :returns: tuple -- (reader, writer) of the first successful attempt.
+        :raises: See :func:`dial`.
+        """
+        if not candidates:
+            raise OSError("No addresses to connect to")
+        candidates = interleave(candidates, self.preferredFamily(key))
+        if self.timeout is None:
+            result = await self._race(candidates)
+        else:
+            result = await asyncio.wait_for(self._race(candidates), self.timeout)
+        family, reader, writer = result
+        self._remember(key, family)
+        return reader, writer
+
+    def preferredFamily(self, key):
+        """
+        :returns: int -- The family that last won for `key`, or AF_INET6 if
+                it is not known.
+        """
+        entry = self._families.get(key)
+        if entry is not None:
+            expiry, family = entry
+            if expiry > self._clock():
+                return family
+            del self._families[key]
+        return socket.AF_INET6
+
+    def _remember(self, key, family):
+        if self.familyTtl <= 0:
+            return
+        self._families.pop(key, None)
+        while len(self._families) >= self.maxSize:
+            del self._families[next(iter(self._families))]
+        self._families[key] = (self._clock() + self.familyTtl, family)
+
+    async def _race(self, candidates):
+        """
+        :returns: tuple -- (family, reader, writer) of the winning attempt.
+        """
+        remaining = list(candidates)
+        attempts = {} # task -> family
+        errors = []
+        try:
+            while remaining or attempts:
+                startNext = False
+                if remaining and not attempts:
+                    startNext = True
+                else:
+                    done, _ = await asyncio.wait(
+                        attempts, timeout=self.attemptDelay if remaining else None,
+                        return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        family = attempts.pop(task)
+                        if task.exception() is None:
+                            reader, writer = task.result()
+                            return family, reader, writer
+                        errors.append(task.exception())
+                    # start the next attempt once the delay expires, or
+                    # right away if an attempt failed
+                    startNext = bool(remaining)
+                if startNext:
+                    family, sockaddr = remaining.pop(0)
+                    task = asyncio.ensure_future(self._connect(family, sockaddr))
+                    attempts[task] = family
+            raise OSError("All connection attempts failed: %s"
+                          % ", ".join(str(e) for e in errors))
+        finally:
+            await _cancel(attempts)
+
+
+def interleave(candidates, firstFamily=socket.AF_INET6):
+    """
+    Order addresses by alternating between address families, starting with
+    `firstFamily` (RFC 8305 section 4).
+
+    :param list candidates: (family, sockaddr) of each address.
+
+    :returns: list -- The reordered candidates.
+    """
+    byFamily = {}
+    for candidate in candidates:
+        byFamily.setdefault(candidate[0], []).append(candidate)
+    families = sorted(byFamily, key=lambda family: family != firstFamily)
+    result = []
+    while any(byFamily.values()):
+        for family in families:
+            if byFamily[family]:
+                result.append(byFamily[family].pop(0))
+    return result
+
+async def _openConnection(family, sockaddr):
+    return await asyncio.open_connection(sockaddr[0], sockaddr[1], family=family)
+
+async def _cancel(attempts):
+    """
+    Cancel the losing attempts, closing any that connected anyway.
+    """
+    for task in attempts:
+        task.cancel()
+    for task in attempts:
+        try:
+            reader, writer = await task
+        except (asyncio.CancelledError, Exception):
+            continue
+        writer.close()
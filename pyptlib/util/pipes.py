@@ -0,0 +1,239 @@
+"""Non-blocking, line-framed reading of child process pipes.
+
+The file objects that subprocess gives for Popen.stdout and Popen.stderr
+read ahead into their own buffer, so a select() on the pipe can report
+nothing to read while a complete line is waiting in that buffer, and their
+readline() blocks. This module reads pipes through their raw file
+descriptor instead, so that a single thread can follow many children:
+
+    mux = PipeMultiplexer()
+    for proc in procs:
+        mux.add(proc.stdout, lambda reader, line, proc=proc: handle(proc, line))
+    while mux:
+        mux.poll()
+
+or with iter_lines(), or in an asyncio application:
+
+    async for line in iter_lines_async(proc.stdout):
+        handle(proc, line)
+
+Do not read from a pipe through its file object once it is given to this
+module, as any data buffered by the file object would not be seen here.
+
+Not supported on Windows, where pipes cannot be made non-blocking.
+"""
+
+import os
+import selectors
+
+DEFAULT_MAX_LINE = 65536
+CHUNK_SIZE = 65536
+
+
+class LineReader(object):
+    """Reads complete lines from a pipe without blocking.
+
+    Attributes:
+        pipe: The file object or file descriptor read from.
+        encoding: If set, lines are decoded to str with this encoding;
+            otherwise they are bytes.
+        eof: Whether the end of the pipe was reached.
+    """
+
+    def __init__(self, pipe, encoding=None, errors="replace",
+                 max_line=DEFAULT_MAX_LINE):
+        """
+        Args:
+            pipe: A file object with a fileno(), e.g. Popen.stdout, or a file
+                descriptor. It is put into non-blocking mode.
+            encoding, errors: How to decode lines; see bytes.decode().
+            max_line: Lines longer than this are returned in pieces of this
+                length, so that a child cannot make us buffer without limit.
+        """
+        self.pipe = pipe
+        self.encoding = encoding
+        self.errors = errors
+        self.max_line = max_line
+        self.eof = False
+        self._fd = pipe if isinstance(pipe, int) else pipe.fileno()
+        self._buf = bytearray()
+        os.set_blocking(self._fd, False)
+
+    def fileno(self):
+        return self._fd
+
+    def read_lines(self):
+        """Read everything available now, and return the complete lines.
+
+        Lines include their trailing newline, like file.readline(). Once the
+        end of the pipe is reached, any incomplete last line is returned too,
+        and eof is set.
+
+        Returns:
+            A list of the lines read, which may be empty.
+        """
+        lines = []
+        while not self.eof:
+            try:
+                chunk = os.read(self._fd, CHUNK_SIZE)
+            except BlockingIOError:
+                break
+            except InterruptedError:
+                continue
+            if not chunk:
+                self.eof = True
+                break
+            self._split(chunk, lines)
+        if self.eof and self._buf:
+            lines.append(bytes(self._buf))
+            del self._buf[:]
+        if self.encoding is not None:
+            lines = [line.decode(self.encoding, self.errors) for line in lines]
+        return lines
+
+    def close(self):
+        """Close the pipe."""
+        if isinstance(self.pipe, int):
+            os.close(self.pipe)
+        else:
+            self.pipe.close()
+
+    def _split(self, chunk, lines):
+        buf = self._buf
+        search = len(buf) # no newline before here
+        buf += chunk
+        pos = 0
+        while True:
+            end = buf.find(b"\n", search)
+            limit = pos + self.max_line
+            if 0 <= end < limit:
+                lines.append(bytes(buf[pos:end + 1]))
+                pos = search = end + 1
+            elif len(buf) >= limit:
+                # overlong line; return it in pieces
+                lines.append(bytes(buf[pos:limit]))
+                pos = limit
+                search = max(search, pos)
+            else:
+                break
+        del buf[:pos]
+
+
+class PipeMultiplexer(object):
+    """Follows the lines of many pipes from one thread, with a selector.
+
+    The multiplexer is true while it still has pipes that have not reached
+    their end.
+    """
+
+    def __init__(self, selector=None):
+        """
+        Args:
+            selector: A selectors.BaseSelector to use; by default a new
+                selectors.DefaultSelector.
+        """
+        self.selector = selector or selectors.DefaultSelector()
+
+    def add(self, pipe, callback, **kwargs):
+        """Start following a pipe.
+
+        Args:
+            pipe: A file object or file descriptor, or a LineReader.
+            callback: Called as callback(reader, line) for every line, and
+                as callback(reader, None) when the end of the pipe is
+                reached, after which the pipe is no longer followed.
+            **kwargs: Passed to LineReader, if pipe is not one already.
+
+        Returns:
+            The LineReader for the pipe.
+        """
+        reader = pipe if isinstance(pipe, LineReader) else LineReader(pipe, **kwargs)
+        self.selector.register(reader, selectors.EVENT_READ, callback)
+        return reader
+
+    def remove(self, reader):
+        """Stop following a pipe, without closing it."""
+        self.selector.unregister(reader)
+
+    def poll(self, timeout=None):
+        """Wait for lines, and pass them to their callbacks.
+
+        Args:
+            timeout: Maximum time in seconds to wait, or None to wait until
+                some pipe is readable.
+
+        Returns:
+            The number of pipes that were readable; 0 if the timeout expired.
+        """
+        events = self.selector.select(timeout)
+        for key, _ in events:
+            reader, callback = key.fileobj, key.data
+            for line in reader.read_lines():
+                callback(reader, line)
+            if reader.eof:
+                self.remove(reader)
+                callback(reader, None)
+        return len(events)
+
+    def close(self):
+        """Stop following all pipes, and close the selector."""
+        self.selector.close()
+
+    def __bool__(self):
+        return bool(self.selector.get_map())
+
+
+def iter_lines(pipes, timeout=None, **kwargs):
+    """Yield (pipe, line) for the lines of several pipes, as they arrive.
+
+    Args:
+        pipes: File objects or file descriptors.
+        timeout: Maximum time in seconds to wait for any pipe to become
+            readable; if it expires, iteration stops. None to wait until
+            every pipe has ended.
+        **kwargs: Passed to LineReader.
+    """
+    ready = []
+    mux = PipeMultiplexer()
+    try:
+        for pipe in pipes:
+            mux.add(pipe, lambda reader, line, pipe=pipe:
+                    line is not None and ready.append((pipe, line)), **kwargs)
+        while mux:
+            if not mux.poll(timeout):
+                return
+            for item in ready:
+                yield item
+            del ready[:]
+    finally:
+        mux.close()
+
+
+async def iter_lines_async(pipe, **kwargs):
+    """Asynchronously iterate over the lines of a pipe, as they arrive.
+
+    The pipe is watched with the running event loop's add_reader(), so this
+    does not use a thread.
+
+    Args:
+        pipe: A file object or file descriptor, or a LineReader.
+        **kwargs: Passed to LineReader, if pipe is not one already.
+    """
+    import asyncio
+
+    reader = pipe if isinstance(pipe, LineReader) else LineReader(pipe, **kwargs)
+    loop = asyncio.get_running_loop()
+    readable = asyncio.Event()
+    loop.add_reader(reader.fileno(), readable.set)
+    try:
+        while True:
+            # clear before draining the pipe, so that data arriving while
+            # the caller handles our lines still wakes us up
+            readable.clear()
+            for line in reader.read_lines():
+                yield line
+            if reader.eof:
+                return
+            await readable.wait()
+    finally:
+        loop.remove_reader(reader.fileno())
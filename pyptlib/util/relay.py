@@ -0,0 +1,151 @@
+"""Relaying bytes between sockets, without copying them where possible.
+
+Once a transport has finished its handshake and is left with a plain byte
+stream in either or both directions (e.g. de-obfuscated traffic to the
+ORPort), it can hand the sockets to pump() or relay() instead of writing its
+own read/write loop.
+
+On Linux, bytes are moved with os.splice() through a pipe, so they are never
+copied into userspace. Elsewhere, or if splice() is not supported for the
+sockets, a recv_into()/send() loop over a single preallocated buffer is used.
+
+All sockets must be in blocking mode.
+"""
+
+import errno
+import os
+import socket
+import threading
+
+DEFAULT_BUFSIZE = 65536
+
+SPLICE_SUPPORTED = hasattr(os, "splice")
+if SPLICE_SUPPORTED:
+    _SPLICE_FLAGS = os.SPLICE_F_MOVE | os.SPLICE_F_MORE
+# splice() fails with these if it does not support a kind of file
+_UNSUPPORTED_ERRNOS = (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP)
+
+
+def pump(src, dst, bufsize=DEFAULT_BUFSIZE, use_splice=None, initial=b"",
+         shutdown=True):
+    """Copy bytes from src to dst, until src reaches EOF.
+
+    Args:
+        src, dst: Connected sockets, in blocking mode.
+        bufsize: Maximum number of bytes to move at once.
+        use_splice: Whether to use os.splice(); by default, it is used where
+            supported.
+        initial: Bytes to send to dst first, e.g. data that was read from
+            src together with the end of a handshake.
+        shutdown: Whether to shut down the write side of dst at EOF, so that
+            the peer of dst sees EOF too.
+
+    Returns:
+        The number of bytes sent to dst, including initial.
+    """
+    if use_splice is None:
+        use_splice = SPLICE_SUPPORTED
+    total = 0
+    if initial:
+        dst.sendall(initial)
+        total += len(initial)
+    if use_splice:
+        moved = _pump_splice(src, dst, bufsize)
+        if moved is None:
+            moved = _pump_copy(src, dst, bufsize)
+    else:
+        moved = _pump_copy(src, dst, bufsize)
+    total += moved
+    if shutdown:
+        try:
+            dst.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass # already disconnected
+    return total
+
+def relay(a, b, bufsize=DEFAULT_BUFSIZE, use_splice=None):
+    """Relay bytes between a and b in both directions, until both reach EOF.
+
+    One direction is pumped in a new thread, and the other in the calling
+    thread. If either direction fails, both sockets are shut down, so that
+    the other direction ends too, and the error is raised.
+
+    Args:
+        a, b: Connected sockets, in blocking mode.
+        bufsize, use_splice: See pump().
+
+    Returns:
+        A tuple (bytes sent from a to b, bytes sent from b to a).
+    """
+    result = [0, 0]
+    errors = []
+
+    def run(i, src, dst):
+        try:
+            result[i] = pump(src, dst, bufsize, use_splice)
+        except OSError as e:
+            errors.append(e)
+            for sock in (a, b):
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    t = threading.Thread(target=run, args=(1, b, a), name="pyptlib-relay")
+    t.daemon = True
+    t.start()
+    run(0, a, b)
+    t.join()
+    if errors:
+        raise errors[0]
+    return tuple(result)
+
+def _pump_splice(src, dst, bufsize):
+    """Pump bytes from src to dst through a pipe, with os.splice().
+
+    Returns:
+        The number of bytes moved, or None if splice() is not supported for
+        these sockets and nothing was moved.
+    """
+    src_fd, dst_fd = src.fileno(), dst.fileno()
+    pipe_r, pipe_w = os.pipe()
+    try:
+        _set_pipe_size(pipe_w, bufsize)
+        total = 0
+        while True:
+            try:
+                n = os.splice(src_fd, pipe_w, bufsize, flags=_SPLICE_FLAGS)
+            except OSError as e:
+                if total == 0 and e.errno in _UNSUPPORTED_ERRNOS:
+                    return None
+                raise
+            if n == 0:
+                return total
+            # drain the pipe fully, so it never holds more than one read
+            while n:
+                m = os.splice(pipe_r, dst_fd, n, flags=_SPLICE_FLAGS)
+                n -= m
+                total += m
+    finally:
+        os.close(pipe_r)
+        os.close(pipe_w)
+
+def _pump_copy(src, dst, bufsize):
+    """Pump bytes from src to dst through one preallocated buffer."""
+    buf = memoryview(bytearray(bufsize))
+    total = 0
+    while True:
+        n = src.recv_into(buf)
+        if n == 0:
+            return total
+        dst.sendall(buf[:n])
+        total += n
+
+def _set_pipe_size(fd, size):
+    """Grow a pipe to hold size bytes, if the platform allows."""
+    try:
+        import fcntl
+        if hasattr(fcntl, "F_SETPIPE_SZ"):
+            fcntl.fcntl(fd, fcntl.F_SETPIPE_SZ, size)
+    except OSError:
+        pass # e.g. over /proc/sys/fs/pipe-max-size; the default still works
@@ -0,0 +1,127 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Asynchronous, caching host resolution for asyncio applications.
+
+:func:`pyptlib.util.parse_addr_spec` with resolve=True blocks in
+getaddrinfo, which stalls the whole event loop for the length of a DNS
+lookup. The :class:`Resolver` here runs lookups in an executor instead,
+caches both successful and failed lookups for a limited time, and makes
+concurrent lookups of the same name share a single getaddrinfo call.
+"""
+
+import asyncio
+import time
+import weakref
+
+import pyptlib.util as util
+
+
+class Resolver(object):
+    """
+    Asynchronous resolver with a TTL-bounded positive and negative cache.
+
+    A Resolver may only be used from one event loop at a time.
+
+    :var float ttl: Seconds to cache successful lookups for.
+    :var float negativeTtl: Seconds to cache failed lookups for.
+    :var int maxSize: Maximum number of cached lookups.
+    :var concurrent.futures.Executor executor: Executor to run lookups in,
+            or None for the event loop's default executor.
+    """
+
+    def __init__(self, ttl=300, negativeTtl=30, maxSize=1024, executor=None,
+                 clock=time.monotonic):
+        self.ttl = ttl
+        self.negativeTtl = negativeTtl
+        self.maxSize = maxSize
+        self.executor = executor
+        self._clock = clock
+        self._cache = {} # (host, port, af) -> (expiry, addr or ValueError)
+        self._pending = {} # (host, port, af) -> future of an in-flight lookup
+
+    async def parse_addr_spec(self, spec, defhost=None, defport=None):
+        """
+        Like :func:`pyptlib.util.parse_addr_spec` with resolve=True, but
+        without blocking the event loop.
+
+        Numeric addresses are handled directly, without using the executor.
+
+        :returns: tuple -- (address, port)
+        :raises: ValueError if spec is not well formed, or could not be
+            resolved.
+        """
+        host, port, af = util._split_addr_spec(spec, defhost, defport)
+        addr = util._numeric_addr(host, port, af)
+        if addr is not None:
+            return addr
+
+        key = (host, port, af)
+        entry = self._cache.get(key)
+        if entry is not None:
+            expiry, result = entry
+            if expiry > self._clock():
+                if isinstance(result, ValueError):
+                    raise ValueError(str(result))
+                return result
+            del self._cache[key]
+
+        future = self._pending.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(
+                self.executor, util._resolve_addr, host, port, af, True)
+            self._pending[key] = future
+            future.add_done_callback(lambda f: self._store(key, f))
+        # shield, so that one cancelled caller does not cancel the lookup
+        # for every other caller waiting on it
+        return await asyncio.shield(future)
+
+    def invalidate(self, spec=None, defhost=None, defport=None):
+        """
+        Drop cached lookups; all of them, or only those for `spec`.
+        """
+        if spec is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(util._split_addr_spec(spec, defhost, defport), None)
+
+    def _store(self, key, future):
+        """
+        Cache the outcome of a finished lookup.
+        """
+        self._pending.pop(key, None)
+        if future.cancelled():
+            return
+        result = future.exception()
+        if result is None:
+            result, ttl = future.result(), self.ttl
+        elif isinstance(result, ValueError):
+            ttl = self.negativeTtl
+        else:
+            return
+        if ttl <= 0:
+            return
+        while len(self._cache) >= self.maxSize:
+            del self._cache[next(iter(self._cache))]
+        self._cache[key] = (self._clock() + ttl, result)
+
+
+# event loop -> its default Resolver, as a Resolver only serves one loop
+_DEFAULT_RESOLVERS = weakref.WeakKeyDictionary()
+
+async def parse_addr_spec_async(spec, defhost=None, defport=None):
+    """
+    Asynchronous counterpart of :func:`pyptlib.util.parse_addr_spec` with
+    resolve=True, using a default :class:`Resolver` shared by all callers
+    in the running event loop.
+
+    :returns: tuple -- (address, port)
+    :raises: ValueError if spec is not well formed, or could not be resolved.
+    """
+    loop = asyncio.get_running_loop()
+    resolver = _DEFAULT_RESOLVERS.get(loop)
+    if resolver is None:
+        resolver = _DEFAULT_RESOLVERS[loop] = Resolver()
+    return await resolver.parse_addr_spec(spec, defhost, defport)
@@ -7,7 +7,6 @@ Some parts do not yet work fully on windows (sending/trapping signals).
 """
 
 import atexit
-import inspect
 import os
 import signal
 import subprocess
@@ -30,15 +29,13 @@ if mswindows:
     import win32api, win32con, win32job, win32process
 
 _CHILD_PROCS = []
-# TODO(infinity0): add functionality to detect when any child dies, and
-# offer different response strategies for them (e.g. restart the child? or die
-# and kill the other children too).
+# See pyptlib.util.supervisor for detecting when any child dies, and applying
+# different response strategies for them (e.g. restart the child, or die and
+# kill the other children too).
 
 SINK = object()
+CAPTURE = object()
 
-# get default args from subprocess.Popen to use in subproc.Popen
-a = inspect.getargspec(subprocess.Popen.__init__)
-_Popen_defaults = list(zip(a.args[-len(a.defaults):],a.defaults)); del a
 if mswindows:
     # required for os.kill() to work
     _Popen_creationflags = subprocess.CREATE_NEW_PROCESS_GROUP
@@ -67,11 +64,6 @@ if mswindows:
         # JOB_OBJECT_LIMIT_BREAKAWAY_OK set on it as well.
         _Popen_creationflags |= win32process.CREATE_BREAKAWAY_FROM_JOB
 
-    tmp = dict(_Popen_defaults)
-    tmp['creationflags'] |= _Popen_creationflags
-    _Popen_defaults = list(tmp.items())
-    del tmp, _Popen_creationflags
-
 
 class Popen(subprocess.Popen):
     """Wrapper for subprocess.Popen that tracks every child process.
@@ -84,34 +76,76 @@ class Popen(subprocess.Popen):
     Additionally, you may use subproc.SINK as the value for either of the
     stdout, stderr arguments to tell subprocess to discard anything written
     to those channels.
+
+    You may also use subproc.CAPTURE for them, to keep only the most recent
+    output, e.g. for crash reports. The channel is then drained in the
+    background (see pyptlib.util.capture), so the child never blocks on a full
+    pipe; the corresponding attribute (stdout, stderr) is None, and the output
+    is available from captured_output(). The extra capture_size param sets the
+    number of bytes kept per channel; if the capture_spill param is given, all
+    output is also appended to rotating files named capture_spill + ".stdout"
+    and capture_spill + ".stderr", e.g. in the state location.
     """
 
     def __init__(self, *args, **kwargs):
-        kwargs = dict(_Popen_defaults + list(kwargs.items()))
+        if mswindows:
+            kwargs.setdefault('creationflags', _Popen_creationflags)
         if 'creationflagsmerge' in kwargs:
             kwargs['creationflags'] = (
                 kwargs.get('creationflags', 0) | kwargs['creationflagsmerge'])
             del kwargs['creationflagsmerge']
+        capture_size = kwargs.pop('capture_size', None)
+        capture_spill = kwargs.pop('capture_spill', None)
+        captured = []
         for f in ['stdout', 'stderr']:
-            if kwargs[f] is SINK:
+            if kwargs.get(f) is SINK:
                 kwargs[f] = create_sink()
+            elif kwargs.get(f) is CAPTURE:
+                kwargs[f] = subprocess.PIPE
+                captured.append(f)
         # super() does some magic that makes **kwargs not work, so just call
         # our super-constructor directly
         subprocess.Popen.__init__(self, *args, **kwargs)
         _CHILD_PROCS.append(self)
 
+        self.captures = {}
+        if captured:
+            from pyptlib.util import capture
+            for f in captured:
+                capture_args = {}
+                if capture_size is not None:
+                    capture_args['size'] = capture_size
+                if capture_spill is not None:
+                    capture_args['spill_path'] = "%s.%s" % (capture_spill, f)
+                self.captures[f] = capture.capture_pipe(getattr(self, f), **capture_args)
+                setattr(self, f, None)
+
         if mswindows and _kill_children_on_death:
             handle = windll.kernel32.OpenProcess(
                 win32con.SYNCHRONIZE | win32con.PROCESS_SET_QUOTA | win32con.PROCESS_TERMINATE, 0, self.pid)
             if win32job.AssignProcessToJobObject(_chJob, handle) == 0:
                 raise WinError()
 
-    # TODO(infinity0): perhaps replace Popen.std* with wrapped file objects
-    # that don't buffer readlines() et. al. Currently one must avoid these and
-    # use while/readline(); see man page for "python -u" for more details.
+    def captured_output(self, f="stderr", timeout=1):
+        """Return the most recent output captured from a channel.
+
+        If the child has exited, wait for up to timeout seconds for its last
+        output to be drained first.
+
+        Args:
+            f: "stdout" or "stderr", which must have been given as CAPTURE.
+        """
+        capture = self.captures[f]
+        if self.poll() is not None:
+            capture.wait(timeout)
+        return capture.getvalue()
+
+    # Popen.std* buffer their reads, so select() on them is unreliable and
+    # readline() blocks; see pyptlib.util.pipes for non-blocking line readers
+    # that can follow many children from one thread.
 
 def create_sink():
-    return open(os.devnull, "w", 0)
+    return open(os.devnull, "wb", 0)
 
 
 if mswindows:
@@ -151,17 +185,59 @@ else:
             return True
 
 
+def pidfd_open(proc):
+    """Return a file descriptor that becomes readable when proc exits.
+
+    This uses Linux pidfds. The caller must close the returned fd.
+
+    Returns:
+        The fd, or None if pidfds are not supported, or proc has already
+        been reaped.
+    """
+    if not hasattr(os, "pidfd_open") or proc.returncode is not None:
+        return None
+    try:
+        return os.pidfd_open(proc.pid)
+    except OSError:
+        return None
+
+
 class SignalHandlers(object):
+    """Handlers for a signal, that activate after a number of signals.
+
+    By default, the handlers are run from the Python signal handler, i.e. in
+    the main thread, interrupting whatever it was doing until they return. Use
+    dispatch_signals_in_thread() or dispatch_signals_in_loop() to run them
+    somewhere else.
+    """
 
     def __init__(self):
         self.handlers = {}
         self.received = 0
+        self._installed = None # our handler, as returned by signal.getsignal()
 
     def attach_override_unix(self, signum):
-        if signal.signal(signum, self.handle) != self.handle:
+        if not self.attached(signum):
             self.handlers.clear()
+        if _dispatch_loop is not None:
+            _dispatch_loop.add_signal_handler(signum, self.dispatch, signum, None)
+        else:
+            signal.signal(signum, self.handle)
+        self._installed = signal.getsignal(signum)
+
+    def attached(self, signum):
+        """Whether our handler is still the one installed for signum."""
+        return self._installed is not None and signal.getsignal(signum) == self._installed
 
     def handle(self, signum=0, sframe=None):
+        if _dispatch_thread is None:
+            self.dispatch(signum, sframe)
+        elif _dispatch_thread.pending_exit is not None:
+            raise _dispatch_thread.pending_exit
+        # otherwise, the dispatch thread was woken up and runs the handlers
+
+    def dispatch(self, signum=0, sframe=None):
+        """Count a signal, and run the handlers activated by it."""
         self.received += 1
 
         # code snippet adapted from atexit._run_exitfuncs
@@ -185,7 +261,11 @@ class SignalHandlers(object):
         self.handlers.setdefault(ignoreNum, []).append(handler)
 
 
-_SIGINT_HANDLERS = SignalHandlers()
+_SIGNAL_HANDLERS = {} # signum -> SignalHandlers
+def _signal_handlers(signum):
+    return _SIGNAL_HANDLERS.setdefault(signum, SignalHandlers())
+
+_SIGINT_HANDLERS = _signal_handlers(signal.SIGINT)
 def trap_sigint(handler, ignoreNum=0):
     """Register a handler for an INT signal (Unix).
 
@@ -203,14 +283,244 @@ def trap_sigint(handler, ignoreNum=0):
     handlers.attach_override_unix(signal.SIGINT)
     handlers.register(handler, ignoreNum)
 
+def trap_sigterm(handler, ignoreNum=0):
+    """Register a handler for a TERM signal.
+
+    Args:
+        See trap_sigint().
+    """
+    handlers = _signal_handlers(signal.SIGTERM)
+    handlers.attach_override_unix(signal.SIGTERM)
+    handlers.register(handler, ignoreNum)
+
+def trap_sighup(handler, ignoreNum=0):
+    """Register a handler for a HUP signal (Unix only).
+
+    Args:
+        See trap_sigint().
+    """
+    handlers = _signal_handlers(signal.SIGHUP)
+    handlers.attach_override_unix(signal.SIGHUP)
+    handlers.register(handler, ignoreNum)
+
+
+class _DispatchThread(object):
+    """Runs the handlers of trapped signals in a dedicated thread.
+
+    The thread is woken up through signal.set_wakeup_fd(), which is written
+    to with the number of each signal as soon as it arrives, even while the
+    main thread is blocked.
+    """
+
+    def __init__(self):
+        import threading
+        self.pending_exit = None
+        self._r, self._w = os.pipe()
+        os.set_blocking(self._w, False)
+        signal.set_wakeup_fd(self._w, warn_on_full_buffer=False)
+        thread = threading.Thread(target=self._run, name="pyptlib-signals")
+        thread.daemon = True
+        thread.start()
+
+    def _run(self):
+        import _thread
+        while True:
+            for signum in os.read(self._r, 512):
+                handlers = _SIGNAL_HANDLERS.get(signum)
+                if (handlers is None or not handlers.attached(signum)
+                    or self.pending_exit is not None):
+                    continue
+                try:
+                    handlers.dispatch(signum)
+                except SystemExit as e:
+                    # exit from the main thread, as it would have without us
+                    self.pending_exit = e
+                    _thread.interrupt_main(signum)
+                except:
+                    pass # already reported by dispatch()
+
+_dispatch_thread = None
+_dispatch_loop = None
+
+def dispatch_signals_in_thread():
+    """Run the handlers of trapped signals in a dedicated thread.
+
+    Handlers registered with trap_sigint(), trap_sigterm(), trap_sighup() and
+    auto_killall() will no longer interrupt the main thread, so slow handlers
+    such as killall() do not stall it. If a handler raises SystemExit, it is
+    re-raised in the main thread. The number of signals received is counted
+    as before.
+
+    This uses signal.set_wakeup_fd(), so it cannot be combined with asyncio's
+    loop.add_signal_handler(); see dispatch_signals_in_loop() for asyncio
+    applications. Must be called from the main thread.
+    """
+    global _dispatch_thread
+    if _dispatch_loop is not None:
+        raise RuntimeError("signals are already dispatched in an event loop")
+    if _dispatch_thread is None:
+        _dispatch_thread = _DispatchThread()
+
+def dispatch_signals_in_loop(loop=None):
+    """Run the handlers of trapped signals as callbacks in an asyncio loop.
+
+    The handlers are installed with loop.add_signal_handler(), including any
+    already trapped. auto_killall() then uses killall_async(), so that the
+    loop keeps running while children exit. Must be called from the main
+    thread.
+
+    Args:
+        loop: The event loop; by default the running one.
+    """
+    global _dispatch_loop
+    if _dispatch_thread is not None:
+        raise RuntimeError("signals are already dispatched in a thread")
+    if loop is None:
+        import asyncio
+        loop = asyncio.get_running_loop()
+    attached = [signum for signum, handlers in _SIGNAL_HANDLERS.items()
+                if handlers.attached(signum)]
+    _dispatch_loop = loop
+    for signum in attached:
+        _SIGNAL_HANDLERS[signum].attach_override_unix(signum)
+
 
 _isTerminating = False
+_isDraining = False
+_KILL_WAIT_S = 1 # time to wait for children to die after being killed
+_POLL_MAX_S = 0.05 # max interval when polling children without pidfds
+
+def start_draining():
+    """Record that the program is draining its connections before it shuts
+    down, e.g. with pyptlib.drain. Supervisors no longer restart children
+    from then on."""
+    global _isDraining
+    _isDraining = True
+
+def is_shutting_down():
+    """Whether the program has started draining, or killall() has started."""
+    return _isDraining or _isTerminating
+
+def _start_killall():
+    """Tell all children to terminate.
+
+    Returns:
+        The children that were told to terminate, or None if killall() was
+        already started.
+    """
+    global _isTerminating
+    if _isTerminating: return None
+    _isTerminating = True
+    procs = [proc for proc in _CHILD_PROCS if proc.poll() is None]
+    for proc in procs:
+        proc.terminate()
+    return procs
+
+def _kill(procs):
+    for proc in procs:
+        if proc.poll() is None:
+            proc.kill()
+
+def _finish_killall(cleanup):
+    global _CHILD_PROCS
+    # reap any zombies
+    _CHILD_PROCS = [proc for proc in _CHILD_PROCS if proc.poll() is None]
+    cleanup()
+
+def _wait_procs(procs, timeout):
+    """Wait for procs to exit, returning early once they all have.
+
+    Exits are waited for using pidfds where available, so this returns as
+    soon as the last child dies. Children without a pidfd are polled, at
+    increasing intervals of up to _POLL_MAX_S.
+
+    Returns:
+        The procs that are still alive after timeout seconds.
+    """
+    import selectors
+    deadline = time.monotonic() + timeout
+    polled = []
+    sel = selectors.DefaultSelector()
+    try:
+        for proc in procs:
+            if proc.poll() is not None: continue
+            fd = pidfd_open(proc)
+            if fd is None:
+                polled.append(proc)
+            else:
+                sel.register(fd, selectors.EVENT_READ, proc)
+        interval = 0.001
+        while polled or sel.get_map():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0: break
+            wait = min(remaining, interval) if polled else remaining
+            interval = min(interval * 2, _POLL_MAX_S)
+            if sel.get_map():
+                for key, _ in sel.select(wait):
+                    sel.unregister(key.fd)
+                    os.close(key.fd)
+                    # reap it; this returns None if another thread is in
+                    # wait() for it, but either way the child is dead
+                    key.data.poll()
+            else:
+                time.sleep(wait)
+            polled = [proc for proc in polled if proc.poll() is None]
+        return polled + [key.data for key in sel.get_map().values()]
+    finally:
+        for key in list(sel.get_map().values()):
+            os.close(key.fd)
+        sel.close()
+
+async def _wait_procs_async(procs, timeout):
+    """Like _wait_procs(), but waits in the running asyncio event loop."""
+    import asyncio
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    polled = []
+    waiters = [] # (fd, future, proc)
+    def exited(future):
+        if not future.done(): future.set_result(None)
+    try:
+        for proc in procs:
+            if proc.poll() is not None: continue
+            fd = pidfd_open(proc)
+            if fd is None:
+                polled.append(proc)
+                continue
+            future = loop.create_future()
+            waiters.append((fd, future, proc))
+            loop.add_reader(fd, exited, future)
+        interval = 0.001
+        while True:
+            pending = [future for _, future, _ in waiters if not future.done()]
+            polled = [proc for proc in polled if proc.poll() is None]
+            remaining = deadline - loop.time()
+            if not (pending or polled) or remaining <= 0: break
+            wait = min(remaining, interval) if polled else remaining
+            interval = min(interval * 2, _POLL_MAX_S)
+            if pending:
+                await asyncio.wait(pending, timeout=wait)
+            else:
+                await asyncio.sleep(wait)
+    finally:
+        for fd, _, _ in waiters:
+            loop.remove_reader(fd)
+            os.close(fd)
+    alive = list(polled)
+    for _, future, proc in waiters:
+        if future.done():
+            proc.poll()
+        else:
+            alive.append(proc)
+    return alive
+
 def killall(cleanup=lambda:None, wait_s=16):
     """Attempt to gracefully terminate all child processes.
 
     All children are told to terminate gracefully. A waiting period is then
     applied, after which all children are killed forcefully. If all children
-    terminate before this waiting period is over, the function exits early.
+    terminate before this waiting period is over, the function exits early,
+    as soon as the last child has exited.
 
     Args:
         cleanup: Run after all children are dead. For example, if your program
@@ -220,28 +530,30 @@ def killall(cleanup=lambda:None, wait_s=16):
         wait_s: Time in seconds to wait before trying to kill children.
     """
     # TODO(infinity0): log this somewhere, maybe
-    global _isTerminating, _CHILD_PROCS
-    if _isTerminating: return
-    _isTerminating = True
-    # terminate all
-    for proc in _CHILD_PROCS:
-        if proc.poll() is None:
-            proc.terminate()
-    # wait and make sure they're dead
-    for i in range(wait_s):
-        _CHILD_PROCS = [proc for proc in _CHILD_PROCS
-                        if proc.poll() is None]
-        if not _CHILD_PROCS: break
-        time.sleep(1)
+    procs = _start_killall()
+    if procs is None: return
+    procs = _wait_procs(procs, wait_s)
     # if still existing, kill them
-    for proc in _CHILD_PROCS:
-        if proc.poll() is None:
-            proc.kill()
-    time.sleep(0.5)
-    # reap any zombies
-    for proc in _CHILD_PROCS:
-        proc.poll()
-    cleanup()
+    _kill(procs)
+    _wait_procs(procs, _KILL_WAIT_S)
+    _finish_killall(cleanup)
+
+async def killall_async(cleanup=lambda:None, wait_s=16):
+    """Like killall(), but waits in the running asyncio event loop.
+
+    This does not block the event loop while waiting for children to exit,
+    so it can be awaited from a coroutine, e.g. on shutdown of an asyncio
+    application.
+
+    Args:
+        See killall().
+    """
+    procs = _start_killall()
+    if procs is None: return
+    procs = await _wait_procs_async(procs, wait_s)
+    _kill(procs)
+    await _wait_procs_async(procs, _KILL_WAIT_S)
+    _finish_killall(cleanup)
 
 def auto_killall(ignoreNumSigInts=0, *args, **kwargs):
     """Automatically terminate all child processes on exit.
@@ -252,7 +564,11 @@ def auto_killall(ignoreNumSigInts=0, *args, **kwargs):
             all other cases, such as on normal exit, or on a TERM signal.
         *args, **kwargs: See killall().
     """
-    killall_handler = lambda signum, sframe: killall(*args, **kwargs)
+    def killall_handler(signum, sframe):
+        if _dispatch_loop is not None:
+            _dispatch_loop.create_task(killall_async(*args, **kwargs))
+        else:
+            killall(*args, **kwargs)
     trap_sigint(killall_handler, ignoreNumSigInts)
-    signal.signal(signal.SIGTERM, killall_handler)
+    trap_sigterm(killall_handler)
     atexit.register(killall, *args, **kwargs)
@@ -0,0 +1,302 @@
+"""Supervision of child processes, with per-child restart policies.
+
+A Supervisor learns that a child has exited as an event rather than by
+polling: through a Linux pidfd per child where available, otherwise
+through SIGCHLD and a wakeup pipe. It then applies the child's policy:
+
+    RESTART: start the child again, with exponential backoff if it keeps
+        exiting soon after being started.
+    IGNORE: just record the exit.
+    KILLALL: terminate all children via subproc.killall(), e.g. so that the
+        whole plugin fails fast.
+
+Children are started with subproc.Popen, so they are still subject to
+killall() and auto_killall(). No children are restarted once killall()
+has started, or while the program drains its connections before shutting
+down (see subproc.start_draining()).
+"""
+
+import os
+import selectors
+import signal
+import threading
+import time
+
+from pyptlib.util import subproc
+
+RESTART = "restart"
+IGNORE = "ignore"
+KILLALL = "killall"
+POLICIES = (RESTART, IGNORE, KILLALL)
+
+
+class SupervisedChild(object):
+    """A child process managed by a Supervisor.
+
+    Attributes:
+        name: Name of the child, for display purposes.
+        args, kwargs: Arguments used to (re)start the child with Popen.
+        policy: What to do when the child exits; one of POLICIES.
+        proc: The current subproc.Popen for this child.
+        restarts: Number of times the child has been restarted.
+        returncodes: Exit status of every previous run of the child.
+        start_errors: The OSError of every failed restart of the child, e.g.
+            if its program is missing or we ran out of file descriptors.
+            Failed restarts are retried with the same backoff as exits.
+    """
+
+    def __init__(self, name, args, kwargs, policy):
+        self.name = name
+        self.args = args
+        self.kwargs = kwargs
+        self.policy = policy
+        self.proc = None
+        self.restarts = 0
+        self.returncodes = []
+        self.start_errors = []
+        self._started_at = None
+        self._failures = 0 # consecutive quick exits, for backoff
+        self._pidfd = None
+
+    def is_alive(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def __repr__(self):
+        return "<SupervisedChild %s pid=%s restarts=%d>" % (
+            self.name, self.proc.pid if self.proc else None, self.restarts)
+
+
+class Supervisor(object):
+    """Watches child processes and applies their restart policies.
+
+    Children are watched from a background thread. If pidfds are not
+    available, start() must be called from the main thread, as it installs a
+    SIGCHLD handler.
+
+    Args:
+        backoff_s: Delay before the first restart of a child that exits.
+        max_backoff_s: Maximum delay between restarts; the delay doubles
+            every time a child exits within stable_s of being (re)started.
+        stable_s: A child that runs for at least this long is considered
+            healthy again, and its backoff is reset.
+        on_exit: Optional callable, called as on_exit(child, returncode) from
+            the supervisor thread whenever a child exits.
+        cleanup: Passed to subproc.killall() for the KILLALL policy.
+    """
+
+    def __init__(self, backoff_s=0.5, max_backoff_s=30, stable_s=60,
+                 on_exit=None, cleanup=lambda: None):
+        self.backoff_s = backoff_s
+        self.max_backoff_s = max_backoff_s
+        self.stable_s = stable_s
+        self.on_exit = on_exit
+        self.cleanup = cleanup
+        self.children = []
+        self._lock = threading.RLock()
+        self._restarts = [] # (when, child) pending restarts
+        self._selector = None
+        self._wakeup_r = self._wakeup_w = None
+        self._use_pidfd = True
+        self._thread = None
+        self._stopping = False
+
+    def spawn(self, args, policy=RESTART, name=None, **kwargs):
+        """Start a supervised child process.
+
+        Args:
+            args, kwargs: Passed to subproc.Popen.
+            policy: What to do when the child exits; one of POLICIES.
+            name: Name of the child; defaults to the first argument.
+
+        Returns:
+            The SupervisedChild.
+        """
+        if policy not in POLICIES:
+            raise ValueError("unknown policy %r" % (policy,))
+        if name is None:
+            name = args if isinstance(args, str) else args[0]
+        child = SupervisedChild(name, args, kwargs, policy)
+        with self._lock:
+            self.children.append(child)
+            self._start_child(child)
+        self._wakeup()
+        return child
+
+    def restart_counts(self):
+        """Return a dict mapping each child's name to its restart count."""
+        with self._lock:
+            return dict((child.name, child.restarts) for child in self.children)
+
+    def start(self):
+        """Start watching children in a background thread.
+
+        Raises:
+            RuntimeError: pidfds are not available, and this was not called
+                from the main thread.
+        """
+        if self._thread is not None:
+            return
+        probe = subproc.pidfd_open(_Self())
+        self._use_pidfd = probe is not None
+        if probe is not None:
+            os.close(probe)
+        elif threading.current_thread() is not threading.main_thread():
+            raise RuntimeError("without pidfds, a Supervisor must be started "
+                               "from the main thread, to handle SIGCHLD")
+        self._selector = selectors.DefaultSelector()
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_r, False)
+        os.set_blocking(self._wakeup_w, False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ)
+        if not self._use_pidfd:
+            signal.signal(signal.SIGCHLD, self._on_sigchld)
+        with self._lock:
+            for child in self.children:
+                self._watch(child)
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="pyptlib-supervisor")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop watching children. The children themselves keep running."""
+        if self._thread is None:
+            return
+        self._stopping = True
+        self._wakeup()
+        self._thread.join()
+        self._thread = None
+        if not self._use_pidfd:
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        with self._lock:
+            for child in self.children:
+                self._unwatch(child)
+            self._restarts = []
+        self._selector.close()
+        wakeup_r, wakeup_w = self._wakeup_r, self._wakeup_w
+        self._wakeup_r = self._wakeup_w = None
+        os.close(wakeup_r)
+        os.close(wakeup_w)
+
+    def _start_child(self, child):
+        child.proc = subproc.Popen(child.args, **child.kwargs)
+        child._started_at = time.monotonic()
+        if self._thread is not None:
+            self._watch(child)
+
+    def _watch(self, child):
+        if not self._use_pidfd or child._pidfd is not None or child.proc is None:
+            return
+        child._pidfd = subproc.pidfd_open(child.proc)
+        if child._pidfd is None:
+            # already exited and reaped by someone else
+            self._wakeup()
+        else:
+            self._selector.register(child._pidfd, selectors.EVENT_READ, child)
+
+    def _unwatch(self, child):
+        if child._pidfd is not None:
+            self._selector.unregister(child._pidfd)
+            os.close(child._pidfd)
+            child._pidfd = None
+
+    def _on_sigchld(self, signum, sframe):
+        self._wakeup()
+
+    def _wakeup(self):
+        if self._wakeup_w is not None:
+            try:
+                os.write(self._wakeup_w, b"\0")
+            except OSError:
+                pass # pipe full, so a wakeup is pending anyway
+
+    def _run(self):
+        while not self._stopping:
+            with self._lock:
+                timeout = None
+                if self._restarts:
+                    timeout = max(min(when for when, _ in self._restarts) - time.monotonic(), 0)
+            events = self._selector.select(timeout)
+            if self._stopping:
+                break
+            with self._lock:
+                for key, _ in events:
+                    if key.fileobj == self._wakeup_r:
+                        self._drain_wakeup()
+                        # without a pidfd, we don't know which child exited
+                        for child in self.children:
+                            if child._pidfd is None:
+                                self._check(child)
+                    else:
+                        self._check(key.data)
+                self._run_restarts()
+
+    def _drain_wakeup(self):
+        try:
+            while os.read(self._wakeup_r, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _check(self, child):
+        proc = child.proc
+        if proc is None:
+            return
+        if child._pidfd is not None:
+            # the pidfd is readable, so the child is dead; wait() only blocks
+            # while another thread is busy reaping it
+            returncode = proc.wait()
+        else:
+            returncode = proc.poll()
+        if returncode is None:
+            return
+        self._unwatch(child)
+        child.proc = None
+        child.returncodes.append(returncode)
+        try:
+            subproc._CHILD_PROCS.remove(proc)
+        except ValueError:
+            pass
+        if self.on_exit is not None:
+            self.on_exit(child, returncode)
+        self._apply_policy(child, returncode)
+
+    def _apply_policy(self, child, returncode):
+        if subproc.is_shutting_down() or self._stopping:
+            return
+        if child.policy == RESTART:
+            if time.monotonic() - child._started_at >= self.stable_s:
+                child._failures = 0
+            self._schedule_restart(child)
+        elif child.policy == KILLALL:
+            # run in its own thread, so we keep reaping children meanwhile
+            t = threading.Thread(target=subproc.killall, args=(self.cleanup,))
+            t.daemon = True
+            t.start()
+
+    def _schedule_restart(self, child):
+        delay = min(self.backoff_s * (2 ** child._failures), self.max_backoff_s)
+        child._failures += 1
+        self._restarts.append((time.monotonic() + delay, child))
+
+    def _run_restarts(self):
+        now = time.monotonic()
+        due = [child for when, child in self._restarts if when <= now]
+        self._restarts = [(when, child) for when, child in self._restarts if when > now]
+        for child in due:
+            if subproc.is_shutting_down() or self._stopping:
+                return
+            try:
+                self._start_child(child)
+            except OSError as e:
+                # don't let it kill the supervisor thread; try again later
+                child.start_errors.append(e)
+                self._schedule_restart(child)
+                continue
+            child.restarts += 1
+
+
+class _Self(object):
+    """Stand-in for a Popen, used to probe for pidfd support."""
+    pid = os.getpid()
+    returncode = None
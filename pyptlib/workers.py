@@ -0,0 +1,236 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Worker pools, for serving a server transport on several cores.
+
+A :class:`WorkerPool` starts several worker processes that all accept
+connections for the same transport on the same address, each through its
+own SO_REUSEPORT listener; the kernel spreads incoming connections across
+them. The parent keeps the address reserved for the lifetime of the pool,
+and reports a single SMETHOD line for it, once a worker is listening.
+
+Workers are started with a :class:`pyptlib.util.supervisor.Supervisor`, so
+they are restarted when they die, and are terminated by
+:func:`pyptlib.util.subproc.killall` and
+:func:`pyptlib.util.subproc.auto_killall` like any other child.
+
+:func:`WorkerPool.launch` may be used as a launcher for
+:func:`pyptlib.server.ServerTransportPlugin.launchTransports`, which runs
+launchers in other threads. Where pidfds are not available (Linux before
+5.3, and other platforms), the supervisor then has to be started from the
+main thread first::
+
+    pool.supervisor.start()
+    plugin.launchTransports({"obfs4": pool.launch})
+
+A worker process gets its listening socket with :func:`workerListener`.
+"""
+
+import os
+import selectors
+import socket
+
+from pyptlib.config import EnvError
+from pyptlib.util import parse_addr_spec
+from pyptlib.util.supervisor import Supervisor, RESTART
+
+WORKER_TRANSPORT_ENV = 'PYPTLIB_WORKER_TRANSPORT'
+WORKER_LISTEN_ENV = 'PYPTLIB_WORKER_LISTEN'
+WORKER_INDEX_ENV = 'PYPTLIB_WORKER_INDEX'
+WORKER_READY_ENV = 'PYPTLIB_WORKER_READY_FD'
+
+
+class WorkerPool(object):
+    """
+    Pool of worker processes serving one transport on one address.
+
+    :var list args: Command line of a worker, passed to subproc.Popen.
+    :var int numWorkers: Number of workers to run.
+    :var str policy: What to do when a worker exits; one of
+            :data:`pyptlib.util.supervisor.POLICIES`.
+    :var float readyTimeout: Time in seconds that :func:`start` waits for
+            the first worker to listen.
+    :var pyptlib.util.supervisor.Supervisor supervisor: Supervisor of the
+            workers.
+    :var str name: Name of the transport, set by :func:`start`.
+    :var tuple addrport: (addr,port) where the workers accept connections,
+            set by :func:`start`.
+    :var list workers: The :class:`pyptlib.util.supervisor.SupervisedChild`
+            of each worker.
+    """
+
+    def __init__(self, args, numWorkers=None, policy=RESTART, supervisor=None,
+                 readyTimeout=30, **popenArgs):
+        """
+        :param list args: Command line of a worker.
+        :param int numWorkers: Number of workers; defaults to the number of CPUs.
+        :param str policy: What to do when a worker exits.
+        :param supervisor: Supervisor to start the workers with; by default, a
+                new one is created, and started when the pool is.
+        :param float readyTimeout: Time to wait for the first worker to listen.
+        :param popenArgs: Extra keyword arguments to subproc.Popen.
+        """
+        self.args = args
+        self.numWorkers = numWorkers or os.cpu_count() or 1
+        self.policy = policy
+        self.readyTimeout = readyTimeout
+        self.supervisor = supervisor or Supervisor()
+        self.popenArgs = popenArgs
+        self.name = None
+        self.addrport = None
+        self.workers = []
+        self._reserved = None
+
+    def start(self, name, bindaddr):
+        """
+        Reserve the bind address, start the workers, and wait until one of
+        them is listening.
+
+        :param str name: Name of the transport.
+        :param tuple bindaddr: (addr,port) where the transport should accept
+                connections. If the port is 0, a free port is chosen.
+
+        :returns: tuple -- (addr,port) where the workers accept connections.
+        :raises: :class:`ValueError` if SO_REUSEPORT is not supported,
+                :class:`RuntimeError` if the supervisor could not be started
+                from this thread (see the module docs), :class:`TimeoutError`
+                if no worker listened within readyTimeout, or
+                :class:`OSError` if the address could not be bound.
+        """
+        if self._reserved is not None:
+            raise ValueError("worker pool already started")
+        self.supervisor.start()
+        # Bound but not listening, so that it keeps the port for the workers
+        # (even while they are being restarted) without being sent any
+        # connections itself.
+        self._reserved = reusePortSocket(bindaddr)
+        self.name = name
+        self.addrport = self._reserved.getsockname()[:2]
+
+        env = dict(self.popenArgs.get('env') or os.environ)
+        env[WORKER_TRANSPORT_ENV] = name
+        env[WORKER_LISTEN_ENV] = formatAddrPort(self.addrport)
+        # Workers write to this pipe once they listen. Only the first start
+        # of each worker gets it; restarts get the plain arguments.
+        readyR, readyW = os.pipe()
+        try:
+            for i in range(self.numWorkers):
+                self.workers.append(self.supervisor.spawn(
+                    self.args, self.policy, name="%s-%d" % (name, i),
+                    **self._workerArgs(env, i, readyW)))
+            with selectors.DefaultSelector() as selector:
+                selector.register(readyR, selectors.EVENT_READ)
+                if not selector.select(self.readyTimeout):
+                    raise TimeoutError("no worker of %s listening after %ss"
+                                       % (name, self.readyTimeout))
+        finally:
+            for i, worker in enumerate(self.workers):
+                worker.kwargs = self._workerArgs(env, i)
+            os.close(readyR)
+            os.close(readyW)
+        return self.addrport
+
+    def _workerArgs(self, env, index, readyFd=None):
+        """
+        :returns: dict -- Keyword arguments to subproc.Popen for a worker.
+        """
+        popenArgs = dict(self.popenArgs)
+        popenArgs['env'] = dict(env)
+        popenArgs['env'][WORKER_INDEX_ENV] = str(index)
+        if readyFd is not None:
+            popenArgs['env'][WORKER_READY_ENV] = str(readyFd)
+            popenArgs['pass_fds'] = tuple(popenArgs.get('pass_fds', ())) + (readyFd,)
+        return popenArgs
+
+    def launch(self, name, bindaddr):
+        """
+        Launcher for :func:`pyptlib.server.ServerTransportPlugin.launchTransports`;
+        see :func:`start`, and the module docs.
+
+        :returns: tuple -- The arguments to reportMethodSuccess(), after name.
+        """
+        return (self.start(name, bindaddr), None)
+
+    def stop(self):
+        """
+        Stop supervising the workers, and release the bind address.
+
+        The workers themselves are left running; they are terminated by
+        :func:`pyptlib.util.subproc.killall`.
+        """
+        self.supervisor.stop()
+        if self._reserved is not None:
+            self._reserved.close()
+            self._reserved = None
+
+
+def reusePortSocket(addrport):
+    """
+    :returns: socket -- A TCP socket with SO_REUSEPORT set, bound to `addrport`.
+    :raises: :class:`ValueError` if SO_REUSEPORT is not supported.
+    """
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        raise ValueError("SO_REUSEPORT is not supported on this platform")
+    family = socket.AF_INET6 if ':' in addrport[0] else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind(tuple(addrport))
+    except:
+        sock.close()
+        raise
+    return sock
+
+def formatAddrPort(addrport):
+    """
+    :returns: str -- `addrport` as a host:port specification.
+    """
+    addr, port = addrport
+    if ':' in addr:
+        addr = '[%s]' % addr
+    return '%s:%d' % (addr, port)
+
+def workerListener(backlog=128, environ=None):
+    """
+    Get the listening socket of this worker process, in a :class:`WorkerPool`.
+
+    :param int backlog: Backlog of the listening socket.
+    :param dict environ: Environment to read from; defaults to os.environ.
+
+    :returns: tuple -- (name, index, socket): name of the transport, index of
+            this worker in its pool, and a listening socket.
+    :raises: :class:`pyptlib.config.EnvError` if this process was not started
+            by a WorkerPool.
+    """
+    environ = os.environ if environ is None else environ
+    try:
+        name = environ[WORKER_TRANSPORT_ENV]
+        spec = environ[WORKER_LISTEN_ENV]
+        index = int(environ.get(WORKER_INDEX_ENV, 0))
+        addrport = parse_addr_spec(spec)
+    except (KeyError, ValueError) as e:
+        raise EnvError("not started as a pyptlib worker (%s)" % e)
+    sock = reusePortSocket(addrport)
+    try:
+        sock.listen(backlog)
+    except:
+        sock.close()
+        raise
+    _reportReady(environ)
+    return name, index, sock
+
+def _reportReady(environ):
+    """
+    Tell the :class:`WorkerPool` that started us that we are listening.
+    """
+    try:
+        fd = int(environ.pop(WORKER_READY_ENV))
+    except (KeyError, ValueError):
+        return
+    try:
+        os.write(fd, b"\0")
+        os.close(fd)
+    except OSError:
+        pass # the pool no longer waits